@@ -4,6 +4,7 @@ import os
 
 import grpc
 from utils.p4runtime_lib.bmv2 import Bmv2SwitchConnection
+from utils.p4runtime_lib.error_utils import printGrpcError
 from utils.p4runtime_lib.helper import P4InfoHelper
 from utils.p4runtime_lib.switch import ShutdownAllSwitchConnections
 
@@ -57,36 +58,63 @@ def writeProtectedTrafficEntry(p4info_helper: P4InfoHelper,
     table_entry = p4info_helper.buildTableEntry(
         table_name="MyIngress.protected_connections",  
         match_fields={
-            "hdr.ipv4.srcAddr": source_ip,
-            "hdr.ipv4.dstAddr": destination_ip
+            "hdr.ipv4.srcAddr": (source_ip, "255.255.255.255"),
+            "hdr.ipv4.dstAddr": (destination_ip, "255.255.255.255")
         },
+        priority=1,
         action_name="MyIngress.associate_protected_details",
         action_params={
             "connection": connection_id,
             "isPHIngressFlag": int(is_ph_ingress),
             "isPHEgressFlag": int(is_ph_egress),
-            "sessionID": clone_session_id
+            "sessionID": clone_session_id,
+            "protectionMode": 0
         })
     switch.WriteTableEntry(table_entry)
     print(f"Protected pair ({source_ip},{destination_ip}) with ID {connection_id} created on {switch.name}")
     print(f"INGRESS {is_ph_ingress}, EGRESS {is_ph_egress}, CLONE SESSION {clone_session_id}")
 
+def writeHashedProtectedTrafficEntry(p4info_helper: P4InfoHelper,
+                                     switch: Bmv2SwitchConnection,
+                                     source_ip: str,
+                                     destination_ip: str,
+                                     is_ph_ingress: bool,
+                                     is_ph_egress: bool,
+                                     clone_session_id: int = 0) -> None:
+    # the connection slot is crc32(src, dst) on both switches, as in controller/topology.py
+    table_entry = p4info_helper.buildTableEntry(
+        table_name="MyIngress.protected_connections",
+        match_fields={
+            "hdr.ipv4.srcAddr": (source_ip, "255.255.255.255"),
+            "hdr.ipv4.dstAddr": (destination_ip, "255.255.255.255")
+        },
+        priority=1,
+        action_name="MyIngress.associate_hashed_protected_details",
+        action_params={
+            "isPHIngressFlag": int(is_ph_ingress),
+            "isPHEgressFlag": int(is_ph_egress),
+            "sessionID": clone_session_id,
+            "protectionMode": 0
+        })
+    switch.WriteTableEntry(table_entry)
+    print(f"Protected pair ({source_ip},{destination_ip}) with a hashed ID created on {switch.name}")
+    print(f"INGRESS {is_ph_ingress}, EGRESS {is_ph_egress}, CLONE SESSION {clone_session_id}")
+
 def writeCloneSession(p4info_helper: P4InfoHelper, switch: Bmv2SwitchConnection, clone_session_id: int, clone_port: int) -> None:
     replicas = [{"egress_port": clone_port, "instance": 1}]
     clone_entry = p4info_helper.buildCloneSessionEntry(clone_session_id, replicas, 0) # never truncate
     switch.WritePREEntry(clone_entry)
     print(f"Clone session ID {clone_session_id} via Port {clone_port} created on {switch.name}")
 
-def writeRoutingByEgressEntry(p4info_helper: P4InfoHelper, switch: Bmv2SwitchConnection, dst_network: str, prefix_len: int, egress_port: int, src_mac: str, next_hop_mac: str) -> None:
+def writeNextHopEntry(p4info_helper: P4InfoHelper, switch: Bmv2SwitchConnection, egress_port: int, next_hop_mac: str, dst_network: str = "0.0.0.0", prefix_len: int = 0) -> None:
     table_entry = p4info_helper.buildTableEntry(
         table_name="MyEgress.next_hop_table", 
         match_fields={
             "standard_metadata.egress_port": egress_port,
-            "hdr.ipv4.dstAddr": (dst_network, prefix_len)
+            "hdr.ipv4.dstAddr": (dst_network, prefix_len) # /0 on point-to-point links
         },
-        action_name="MyEgress.set_mac",
+        action_name="MyEgress.set_dmac",
         action_params={
-            "srcAddr": src_mac,
             "dstAddr": next_hop_mac
         })
     switch.WriteTableEntry(table_entry)
@@ -129,16 +157,17 @@ def main(p4info_file_path: str, bmv2_file_path: str):
         writeIngressMACEntry(info_help, ingress_switch, mac_addr="08:00:00:00:01:00", ingress_port=1)
 
         writeCloneSession(info_help, ingress_switch, clone_session_id=500, clone_port=2)
-        writeProtectedTrafficEntry(info_help, ingress_switch, 
-                                    source_ip="10.0.1.100", 
-                                    destination_ip="10.0.2.100", 
-                                    connection_id=1, 
-                                    is_ph_ingress=True,  
-                                    is_ph_egress=False,
-                                    clone_session_id=500)
+        writeHashedProtectedTrafficEntry(info_help, ingress_switch,
+                                         source_ip="10.0.1.100",
+                                         destination_ip="10.0.2.100",
+                                         is_ph_ingress=True,
+                                         is_ph_egress=False,
+                                         clone_session_id=500)
         writeWorkingRoutingPathEntry(info_help, ingress_switch, dst_network="10.0.2.0", prefix_len=24, egress_port=3)        
-        writeRoutingByEgressEntry(info_help, ingress_switch, dst_network="10.0.2.0", prefix_len=24, egress_port=3, src_mac="00:00:00:00:01:03", next_hop_mac="00:00:00:00:06:03")
-        writeRoutingByEgressEntry(info_help, ingress_switch, dst_network="10.0.2.0", prefix_len=24, egress_port=2, src_mac="00:00:00:00:01:02", next_hop_mac="00:00:00:00:02:02")
+        writePortMACAddr(info_help, ingress_switch, mac="00:00:00:00:01:03", port=3)
+        writeNextHopEntry(info_help, ingress_switch, egress_port=3, next_hop_mac="00:00:00:00:06:03")
+        writePortMACAddr(info_help, ingress_switch, mac="00:00:00:00:01:02", port=2)
+        writeNextHopEntry(info_help, ingress_switch, egress_port=2, next_hop_mac="00:00:00:00:02:02")
 
        
         ############ PRIMARY ROUTE ############
@@ -146,44 +175,48 @@ def main(p4info_file_path: str, bmv2_file_path: str):
         switch_6 = sw[5]
         writeIngressMACEntry(info_help, switch_6, mac_addr="00:00:00:00:06:03", ingress_port=3)
         writeWorkingRoutingPathEntry(info_help, switch_6, dst_network="10.0.2.0", prefix_len=24, egress_port=2)
-        writeRoutingByEgressEntry(info_help, switch_6, dst_network="10.0.2.0", prefix_len=24, egress_port=2, src_mac="00:00:00:00:06:02", next_hop_mac="00:00:00:00:05:02")
+        writePortMACAddr(info_help, switch_6, mac="00:00:00:00:06:02", port=2)
+        writeNextHopEntry(info_help, switch_6, egress_port=2, next_hop_mac="00:00:00:00:05:02")
 
         # Configure SW 5
         switch_5 = sw[4]
         writeIngressMACEntry(info_help, switch_5, mac_addr="00:00:00:00:05:02", ingress_port=2)
         writeWorkingRoutingPathEntry(info_help, switch_5, dst_network="10.0.2.0", prefix_len=24, egress_port=3)
-        writeRoutingByEgressEntry(info_help, switch_5, dst_network="10.0.2.0", prefix_len=24, egress_port=3, src_mac="00:00:00:00:05:03", next_hop_mac="00:00:00:00:04:03")
+        writePortMACAddr(info_help, switch_5, mac="00:00:00:00:05:03", port=3)
+        writeNextHopEntry(info_help, switch_5, egress_port=3, next_hop_mac="00:00:00:00:04:03")
 
         ############ SECONDARY ROUTE ############
         # Configure SW 2
         switch_2 = sw[1]
         writeIngressMACEntry(info_help, switch_2, mac_addr="00:00:00:00:02:02", ingress_port=2)
         writeWorkingRoutingPathEntry(info_help, switch_2, dst_network="10.0.2.0", prefix_len=24, egress_port=3)
-        writeRoutingByEgressEntry(info_help, switch_2, dst_network="10.0.2.0", prefix_len=24, egress_port=3, src_mac="00:00:00:00:02:03", next_hop_mac="00:00:00:00:03:03")
+        writePortMACAddr(info_help, switch_2, mac="00:00:00:00:02:03", port=3)
+        writeNextHopEntry(info_help, switch_2, egress_port=3, next_hop_mac="00:00:00:00:03:03")
 
         # Configure SW 3
         switch_3 = sw[2]
         writeIngressMACEntry(info_help, switch_3, mac_addr="00:00:00:00:03:03", ingress_port=3)
         writeWorkingRoutingPathEntry(info_help, switch_3, dst_network="10.0.2.0", prefix_len=24, egress_port=2)
-        writeRoutingByEgressEntry(info_help, switch_3, dst_network="10.0.2.0", prefix_len=24, egress_port=2, src_mac="00:00:00:00:03:02", next_hop_mac="00:00:00:00:04:02")
+        writePortMACAddr(info_help, switch_3, mac="00:00:00:00:03:02", port=2)
+        writeNextHopEntry(info_help, switch_3, egress_port=2, next_hop_mac="00:00:00:00:04:02")
 
         ############# EGRESS SWITCH #################
         egress_switch = sw[3]
         writeIngressMACEntry(info_help, egress_switch, mac_addr="00:00:00:00:04:02", ingress_port=2)
         writeIngressMACEntry(info_help, egress_switch, mac_addr="00:00:00:00:04:03", ingress_port=3)
         writeWorkingRoutingPathEntry(info_help, egress_switch, dst_network="10.0.2.0", prefix_len=24, egress_port=1)
-        writeRoutingByEgressEntry(info_help, egress_switch, dst_network="10.0.2.100", prefix_len=32, egress_port=1, src_mac="08:00:00:00:02:00", next_hop_mac="08:00:00:00:02:22")
-        writeRoutingByEgressEntry(info_help, egress_switch, dst_network="10.0.2.101", prefix_len=32, egress_port=1, src_mac="08:00:00:00:02:00", next_hop_mac="08:00:00:00:02:23")
-        writeProtectedTrafficEntry(info_help, egress_switch, 
-                                    source_ip="10.0.1.100", 
-                                    destination_ip="10.0.2.100", 
-                                    connection_id=1, 
-                                    is_ph_ingress=False,  
-                                    is_ph_egress=True)
+        writePortMACAddr(info_help, egress_switch, mac="08:00:00:00:02:00", port=1)
+        writeNextHopEntry(info_help, egress_switch, egress_port=1, next_hop_mac="08:00:00:00:02:22", dst_network="10.0.2.100", prefix_len=32)
+        writeNextHopEntry(info_help, egress_switch, egress_port=1, next_hop_mac="08:00:00:00:02:23", dst_network="10.0.2.101", prefix_len=32)
+        writeHashedProtectedTrafficEntry(info_help, egress_switch,
+                                         source_ip="10.0.1.100",
+                                         destination_ip="10.0.2.100",
+                                         is_ph_ingress=False,
+                                         is_ph_egress=True)
     except KeyboardInterrupt:
         print(" Shutting down.")
     except grpc.RpcError as e:
-        print(e)
+        printGrpcError(e)
 
     ShutdownAllSwitchConnections()
 
@@ -0,0 +1,118 @@
+import dataclasses
+import logging
+from typing import Dict, List, Optional
+
+from p4.v1 import p4runtime_pb2
+
+from utils.p4runtime_lib.switch import buildUpdate
+
+from controller.p4forwardingtables import ProtectionMode
+from controller.p4latency import PathLatencyPoller
+from controller.p4pathselect import ProtectedPathPair
+from controller.p4protectionheader import PathRole, path_register_index
+from controller.p4switch import P4SwitchConnection
+from controller.p4worker import PeriodicWorker
+
+
+class AdaptiveProtection(PeriodicWorker):
+    """
+    Control loop running protected flows in ON_DEMAND mode while their working path is healthy
+    and switching them to ALWAYS_ON (1+1) when it degrades.
+
+    Loss is the share of the packets protected by the PH ingress (ph_protected_sent) that the PH egress
+    did not receive over the working path (ph_path_received), whatever made it over the backup path,
+    so that the backup does not hide a lossy working path in ALWAYS_ON mode. Latency is the average
+    working path latency measured by a PathLatencyPoller (optional).
+    All the mode changes of a round go to the PH ingress in one batched MODIFY.
+    """
+
+    def __init__(self,
+                 ingress_connection: P4SwitchConnection,
+                 egress_connection: P4SwitchConnection,
+                 path_pairs: List[ProtectedPathPair],
+                 latency_poller: Optional[PathLatencyPoller] = None,
+                 interval: float = 1.0,
+                 min_packets: int = 100,
+                 loss_threshold: float = 0.01,
+                 latency_threshold: Optional[float] = None,
+                 healthy_rounds_before_on_demand: int = 10) -> None:
+        super().__init__('adaptive-protection', interval)
+        self.ingress_connection = ingress_connection
+        self.egress_connection = egress_connection
+        self.path_pairs = list(path_pairs)
+        self.latency_poller = latency_poller
+        self.min_packets = min_packets
+        self.loss_threshold = loss_threshold
+        self.latency_threshold = latency_threshold  # us, None to only look at losses
+        self.healthy_rounds_before_on_demand = healthy_rounds_before_on_demand
+        self._previous_sent: Dict[int, int] = dict()
+        self._previous_received: Dict[int, int] = dict()
+        self._healthy_rounds: Dict[int, int] = dict()
+
+    def _is_degraded(self, path_pair: ProtectedPathPair, sent: int, received: int) -> Optional[bool]:
+        """
+        Return whether the working path is degraded from the packets sent and received over it since the
+        previous round, None if there was not enough traffic to tell.
+        """
+        connection_id = path_pair.connection_id
+        sent_delta = sent - self._previous_sent.get(connection_id, sent)
+        received_delta = received - self._previous_received.get(connection_id, received)
+        self._previous_sent[connection_id] = sent
+        self._previous_received[connection_id] = received
+        if sent_delta < 0 or received_delta < 0:
+            return None  # the counters were reset, e.g. by a new pipeline: start over from here
+        if sent_delta < self.min_packets:
+            return None
+
+        loss = max(sent_delta - received_delta, 0) / sent_delta
+        if loss > self.loss_threshold:
+            logging.info(f'connection {connection_id} lost {loss:.2%} of its packets')
+            return True
+        if self.latency_poller is not None and self.latency_threshold is not None:
+            latency = self.latency_poller.latest(connection_id, PathRole.WORKING)
+            if latency is not None and latency.avg_latency > self.latency_threshold:
+                logging.info(f'connection {connection_id} working path latency is {latency.avg_latency:.0f}us')
+                return True
+        return False
+
+    def adapt(self) -> None:
+        """Run one round of the loop."""
+        sent = self.ingress_connection.read_counter_array("MyIngress.ph_protected_sent")
+        received = self.egress_connection.read_counter_array("MyIngress.ph_path_received")
+
+        updates = list()
+        changes = list()
+        for path_pair in self.path_pairs:
+            connection_id = path_pair.connection_id
+            working_received = received.get(path_register_index(connection_id, PathRole.WORKING), 0)
+            degraded = self._is_degraded(path_pair, sent.get(connection_id, 0), working_received)
+            if degraded is None:
+                continue
+
+            mode = ProtectionMode(path_pair.protect_entry.action_params["protectionMode"])
+            if degraded:
+                self._healthy_rounds[connection_id] = 0
+                new_mode = ProtectionMode.ALWAYS_ON
+            else:
+                self._healthy_rounds[connection_id] = self._healthy_rounds.get(connection_id, 0) + 1
+                healthy = self._healthy_rounds[connection_id] >= self.healthy_rounds_before_on_demand
+                new_mode = ProtectionMode.ON_DEMAND if healthy else mode
+            if new_mode == mode:
+                continue
+
+            protect_entry = dataclasses.replace(
+                path_pair.protect_entry,
+                action_params={**path_pair.protect_entry.action_params, "protectionMode": int(new_mode)})
+            updates.append(buildUpdate(self.ingress_connection.build_table_entry(protect_entry), p4runtime_pb2.Update.MODIFY))
+            changes.append((path_pair, protect_entry))
+
+        if not updates:
+            return
+        self.ingress_connection.write_updates(updates)
+        for path_pair, protect_entry in changes:
+            path_pair.protect_entry = protect_entry
+            logging.warn(f'connection {path_pair.connection_id} protection mode is now '
+                         f'{ProtectionMode(protect_entry.action_params["protectionMode"]).name}')
+
+    def run_round(self) -> None:
+        self.adapt()
@@ -0,0 +1,168 @@
+import logging
+import threading
+from dataclasses import dataclass
+from queue import Queue
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from p4.v1 import p4runtime_pb2
+
+from utils.p4runtime_lib.convert import decodeNum
+from utils.p4runtime_lib.switch import buildUpdate
+
+from controller.p4forwardingtables import SwitchTableEntryFactory, TableEntry, hashed_connection_id
+from controller.p4pathselect import ProtectedPathPair
+from controller.p4switch import P4SwitchConnection
+from controller.p4worker import BackgroundWorker
+
+# per-connection registers of switch_dataplane.p4, cleared when a connection slot is reclaimed
+# so that the next flow using it starts from a clean sequence
+CONNECTION_REGISTERS = [
+    "MyIngress.ph_expected_next_clone_ids",
+    "MyIngress.ph_connection_owners",
+    "MyIngress.ph_last_epochs",
+    "MyIngress.ph_pending_duplicates",
+    "MyIngress.ph_pending_out_of_window",
+    "MyIngress.ph_last_drop_digest",
+]
+
+EntryKey = Tuple[int, int, FrozenSet[Tuple[int, ...]]]
+
+
+def _decode_value(value: bytes) -> int:
+    # the switch may answer with the shortest bytestring of a number, even an empty one for 0
+    return decodeNum(value) if value else 0
+
+
+def _match_key(match: p4runtime_pb2.FieldMatch) -> Tuple[int, ...]:
+    """Field id and numeric values of a match field, whatever the width they are encoded with."""
+    kind = match.WhichOneof('field_match_type')
+    if kind == 'exact':
+        values = [match.exact.value]
+    elif kind == 'ternary':
+        values = [match.ternary.value, match.ternary.mask]
+    elif kind == 'lpm':
+        return match.field_id, _decode_value(match.lpm.value), match.lpm.prefix_len
+    elif kind == 'range':
+        values = [match.range.low, match.range.high]
+    elif kind == 'optional':
+        values = [match.optional.value]
+    else:
+        raise ValueError(f'unsupported match kind {kind} of field {match.field_id}')
+    return (match.field_id, *map(_decode_value, values))
+
+
+def table_entry_key(entry: p4runtime_pb2.TableEntry) -> EntryKey:
+    """Identity of a table entry (table, priority, match), whatever the order and encoding of its match fields."""
+    return entry.table_id, entry.priority, frozenset(map(_match_key, entry.match))
+
+
+@dataclass
+class AgedFlow:
+    """Protected flow installed with an idle timeout, with everything to remove once it stops."""
+
+    path_pair: ProtectedPathPair
+    egress_entry: TableEntry
+
+
+class FlowAging(BackgroundWorker):
+    """
+    Remove the protected flows whose protected_connections entry timed out on the PH ingress:
+    the ingress and egress entries, the clone session and the flow's reference to its connection slot.
+    The slot goes back to the connection_ids pool of the ingress, and its registers are cleared, only once
+    no other live entry (a colliding hashed flow, a prefix entry) maps to it.
+    Idle timeout notifications are taken off the stream channel and handled on a worker thread.
+    """
+
+    def __init__(self,
+                 ingress_connection: P4SwitchConnection,
+                 egress_connection: P4SwitchConnection,
+                 entry_factory: SwitchTableEntryFactory,
+                 on_flow_removed: Optional[Callable[[ProtectedPathPair], None]] = None) -> None:
+        super().__init__('flow-aging')
+        self.ingress_connection = ingress_connection
+        self.egress_connection = egress_connection
+        self.entry_factory = entry_factory
+        self.on_flow_removed = on_flow_removed
+        self._flows: Dict[EntryKey, AgedFlow] = dict()
+        self._timed_out: Queue = Queue()
+        self._lock = threading.Lock()
+
+    def allocate_connection_id(self) -> int:
+        """Connection ID for a new flow protected with get_traffic_protect_entry, released when it times out."""
+        return self.ingress_connection.switch.connection_ids.acquire()
+
+    def reserve_hashed_slot(self, source_ip: str, destination_ip: str) -> int:
+        """Reference the hashed slot of a new flow protected with get_hashed_traffic_protect_entry."""
+        connection_id = hashed_connection_id(source_ip, destination_ip)
+        self.ingress_connection.switch.connection_ids.reserve(connection_id)
+        return connection_id
+
+    def track(self, path_pair: ProtectedPathPair, egress_entry: TableEntry) -> None:
+        """
+        Age a protected flow; its ingress entry must have been written with an idle_timeout_ns, and
+        its connection ID taken from allocate_connection_id or reserve_hashed_slot.
+        """
+        if path_pair.protect_entry.idle_timeout_ns == 0:
+            raise ValueError(f'connection {path_pair.connection_id} is protected without an idle timeout')
+        if self.ingress_connection.switch.connection_ids.references(path_pair.connection_id) == 0:
+            raise ValueError(f'connection {path_pair.connection_id} was not allocated from the pool')
+        key = table_entry_key(self.ingress_connection.build_table_entry(path_pair.protect_entry))
+        with self._lock:
+            self._flows[key] = AgedFlow(path_pair=path_pair, egress_entry=egress_entry)
+
+    def on_idle_timeout(self, notification: p4runtime_pb2.IdleTimeoutNotification) -> None:
+        """Stream handler, runs on the stream reader thread of the ingress connection."""
+        with self._lock:
+            # the switch notifies again until the entry is gone, the flow is queued only once
+            flows = [self._flows.pop(key) for key in map(table_entry_key, notification.table_entry) if key in self._flows]
+        for flow in flows:
+            self._timed_out.put(flow)
+
+    def remove_flow(self, flow: AgedFlow) -> None:
+        path_pair = flow.path_pair
+        connection_id = path_pair.connection_id
+        self.ingress_connection.delete_table_entry(path_pair.protect_entry)
+        self.egress_connection.delete_table_entry(flow.egress_entry)
+        self.ingress_connection.release_clone_session(path_pair.clone_session)
+        if not self.ingress_connection.switch.connection_ids.release(connection_id):
+            logging.warn(f'connection {connection_id} timed out, its slot is still in use')
+        else:
+            self._clear_connection_slot(connection_id)
+            logging.warn(f'connection {connection_id} timed out and was removed')
+
+        if self.on_flow_removed is not None:
+            self.on_flow_removed(path_pair)
+
+    def _clear_connection_slot(self, connection_id: int) -> None:
+        if connection_id in self.ingress_connection.switch.connection_epochs:
+            epoch_entry = self.entry_factory.get_connection_epoch_entry(connection_id, 0)
+            self.ingress_connection.delete_table_entry(epoch_entry)
+            del self.ingress_connection.switch.connection_epochs[connection_id]
+        for switch_connection in (self.ingress_connection, self.egress_connection):
+            p4_api = switch_connection.switch.p4_api
+            switch_connection.write_updates([
+                buildUpdate(p4_api.buildRegisterEntry(register_name, connection_id, 0), p4runtime_pb2.Update.MODIFY)
+                for register_name in CONNECTION_REGISTERS
+            ])
+
+    def tracked(self) -> List[ProtectedPathPair]:
+        with self._lock:
+            return [flow.path_pair for flow in self._flows.values()]
+
+    def start(self) -> None:
+        self.ingress_connection.connection.AddStreamHandler('idle_timeout_notification', self.on_idle_timeout)
+        super().start()
+
+    def stop(self) -> None:
+        self.ingress_connection.connection.RemoveStreamHandler('idle_timeout_notification', self.on_idle_timeout)
+        super().stop()
+
+    def _wake(self) -> None:
+        self._timed_out.put(None)
+
+    def _run(self) -> None:
+        for flow in iter(self._timed_out.get, None):
+            try:
+                self.remove_flow(flow)
+            except Exception as e:
+                logging.error(f'removing connection {flow.path_pair.connection_id} failed: {e}')
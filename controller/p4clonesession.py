@@ -1,7 +1,169 @@
+import asyncio
+import threading
 from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+# how often an asyncio user of a pending clone session checks whether its creator is done
+PENDING_SESSION_POLL_INTERVAL = 0.005
 
 @dataclass
 class CloneSession:
     clone_instance_id: int
     clone_port: int
     clone_session_id: int
+    packet_length_bytes: int = 0  # 0 means never truncate
+
+
+@dataclass
+class MulticastGroup:
+    multicast_group_id: int
+    egress_ports: List[int]
+
+
+class CloneSessionRegistry:
+    """
+    Reference-counted clone sessions of a switch.
+    Flows cloning to the same (egress port, instance, truncation) share one session,
+    which is removed only when its last user releases it.
+    A new session is pending until its creator confirms that the switch acknowledged it:
+    the other users wait for it in wait_written, and take over its creation if the creator aborts.
+    Likewise the last user removing a session keeps its id until the switch acknowledged the delete
+    (confirm_delete); a user acquiring it meanwhile waits, then creates it again or, if the delete
+    failed (abort_delete), finds it still written.
+    """
+
+    def __init__(self, first_session_id: int = 500) -> None:
+        self._sessions: Dict[Tuple[int, int, int], CloneSession] = dict()
+        self._users: Dict[int, int] = dict()
+        self._written: Set[int] = set()  # sessions acknowledged by the switch
+        self._creating: Set[int] = set()  # pending sessions a user is writing
+        self._deleting: Set[int] = set()  # sessions their last user is removing from the switch
+        self._free_session_ids: List[int] = list()
+        self._next_session_id = first_session_id
+        self._changed = threading.Condition()
+
+    def acquire(self,
+                clone_port: int,
+                clone_instance_id: int = 1,
+                packet_length_bytes: int = 0) -> Tuple[CloneSession, bool]:
+        """
+        Take a reference to the session for the given replica; return it and whether the caller has to create it,
+        in which case it writes the session and reports with confirm or abort. Otherwise it calls wait_written.
+        """
+        key = (clone_port, clone_instance_id, packet_length_bytes)
+        with self._changed:
+            session = self._sessions.get(key)
+            created = session is None
+            if created:
+                if self._free_session_ids:
+                    session_id = self._free_session_ids.pop()
+                else:
+                    session_id = self._next_session_id
+                    self._next_session_id += 1
+                session = CloneSession(
+                    clone_instance_id=clone_instance_id,
+                    clone_port=clone_port,
+                    clone_session_id=session_id,
+                    packet_length_bytes=packet_length_bytes)
+                self._sessions[key] = session
+                self._users[session_id] = 0
+                self._creating.add(session_id)
+            self._users[session.clone_session_id] += 1
+            return session, created
+
+    def _claim(self, session: CloneSession) -> Optional[bool]:
+        """True once the session is written, False if the caller has to create it instead, None while another user does."""
+        session_id = session.clone_session_id
+        if session_id in self._written:
+            return True
+        if session_id in self._creating or session_id in self._deleting:
+            return None
+        self._creating.add(session_id)
+        return False
+
+    def wait_written(self, session: CloneSession) -> bool:
+        """Wait until the session is written (True), or until its creator aborted and the caller has to create it (False)."""
+        with self._changed:
+            while True:
+                written = self._claim(session)
+                if written is not None:
+                    return written
+                self._changed.wait()
+
+    async def wait_written_async(self, session: CloneSession) -> bool:
+        """Same as wait_written, sleeping on the event loop instead of blocking it."""
+        while True:
+            with self._changed:
+                written = self._claim(session)
+            if written is not None:
+                return written
+            await asyncio.sleep(PENDING_SESSION_POLL_INTERVAL)
+
+    def confirm(self, session: CloneSession) -> None:
+        """The creator of the session had it acknowledged by the switch."""
+        with self._changed:
+            self._creating.discard(session.clone_session_id)
+            self._written.add(session.clone_session_id)
+            self._changed.notify_all()
+
+    def abort(self, session: CloneSession) -> None:
+        """The creator of the session failed to write it: drop its reference only, a waiting user takes over."""
+        with self._changed:
+            self._creating.discard(session.clone_session_id)
+            if self._drop(session):
+                self._free(session)
+            self._changed.notify_all()
+
+    def release(self, session: CloneSession) -> bool:
+        """
+        Drop one user of the session; return True if it was the last one and the session has to be removed from the switch,
+        in which case the caller deletes it and reports with confirm_delete or abort_delete.
+        """
+        with self._changed:
+            session_id = session.clone_session_id
+            # a session being deleted is freed by confirm_delete once it has no users
+            if not self._drop(session) or session_id in self._deleting:
+                return False
+            if session_id not in self._written:
+                self._free(session)
+                return False
+            self._written.discard(session_id)
+            self._deleting.add(session_id)
+            return True
+
+    def confirm_delete(self, session: CloneSession) -> None:
+        """The switch acknowledged the delete of the session: free its id, unless a new user has to create it again."""
+        with self._changed:
+            self._deleting.discard(session.clone_session_id)
+            if self._users[session.clone_session_id] == 0:
+                self._free(session)
+            self._changed.notify_all()
+
+    def abort_delete(self, session: CloneSession) -> None:
+        """The delete of the session failed: it is still written, and the caller keeps its reference."""
+        with self._changed:
+            self._deleting.discard(session.clone_session_id)
+            self._written.add(session.clone_session_id)
+            self._users[session.clone_session_id] += 1
+            self._changed.notify_all()
+
+    def _drop(self, session: CloneSession) -> bool:
+        key = (session.clone_port, session.clone_instance_id, session.packet_length_bytes)
+        if self._sessions.get(key) != session or self._users[session.clone_session_id] == 0:
+            raise KeyError(f'clone session {session.clone_session_id} is not registered')
+        self._users[session.clone_session_id] -= 1
+        return self._users[session.clone_session_id] == 0
+
+    def _free(self, session: CloneSession) -> None:
+        del self._sessions[(session.clone_port, session.clone_instance_id, session.packet_length_bytes)]
+        del self._users[session.clone_session_id]
+        self._written.discard(session.clone_session_id)
+        self._free_session_ids.append(session.clone_session_id)
+
+    def users(self, session: CloneSession) -> int:
+        with self._changed:
+            return self._users.get(session.clone_session_id, 0)
+
+    def sessions(self) -> List[CloneSession]:
+        with self._changed:
+            return list(self._sessions.values())
@@ -1,5 +1,115 @@
-from typing import Dict, Any
+import ipaddress
+import socket
+import threading
+import zlib
+from typing import Dict, Any, List, Mapping, Optional, Tuple
 from dataclasses import dataclass
+from enum import IntEnum
+
+# must match PH_MAX_NUM_CONNECTIONS in switch_dataplane.p4
+PH_MAX_NUM_CONNECTIONS = 256
+# epochs are carried in the 2 bits of PH_FLAG_EPOCH_MASK
+PH_NUM_EPOCHS = 4
+# DSCP is carried in the upper 6 bits of hdr.ipv4.diffserv, the lower 2 are ECN
+DSCP_MASK = 0xFC
+
+
+def hashed_connection_id(source_ip: str, destination_ip: str) -> int:
+    """Register slot picked by MyIngress.associate_hashed_protected_details for (src, dst)."""
+    flow_key = socket.inet_aton(source_ip) + socket.inet_aton(destination_ip)
+    return zlib.crc32(flow_key) % PH_MAX_NUM_CONNECTIONS
+
+
+def prefix_to_ternary(network: str, prefix_len: int) -> Tuple[str, str]:
+    """Turn an IPv4 prefix into the (value, mask) pair of a ternary match."""
+    prefix = ipaddress.IPv4Network(f'{network}/{prefix_len}', strict=False)
+    return str(prefix.network_address), str(prefix.netmask)
+
+
+def dscp_to_ternary(dscp: int) -> Tuple[int, int]:
+    """Turn a DSCP into the (value, mask) pair of a ternary match on hdr.ipv4.diffserv, ignoring ECN."""
+    if not 0 <= dscp < 64:
+        raise ValueError(f'invalid DSCP {dscp}')
+    return dscp << 2, DSCP_MASK
+
+
+def prefix_pair_priority(source_prefix_len: int, destination_prefix_len: int, class_specific: bool = False) -> int:
+    """
+    Priority giving precedence to the most specific (src, dst) prefix pair,
+    then to the entries of a single traffic class over those matching every class.
+    """
+    return 2 * (source_prefix_len + destination_prefix_len) + 1 + int(class_specific)
+
+
+class Dscp(IntEnum):
+    """Common DSCP values (RFC 4594)"""
+    CS0 = 0   # best effort
+    CS1 = 8   # low-priority data
+    AF11 = 10
+    AF21 = 18
+    AF31 = 26
+    CS4 = 32
+    AF41 = 34
+    CS5 = 40
+    EF = 46   # telephony
+    CS6 = 48  # network control
+
+
+class ConnectionIdPool:
+    """
+    Connection IDs, i.e. slots of the per-connection registers, in use on a PH ingress/egress pair.
+    IDs handed out to flows and the slots of hashed flows share the same registers, hence the same pool.
+    Slots are reference counted: colliding hashed flows, or the flows of a prefix entry, share a slot,
+    whose registers may only be cleared once the last of them is gone.
+    """
+
+    def __init__(self, size: int = PH_MAX_NUM_CONNECTIONS) -> None:
+        self._size = size
+        self._references: Dict[int, int] = dict()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> int:
+        """Return the lowest free ID, with one reference."""
+        with self._lock:
+            for connection_id in range(self._size):
+                if connection_id not in self._references:
+                    self._references[connection_id] = 1
+                    return connection_id
+        raise RuntimeError(f'all {self._size} connection IDs are in use')
+
+    def reserve(self, connection_id: int) -> bool:
+        """Add a reference to a given ID (e.g. a hashed slot); return False if it already had one."""
+        if not 0 <= connection_id < self._size:
+            raise ValueError(f'invalid connection ID {connection_id}')
+        with self._lock:
+            references = self._references.get(connection_id, 0)
+            self._references[connection_id] = references + 1
+            return references == 0
+
+    def release(self, connection_id: int) -> bool:
+        """Drop a reference to an ID; return True if it was the last one, i.e. the slot is free again."""
+        with self._lock:
+            references = self._references.get(connection_id, 0)
+            if references <= 1:
+                self._references.pop(connection_id, None)
+                return True
+            self._references[connection_id] = references - 1
+            return False
+
+    def references(self, connection_id: int) -> int:
+        with self._lock:
+            return self._references.get(connection_id, 0)
+
+    def in_use(self) -> int:
+        with self._lock:
+            return len(self._references)
+
+
+class ProtectionMode(IntEnum):
+    """Protection modes of a protected flow, see PROTECTION_MODE_* in switch_dataplane.p4"""
+    ALWAYS_ON = 0  # 1+1, every packet is cloned
+    ON_DEMAND = 1  # sequenced but not cloned until the controller switches the flow to ALWAYS_ON
+
 
 @dataclass
 class TableEntry:
@@ -7,8 +117,11 @@ class TableEntry:
 
     table_name: str
     match_fields: Dict[str, Any]
-    action_name: str
+    action_name: Optional[str]  # None for entries pointing to an action profile group
     action_params: Dict[str, Any]
+    priority: Optional[int] = None
+    group_id: Optional[int] = None
+    idle_timeout_ns: int = 0  # protected_connections only, 0 means never aged
 
 
 class SwitchTableEntryFactory:
@@ -48,52 +161,247 @@ class SwitchTableEntryFactory:
             action_params=action_params
             )
     
+    def get_backup_routing_entry(self,
+                                 dst_network: str,
+                                 prefix_len: int,
+                                 egress_port: int) -> TableEntry:
+        """Route taken instead of the working one while the working egress port is down."""
+        
+        match_fields = {
+            "hdr.ipv4.dstAddr": (dst_network, prefix_len)
+        }
+        action_params = {
+            "port": egress_port
+        }
+
+        return TableEntry(
+            table_name="MyIngress.backup_routing_path_table",
+            match_fields=match_fields,
+            action_name="MyIngress.reroute",
+            action_params=action_params
+            )
+
+    def get_multipath_routing_entry(self,
+                                    dst_network: str,
+                                    prefix_len: int,
+                                    group_id: int) -> TableEntry:
+        """Route spreading the flows to dst_network over the members of an action profile group."""
+        
+        match_fields = {
+            "hdr.ipv4.dstAddr": (dst_network, prefix_len)
+        }
+
+        return TableEntry(
+            table_name="MyIngress.working_routing_multipath_table",
+            match_fields=match_fields,
+            action_name=None,
+            action_params={},
+            group_id=group_id
+            )
+    
     def get_traffic_protect_entry(self,
                                 source_ip: str,
                                 destination_ip: str, 
                                 connection_id: int, 
                                 is_ph_ingress: bool, 
                                 is_ph_egress: bool, 
-                                clone_session_id: int = 0) -> TableEntry:
+                                clone_session_id: int = 0,
+                                protection_mode: ProtectionMode = ProtectionMode.ALWAYS_ON,
+                                idle_timeout_ns: int = 0) -> TableEntry:
         
         match_fields = {
-            "hdr.ipv4.srcAddr": source_ip,
-            "hdr.ipv4.dstAddr": destination_ip
+            "hdr.ipv4.srcAddr": prefix_to_ternary(source_ip, 32),
+            "hdr.ipv4.dstAddr": prefix_to_ternary(destination_ip, 32)
         }
         action_params = {
             "connection": connection_id,
             "isPHIngressFlag": 1 if is_ph_ingress else 0,
             "isPHEgressFlag": 1 if is_ph_egress else 0,
-            "sessionID": clone_session_id
+            "sessionID": clone_session_id,
+            "protectionMode": int(protection_mode)
         }
 
         return TableEntry(
             table_name="MyIngress.protected_connections",
             match_fields=match_fields,
             action_name="MyIngress.associate_protected_details",
+            action_params=action_params,
+            priority=prefix_pair_priority(32, 32),
+            idle_timeout_ns=idle_timeout_ns
+            )
+
+    def get_hashed_traffic_protect_entry(self,
+                                         source_ip: str,
+                                         destination_ip: str,
+                                         is_ph_ingress: bool,
+                                         is_ph_egress: bool,
+                                         clone_session_id: int = 0,
+                                         protection_mode: ProtectionMode = ProtectionMode.ALWAYS_ON,
+                                         idle_timeout_ns: int = 0) -> TableEntry:
+        
+        return self.get_prefix_protect_entry(
+            source_network=source_ip,
+            source_prefix_len=32,
+            destination_network=destination_ip,
+            destination_prefix_len=32,
+            is_ph_ingress=is_ph_ingress,
+            is_ph_egress=is_ph_egress,
+            clone_session_id=clone_session_id,
+            protection_mode=protection_mode,
+            idle_timeout_ns=idle_timeout_ns
+            )
+
+    def get_prefix_protect_entry(self,
+                                 source_network: str,
+                                 source_prefix_len: int,
+                                 destination_network: str,
+                                 destination_prefix_len: int,
+                                 is_ph_ingress: bool,
+                                 is_ph_egress: bool,
+                                 clone_session_id: int = 0,
+                                 priority: Optional[int] = None,
+                                 protection_mode: ProtectionMode = ProtectionMode.ALWAYS_ON,
+                                 dscp: Optional[int] = None,
+                                 idle_timeout_ns: int = 0) -> TableEntry:
+        """
+        Protect every flow between two prefixes with a single entry, or only its packets of class dscp.
+        Each flow still gets its own sequence state through the hashed connection slot.
+        """
+        
+        match_fields = {
+            "hdr.ipv4.srcAddr": prefix_to_ternary(source_network, source_prefix_len),
+            "hdr.ipv4.dstAddr": prefix_to_ternary(destination_network, destination_prefix_len)
+        }
+        if dscp is not None:
+            match_fields["hdr.ipv4.diffserv"] = dscp_to_ternary(dscp)
+        action_params = {
+            "isPHIngressFlag": 1 if is_ph_ingress else 0,
+            "isPHEgressFlag": 1 if is_ph_egress else 0,
+            "sessionID": clone_session_id,
+            "protectionMode": int(protection_mode)
+        }
+        if priority is None:
+            priority = prefix_pair_priority(source_prefix_len, destination_prefix_len, dscp is not None)
+
+        return TableEntry(
+            table_name="MyIngress.protected_connections",
+            match_fields=match_fields,
+            action_name="MyIngress.associate_hashed_protected_details",
+            action_params=action_params,
+            priority=priority,
+            idle_timeout_ns=idle_timeout_ns
+            )
+
+    def get_class_protect_entries(self,
+                                  source_network: str,
+                                  source_prefix_len: int,
+                                  destination_network: str,
+                                  destination_prefix_len: int,
+                                  clone_session_id: int,
+                                  class_policy: Mapping[int, ProtectionMode]) -> List[TableEntry]:
+        """
+        PH ingress entries protecting only the traffic classes of class_policy (DSCP -> mode),
+        the other classes of the prefix pair miss protected_connections and are just routed.
+        The PH egress can keep a single class-agnostic entry for the pair.
+        """
+        return [
+            self.get_prefix_protect_entry(
+                source_network=source_network,
+                source_prefix_len=source_prefix_len,
+                destination_network=destination_network,
+                destination_prefix_len=destination_prefix_len,
+                is_ph_ingress=True,
+                is_ph_egress=False,
+                clone_session_id=clone_session_id,
+                protection_mode=protection_mode,
+                dscp=dscp)
+            for dscp, protection_mode in class_policy.items()
+        ]
+
+    def get_multipath_protect_entry(self,
+                                    source_network: str,
+                                    source_prefix_len: int,
+                                    destination_network: str,
+                                    destination_prefix_len: int,
+                                    multicast_group_id: int,
+                                    priority: Optional[int] = None,
+                                    dscp: Optional[int] = None) -> TableEntry:
+        """PH ingress entry replicating the protected flows, or only their class dscp, through a multicast group (1+N protection)."""
+        
+        match_fields = {
+            "hdr.ipv4.srcAddr": prefix_to_ternary(source_network, source_prefix_len),
+            "hdr.ipv4.dstAddr": prefix_to_ternary(destination_network, destination_prefix_len)
+        }
+        if dscp is not None:
+            match_fields["hdr.ipv4.diffserv"] = dscp_to_ternary(dscp)
+        action_params = {
+            "multicastGroup": multicast_group_id
+        }
+        if priority is None:
+            priority = prefix_pair_priority(source_prefix_len, destination_prefix_len, dscp is not None)
+
+        return TableEntry(
+            table_name="MyIngress.protected_connections",
+            match_fields=match_fields,
+            action_name="MyIngress.associate_multipath_protected_details",
+            action_params=action_params,
+            priority=priority
+            )
+
+    def get_connection_epoch_entry(self,
+                                   connection_id: int,
+                                   epoch: int) -> TableEntry:
+        
+        match_fields = {
+            "meta.connectionId": connection_id
+        }
+        action_params = {
+            "epoch": epoch % PH_NUM_EPOCHS
+        }
+
+        return TableEntry(
+            table_name="MyIngress.ph_connection_epochs",
+            match_fields=match_fields,
+            action_name="MyIngress.set_epoch",
+            action_params=action_params
+            )
+
+    def get_port_mac_entry(self,
+                           egress_port: int,
+                           mac_addr: str) -> TableEntry:
+        
+        match_fields = {
+            "standard_metadata.egress_port": egress_port
+        }
+        action_params = {
+            "mac": mac_addr
+        }
+
+        return TableEntry(
+            table_name="MyEgress.port_mac_table",
+            match_fields=match_fields,
+            action_name="MyEgress.set_smac",
             action_params=action_params
             )
 
-    def get_route_by_egress_entry(self,
-                              dst_network: str, 
-                              prefix_len: int,
-                              egress_port: int,
-                              src_mac: str,
-                              next_hop_mac: str
-                              ) -> TableEntry:
+    def get_next_hop_entry(self,
+                           egress_port: int,
+                           next_hop_mac: str,
+                           dst_network: str = "0.0.0.0",
+                           prefix_len: int = 0) -> TableEntry:
+        """Neighbour reached through egress_port; the default /0 fits point-to-point links."""
         
         match_fields = {
             "standard_metadata.egress_port": egress_port,
             "hdr.ipv4.dstAddr": (dst_network, prefix_len)
         }
         action_params = {
-            "srcAddr": src_mac,
             "dstAddr": next_hop_mac
         }
 
         return TableEntry(
             table_name="MyEgress.next_hop_table",
             match_fields=match_fields,
-            action_name="MyEgress.set_mac",
+            action_name="MyEgress.set_dmac",
             action_params=action_params
             )
\ No newline at end of file
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+
+from controller.p4protectionheader import PathRole, path_register_index
+from controller.p4switch import P4SwitchConnection
+from controller.p4worker import PeriodicWorker
+
+
+def _to_signed(value: int, bitwidth: int) -> int:
+    """Latencies are signed in the data plane, as unsynchronised clocks can give negative offsets."""
+    if value >= 1 << (bitwidth - 1):
+        return value - (1 << bitwidth)
+    return value
+
+
+@dataclass
+class PathLatencySample:
+    """Latency of a path in microseconds; min and max since the switch started, average over the last interval."""
+
+    timestamp: float
+    packets: int
+    min_latency: int
+    avg_latency: float
+    max_latency: int
+
+
+class PathLatencyPoller(PeriodicWorker):
+    """
+    Periodically read the path latency registers of a PH egress switch (build with PH_PATH_LATENCY=1)
+    and turn them into a time series per (connection, path).
+    """
+
+    def __init__(self,
+                 switch_connection: P4SwitchConnection,
+                 connection_ids: List[int],
+                 interval: float = 1.0,
+                 history: int = 3600) -> None:
+        super().__init__(f'latency-{switch_connection.switch.name}', interval)
+        self.switch_connection = switch_connection
+        self.connection_ids = list(connection_ids)
+        self.series: Dict[Tuple[int, PathRole], Deque[PathLatencySample]] = {
+            (connection_id, path): deque(maxlen=history)
+            for connection_id in self.connection_ids
+            for path in PathRole
+        }
+        self._previous: Dict[int, Tuple[int, int]] = dict()  # register index -> (count, sum)
+        self._lock = threading.Lock()
+
+    def poll(self) -> None:
+        now = time.time()
+        counts = self.switch_connection.read_register_array("MyIngress.ph_path_latency_count")
+        sums = self.switch_connection.read_register_array("MyIngress.ph_path_latency_sum")
+        minimums = self.switch_connection.read_register_array("MyIngress.ph_path_latency_min")
+        maximums = self.switch_connection.read_register_array("MyIngress.ph_path_latency_max")
+
+        with self._lock:
+            for (connection_id, path), samples in self.series.items():
+                index = path_register_index(connection_id, path)
+                count, total = counts.get(index, 0), _to_signed(sums.get(index, 0), 64)
+                previous_count, previous_total = self._previous.get(index, (0, 0))
+                self._previous[index] = (count, total)
+                packets = (count - previous_count) % (1 << 32)
+                if packets == 0:
+                    continue
+                samples.append(PathLatencySample(
+                    timestamp=now,
+                    packets=packets,
+                    min_latency=_to_signed(minimums.get(index, 0), 48),
+                    avg_latency=(total - previous_total) / packets,
+                    max_latency=_to_signed(maximums.get(index, 0), 48)))
+
+    def latest(self, connection_id: int, path: PathRole) -> Optional[PathLatencySample]:
+        with self._lock:
+            samples = self.series[(connection_id, path)]
+            return samples[-1] if samples else None
+
+    def history(self, connection_id: int, path: PathRole) -> List[PathLatencySample]:
+        with self._lock:
+            return list(self.series[(connection_id, path)])
+
+    def run_round(self) -> None:
+        self.poll()
@@ -0,0 +1,185 @@
+import logging
+import queue
+import socket
+import struct
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from p4.v1 import p4runtime_pb2
+
+from controller.p4forwardingtables import SwitchTableEntryFactory
+from controller.p4pathselect import ProtectedPathPair, swap_protection_paths
+from controller.p4protectionheader import PathRole
+from controller.p4reroute import FastReroute
+from controller.p4switch import P4SwitchConnection
+from controller.p4worker import PeriodicWorker
+
+# must match PROTOCOL_LATENCY_PROBE in switch_dataplane.p4
+PROTOCOL_LATENCY_PROBE = 0xFD
+_ETHERTYPE_IPV4 = 0x0800
+
+_ETHERNET = struct.Struct('!6s6sH')
+_IPV4 = struct.Struct('!BBHHHBBH4s4s')
+_LATENCY_PROBE = struct.Struct('!IHI6s6s')  # latency_probe_t
+_NO_MAC = b'\x00' * 6
+
+
+def _ipv4_checksum(header: bytes) -> int:
+    total = sum(struct.unpack(f'!{len(header) // 2}H', header))
+    while total > 0xFFFF:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def build_latency_probe(source_ip: str, destination_ip: str, connection_id: int, egress_port: int, sequence: int) -> bytes:
+    """Ethernet/IPv4/latency_probe_t frame; MAC addresses are rewritten by the egress of the PH ingress."""
+    probe = _LATENCY_PROBE.pack(connection_id, egress_port, sequence, _NO_MAC, _NO_MAC)
+    total_length = _IPV4.size + len(probe)
+    fields = [0x45, 0, total_length, sequence & 0xFFFF, 0, 64, PROTOCOL_LATENCY_PROBE, 0,
+              socket.inet_aton(source_ip), socket.inet_aton(destination_ip)]
+    fields[7] = _ipv4_checksum(_IPV4.pack(*fields))
+    header = _IPV4.pack(*fields)
+    return _ETHERNET.pack(_NO_MAC, _NO_MAC, _ETHERTYPE_IPV4) + header + probe
+
+
+def parse_latency_probe(frame: bytes) -> Optional[Tuple[int, int, int, int]]:
+    """Return (connection ID, egress port, sequence, latency in us) of a probe, None for other frames."""
+    if len(frame) < _ETHERNET.size + _IPV4.size + _LATENCY_PROBE.size:
+        return None
+    _, _, ether_type = _ETHERNET.unpack_from(frame)
+    if ether_type != _ETHERTYPE_IPV4:
+        return None
+    version_ihl, *_, protocol, _, _, _ = _IPV4.unpack_from(frame, _ETHERNET.size)
+    if protocol != PROTOCOL_LATENCY_PROBE:
+        return None
+    offset = _ETHERNET.size + (version_ihl & 0x0F) * 4
+    connection_id, egress_port, sequence, departure, arrival = _LATENCY_PROBE.unpack_from(frame, offset)
+    latency = int.from_bytes(arrival, 'big') - int.from_bytes(departure, 'big')
+    return connection_id, egress_port, sequence, latency
+
+
+def percentile(samples: Sequence[int], q: float) -> float:
+    """q-th percentile (0-100) of the samples, by linear interpolation."""
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class LatencyProbeService(PeriodicWorker):
+    """
+    Measure the latency of the working and backup path of protected connections with probes sent by the
+    controller out of the PH ingress and punted back by the PH egress, and make the faster path the working one.
+    Samples are kept per path, i.e. per egress port of the PH ingress, so they survive a role swap.
+    The switch clocks are not synchronised: latencies include a constant offset and only compare with each other.
+    """
+
+    def __init__(self,
+                 ingress_connection: P4SwitchConnection,
+                 egress_connection: P4SwitchConnection,
+                 entry_factory: SwitchTableEntryFactory,
+                 path_pairs: List[ProtectedPathPair],
+                 interval: float = 0.1,
+                 history: int = 1000,
+                 min_samples: int = 50,
+                 selection_percentile: float = 50,
+                 hysteresis: float = 0.1,
+                 rounds_before_swap: int = 3,
+                 fast_reroute: Optional[FastReroute] = None) -> None:
+        super().__init__('latency-probes', interval)
+        self.ingress_connection = ingress_connection
+        self.egress_connection = egress_connection
+        self.entry_factory = entry_factory
+        self.path_pairs = {path_pair.connection_id: path_pair for path_pair in path_pairs}
+        self.history = history
+        self.min_samples = min_samples
+        self.selection_percentile = selection_percentile
+        self.hysteresis = hysteresis  # the backup path must be this much faster to take over
+        self.rounds_before_swap = rounds_before_swap
+        self.fast_reroute = fast_reroute
+        self._samples: Dict[Tuple[int, int], Deque[int]] = dict()  # (connection ID, egress port) -> latencies
+        self._backup_rounds: Dict[int, int] = dict()
+        self._sequence = 0
+        self._rounds = 0
+        self._lock = threading.Lock()
+
+    def _path_port(self, path_pair: ProtectedPathPair, path: PathRole) -> int:
+        return path_pair.working_port if path == PathRole.WORKING else path_pair.backup_port
+
+    def probe(self) -> None:
+        """Send one probe along each path of every connection."""
+        self._sequence = (self._sequence + 1) % (1 << 32)
+        p4_api = self.ingress_connection.switch.p4_api
+        for path_pair in self.path_pairs.values():
+            source_ip = path_pair.protect_entry.match_fields["hdr.ipv4.srcAddr"][0]
+            destination_ip = path_pair.protect_entry.match_fields["hdr.ipv4.dstAddr"][0]
+            for path in PathRole:
+                egress_port = self._path_port(path_pair, path)
+                frame = build_latency_probe(source_ip, destination_ip, path_pair.connection_id, egress_port, self._sequence)
+                try:
+                    self.ingress_connection.connection.PacketOut(
+                        p4_api.buildPacketOut(frame, {"egress_port": egress_port}), block=False)
+                except queue.Full:
+                    logging.debug(f'stream channel of {self.ingress_connection.switch} is full, probe skipped')
+
+    def on_packet_in(self, packet_in: p4runtime_pb2.PacketIn) -> None:
+        """Stream handler, runs on the stream reader thread of the PH egress."""
+        probe = parse_latency_probe(packet_in.payload)
+        if probe is None:
+            return
+        connection_id, egress_port, _, latency = probe
+        with self._lock:
+            samples = self._samples.setdefault((connection_id, egress_port), deque(maxlen=self.history))
+            samples.append(latency)
+
+    def percentiles(self,
+                    connection_id: int,
+                    path: PathRole,
+                    qs: Sequence[float] = (50, 90, 99)) -> Optional[Dict[float, float]]:
+        """Latency percentiles (us) of the current working or backup path of a connection, None without samples."""
+        egress_port = self._path_port(self.path_pairs[connection_id], path)
+        with self._lock:
+            samples = list(self._samples.get((connection_id, egress_port), ()))
+        if not samples:
+            return None
+        return {q: percentile(samples, q) for q in qs}
+
+    def select(self) -> None:
+        """Swap the roles of the paths of the connections whose backup path has been faster for a while."""
+        for connection_id, path_pair in self.path_pairs.items():
+            with self._lock:
+                working = list(self._samples.get((connection_id, path_pair.working_port), ()))
+                backup = list(self._samples.get((connection_id, path_pair.backup_port), ()))
+            if len(working) < self.min_samples or len(backup) < self.min_samples:
+                continue
+
+            working_latency = percentile(working, self.selection_percentile)
+            backup_latency = percentile(backup, self.selection_percentile)
+            # offsets between clocks cancel out, both paths are timed by the same two switches
+            if backup_latency >= working_latency - abs(working_latency) * self.hysteresis:
+                self._backup_rounds[connection_id] = 0
+                continue
+
+            rounds = self._backup_rounds.get(connection_id, 0) + 1
+            self._backup_rounds[connection_id] = rounds
+            if rounds >= self.rounds_before_swap:
+                logging.info(f'connection {connection_id}: backup path p{self.selection_percentile:g} '
+                             f'{backup_latency:.0f}us, working path {working_latency:.0f}us')
+                swap_protection_paths(self.ingress_connection, self.entry_factory, path_pair, self.fast_reroute)
+                self._backup_rounds[connection_id] = 0
+
+    def start(self) -> None:
+        self.egress_connection.connection.AddStreamHandler('packet', self.on_packet_in)
+        super().start()
+
+    def stop(self) -> None:
+        super().stop()
+        self.egress_connection.connection.RemoveStreamHandler('packet', self.on_packet_in)
+
+    def run_round(self) -> None:
+        self.probe()
+        self._rounds += 1
+        if self._rounds % max(int(1 / self.interval), 1) == 0:  # select about once a second
+            self.select()
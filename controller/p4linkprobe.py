@@ -0,0 +1,159 @@
+import functools
+import logging
+import queue
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from p4.v1 import p4runtime_pb2
+
+from controller.p4reroute import Interface, NetworkGraph
+from controller.p4switch import P4SwitchConnection
+from controller.p4worker import BackgroundWorker
+
+# must match ETHERTYPE_LINK_PROBE in switch_dataplane.p4
+ETHERTYPE_LINK_PROBE = 0x88B5
+
+# Ethernet header (broadcast, no source, ETHERTYPE_LINK_PROBE), then the sending switch ID, port and sequence number
+_PROBE_LAYOUT = struct.Struct('!6s6sHHHI')
+_BROADCAST_MAC = b'\xff' * 6
+_NO_MAC = b'\x00' * 6
+
+
+@dataclass
+class LinkEndState:
+    """Liveness of a link in the direction leaving a switch port."""
+
+    last_received: Optional[float] = None  # time.monotonic() of the last probe that made it across
+    last_sequence: int = 0
+    is_up: Optional[bool] = None  # None until the first detection time has elapsed
+
+
+class LinkProbeMonitor(BackgroundWorker):
+    """
+    BFD-like liveness detection of the links between switches: every interval, each end of each link
+    sends a probe out of its port as a packet-out; the switch on the other end punts it back as a packet-in.
+    A link end is down once no probe made it across for multiplier intervals, and up again on the next probe.
+    All the probes are sent, and the verdicts taken, from a single thread sleeping between rounds.
+    """
+
+    def __init__(self,
+                 graph: NetworkGraph,
+                 switch_connections: Dict[str, P4SwitchConnection],
+                 interval: float = 0.03,
+                 multiplier: int = 3,
+                 on_link_state: Optional[Callable[[str, int, bool], None]] = None) -> None:
+        super().__init__('link-probes')
+        self.graph = graph
+        self.switch_connections = switch_connections  # by switch name, e.g. 's1'
+        self.interval = interval
+        self.multiplier = multiplier
+        self.on_link_state = on_link_state  # called with (switch, port, is_up) on every change
+        self.link_ends: List[Interface] = [
+            (switch, port)
+            for switch, ports in graph.links.items() if switch in switch_connections
+            for port, (neighbour, _) in ports.items() if neighbour in switch_connections
+        ]
+        self._states: Dict[Interface, LinkEndState] = {link_end: LinkEndState() for link_end in self.link_ends}
+        self._switch_names = {
+            switch_connection.switch.id: name for name, switch_connection in switch_connections.items()
+        }
+        self._handlers: Dict[str, Callable[[p4runtime_pb2.PacketIn], None]] = dict()
+        self._sequence = 0
+        self._started = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def detection_time(self) -> float:
+        return self.interval * self.multiplier
+
+    def _build_probe(self, switch: str, port: int) -> p4runtime_pb2.PacketOut:
+        switch_connection = self.switch_connections[switch]
+        payload = _PROBE_LAYOUT.pack(
+            _BROADCAST_MAC, _NO_MAC, ETHERTYPE_LINK_PROBE, switch_connection.switch.id, port, self._sequence)
+        return switch_connection.switch.p4_api.buildPacketOut(payload, {"egress_port": port})
+
+    def on_packet_in(self, receiving_switch: str, packet_in: p4runtime_pb2.PacketIn) -> None:
+        """Stream handler, runs on the stream reader thread of the receiving switch."""
+        if len(packet_in.payload) < _PROBE_LAYOUT.size:
+            return
+        _, _, ether_type, switch_id, port, sequence = _PROBE_LAYOUT.unpack_from(packet_in.payload)
+        if ether_type != ETHERTYPE_LINK_PROBE:
+            return  # some other packet-in
+        link_end = (self._switch_names.get(switch_id), port)
+        state = self._states.get(link_end)
+        if state is None:
+            return
+        # only a probe that crossed the very link it was sent on proves it alive, not one rewired or forged
+        p4_api = self.switch_connections[receiving_switch].switch.p4_api
+        ingress_port = p4_api.get_packet_in_metadata(packet_in).get("ingress_port")
+        if self.graph.links[link_end[0]].get(port) != (receiving_switch, ingress_port):
+            logging.debug(f'probe from {link_end[0]} port {port} received on {receiving_switch} port {ingress_port}, ignored')
+            return
+        with self._lock:
+            state.last_received = time.monotonic()
+            state.last_sequence = sequence
+
+    def probe(self) -> None:
+        """Send one probe out of every link end."""
+        self._sequence += 1
+        for switch, port in self.link_ends:
+            try:
+                self.switch_connections[switch].connection.PacketOut(self._build_probe(switch, port), block=False)
+            except queue.Full:
+                logging.debug(f'stream channel of {switch} is full, probe out of port {port} skipped')
+
+    def detect(self) -> None:
+        """Take a verdict on every link end, reporting the changes."""
+        now = time.monotonic()
+        changes: List[Tuple[str, int, bool]] = list()
+        with self._lock:
+            for (switch, port), state in self._states.items():
+                last_received = state.last_received if state.last_received is not None else self._started
+                if state.last_received is None and now - self._started < self.detection_time:
+                    continue  # no verdict before a full detection time
+                is_up = now - last_received <= self.detection_time
+                if is_up != state.is_up:
+                    state.is_up = is_up
+                    changes.append((switch, port, is_up))
+
+        for switch, port, is_up in changes:
+            logging.warn(f'link out of {switch} port {port} is {"up" if is_up else "down"}')
+            if self.on_link_state is not None:
+                try:
+                    self.on_link_state(switch, port, is_up)
+                except Exception as e:
+                    logging.error(f'handling link state of {switch} port {port} failed: {e}')
+
+    def link_states(self) -> Dict[Interface, Optional[bool]]:
+        with self._lock:
+            return {link_end: state.is_up for link_end, state in self._states.items()}
+
+    def start(self) -> None:
+        for name, switch_connection in self.switch_connections.items():
+            handler = functools.partial(self.on_packet_in, name)
+            switch_connection.connection.AddStreamHandler('packet', handler)
+            self._handlers[name] = handler
+        super().start()
+
+    def stop(self) -> None:
+        super().stop()
+        for name, handler in self._handlers.items():
+            self.switch_connections[name].connection.RemoveStreamHandler('packet', handler)
+        self._handlers.clear()
+
+    def _run(self) -> None:
+        self._started = time.monotonic()
+        next_round = self._started
+        # sleep until the next round rather than a fixed interval, so that the rounds do not drift
+        while not self._stopped.wait(max(next_round - time.monotonic(), 0)):
+            try:
+                self.probe()
+                self.detect()
+            except Exception as e:
+                logging.error(f'link probing round failed: {e}')
+            next_round += self.interval
+            if next_round < time.monotonic():  # fell behind, skip the missed rounds
+                next_round = time.monotonic() + self.interval
@@ -0,0 +1,127 @@
+import dataclasses
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from p4.v1 import p4runtime_pb2
+
+from utils.p4runtime_lib.switch import buildUpdate
+
+from controller.p4clonesession import CloneSession
+from controller.p4forwardingtables import SwitchTableEntryFactory, TableEntry
+from controller.p4protectionheader import PathRole, path_register_index
+from controller.p4reroute import FastReroute
+from controller.p4switch import P4SwitchConnection
+from controller.p4worker import PeriodicWorker
+
+
+@dataclass
+class ProtectedPathPair:
+    """Working and backup path of a protected connection, as programmed on its PH ingress switch."""
+
+    connection_id: int
+    dst_network: str
+    prefix_len: int
+    working_port: int
+    backup_port: int
+    protect_entry: TableEntry  # protected_connections entry referencing the clone session
+    clone_session: CloneSession
+
+
+def swap_protection_paths(ingress_connection: P4SwitchConnection,
+                          entry_factory: SwitchTableEntryFactory,
+                          path_pair: ProtectedPathPair,
+                          fast_reroute: Optional[FastReroute] = None) -> None:
+    """
+    Make the backup path the working one and vice versa: route over the backup port
+    and clone onto the former working port, in a single batched Write.
+    The working route is per destination prefix, so all traffic towards it moves along,
+    and so does the backup route of fast_reroute, if any, protecting it.
+    """
+    clone_session = ingress_connection.acquire_clone_session(
+        clone_port=path_pair.working_port,
+        clone_instance_id=path_pair.clone_session.clone_instance_id,
+        packet_length_bytes=path_pair.clone_session.packet_length_bytes)
+    working_route = entry_factory.get_routing_entry(
+        dst_network=path_pair.dst_network,
+        prefix_len=path_pair.prefix_len,
+        egress_port=path_pair.backup_port)
+    protect_entry = dataclasses.replace(
+        path_pair.protect_entry,
+        action_params={**path_pair.protect_entry.action_params, "sessionID": clone_session.clone_session_id})
+
+    try:
+        ingress_connection.write_updates([
+            buildUpdate(ingress_connection.build_table_entry(working_route), p4runtime_pb2.Update.MODIFY),
+            buildUpdate(ingress_connection.build_table_entry(protect_entry), p4runtime_pb2.Update.MODIFY),
+        ])
+    except Exception:
+        ingress_connection.release_clone_session(clone_session)
+        raise
+    ingress_connection.release_clone_session(path_pair.clone_session)
+
+    logging.warn(f'connection {path_pair.connection_id} now works over port {path_pair.backup_port} '
+                 f'and is protected over port {path_pair.working_port} on {ingress_connection.switch}')
+    path_pair.working_port, path_pair.backup_port = path_pair.backup_port, path_pair.working_port
+    path_pair.protect_entry = protect_entry
+    path_pair.clone_session = clone_session
+    if fast_reroute is not None:
+        fast_reroute.update_backup_route(entry_factory, ingress_connection.switch.name,
+                                         path_pair.dst_network, path_pair.prefix_len, path_pair.working_port)
+
+
+class PathSelector(PeriodicWorker):
+    """
+    Control loop promoting the backup path to working path when it consistently delivers
+    the first copy of the packets, as counted by ph_path_wins on the PH egress switch.
+    """
+
+    def __init__(self,
+                 ingress_connection: P4SwitchConnection,
+                 egress_connection: P4SwitchConnection,
+                 entry_factory: SwitchTableEntryFactory,
+                 path_pairs: List[ProtectedPathPair],
+                 interval: float = 5.0,
+                 min_packets: int = 100,
+                 backup_win_ratio: float = 0.8,
+                 rounds_before_swap: int = 3,
+                 fast_reroute: Optional[FastReroute] = None) -> None:
+        super().__init__('path-selector', interval)
+        self.ingress_connection = ingress_connection
+        self.egress_connection = egress_connection
+        self.entry_factory = entry_factory
+        self.path_pairs = list(path_pairs)
+        self.min_packets = min_packets
+        self.backup_win_ratio = backup_win_ratio
+        self.rounds_before_swap = rounds_before_swap
+        self.fast_reroute = fast_reroute
+        self._previous_wins: Dict[int, int] = dict()
+        self._backup_rounds: Dict[int, int] = dict()
+
+    def select(self) -> None:
+        """Run one round of the loop: compare the wins of both paths since the previous round."""
+        wins = self.egress_connection.read_counter_array("MyIngress.ph_path_wins")
+        for path_pair in self.path_pairs:
+            round_wins = dict()
+            for path in PathRole:
+                index = path_register_index(path_pair.connection_id, path)
+                round_wins[path] = wins.get(index, 0) - self._previous_wins.get(index, 0)
+                self._previous_wins[index] = wins.get(index, 0)
+            if round_wins[PathRole.WORKING] < 0 or round_wins[PathRole.BACKUP] < 0:
+                continue  # the counters were reset, e.g. by a new pipeline: start over from here
+
+            total = round_wins[PathRole.WORKING] + round_wins[PathRole.BACKUP]
+            if total < self.min_packets:
+                continue
+            if round_wins[PathRole.BACKUP] / total < self.backup_win_ratio:
+                self._backup_rounds[path_pair.connection_id] = 0
+                continue
+
+            rounds = self._backup_rounds.get(path_pair.connection_id, 0) + 1
+            self._backup_rounds[path_pair.connection_id] = rounds
+            if rounds >= self.rounds_before_swap:
+                swap_protection_paths(self.ingress_connection, self.entry_factory, path_pair, self.fast_reroute)
+                self._backup_rounds[path_pair.connection_id] = 0
+
+    def run_round(self) -> None:
+        self.select()
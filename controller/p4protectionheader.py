@@ -0,0 +1,79 @@
+import struct
+from dataclasses import dataclass
+from enum import Enum, IntEnum
+from typing import Optional
+
+# IP protocol number announcing a Protection Header after IPv4
+PROTOCOL_PROTECTION_HEADER = 0xFA
+
+# Protection Header flags, see switch_dataplane.p4
+PH_FLAG_EPOCH_MASK = 0x03
+PH_FLAG_BACKUP_PATH = 0x04
+PH_FLAG_TIMESTAMP = 0x08
+
+# must match PH_NUM_PATHS in switch_dataplane.p4
+PH_NUM_PATHS = 2
+
+
+class HeaderFormat(str, Enum):
+    """Wire formats of the Protection Header, see switch_dataplane.p4"""
+    STANDARD = 'standard'  # 32-bit clone ID, 6 bytes
+    COMPACT = 'compact'    # 16-bit clone ID, 4 bytes (PH_COMPACT_HEADER)
+
+
+class PathRole(IntEnum):
+    """Path a protected copy travelled on, as told by PH_FLAG_BACKUP_PATH"""
+    WORKING = 0
+    BACKUP = 1
+
+
+def path_register_index(connection_id: int, path: PathRole) -> int:
+    """Index of the per-path registers and counters of a connection."""
+    return connection_id * PH_NUM_PATHS + path
+
+
+_HEADER_LAYOUTS = {
+    HeaderFormat.STANDARD: struct.Struct('!IBB'),
+    HeaderFormat.COMPACT: struct.Struct('!HBB'),
+}
+
+# 48-bit timestamp following the PH when PH_FLAG_TIMESTAMP is set
+_TIMESTAMP_LENGTH = 6
+
+
+def header_length(header_format: HeaderFormat) -> int:
+    return _HEADER_LAYOUTS[header_format].size
+
+
+@dataclass
+class ProtectionHeader:
+    """Protection Header as carried between IPv4 and the upper protocol."""
+
+    clone_id: int
+    upper_protocol: int
+    flags: int = 0
+    ingress_timestamp: Optional[int] = None  # us, only with PH_FLAG_TIMESTAMP
+
+    def pack(self, header_format: HeaderFormat = HeaderFormat.STANDARD) -> bytes:
+        flags = self.flags & ~PH_FLAG_TIMESTAMP
+        if self.ingress_timestamp is None:
+            return _HEADER_LAYOUTS[header_format].pack(self.clone_id, self.upper_protocol, flags)
+        header = _HEADER_LAYOUTS[header_format].pack(self.clone_id, self.upper_protocol, flags | PH_FLAG_TIMESTAMP)
+        return header + self.ingress_timestamp.to_bytes(_TIMESTAMP_LENGTH, 'big')
+
+    @classmethod
+    def unpack(cls, data: bytes, header_format: HeaderFormat = HeaderFormat.STANDARD) -> 'ProtectionHeader':
+        layout = _HEADER_LAYOUTS[header_format]
+        clone_id, upper_protocol, flags = layout.unpack_from(data)
+        ingress_timestamp = None
+        if flags & PH_FLAG_TIMESTAMP:
+            ingress_timestamp = int.from_bytes(data[layout.size:layout.size + _TIMESTAMP_LENGTH], 'big')
+        return cls(clone_id=clone_id, upper_protocol=upper_protocol, flags=flags, ingress_timestamp=ingress_timestamp)
+
+    @property
+    def path(self) -> PathRole:
+        return PathRole.BACKUP if self.flags & PH_FLAG_BACKUP_PATH else PathRole.WORKING
+
+    @property
+    def epoch(self) -> int:
+        return self.flags & PH_FLAG_EPOCH_MASK
@@ -0,0 +1,130 @@
+import asyncio
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Iterator, List, Optional, Tuple
+
+# updates per second a switch is sent by default, and how many may go at once after an idle period;
+# simple_switch_grpc applies the writes on the threads forwarding packets
+DEFAULT_WRITE_RATE = 1000.0
+DEFAULT_WRITE_BURST = 200
+
+
+class WritePriority(IntEnum):
+    """Lanes of the write rate limiter, the lower the sooner."""
+
+    FAILOVER = 0  # never held back, e.g. marking a failed link down
+    NORMAL = 1
+    BULK = 2  # provisioning and restores, behind everything else
+
+
+_write_priority: ContextVar[WritePriority] = ContextVar('write_priority', default=WritePriority.NORMAL)
+
+
+@contextmanager
+def write_priority(priority: WritePriority) -> Iterator[None]:
+    """Send the writes of the current thread or task in the priority lane, until the end of the with block."""
+    token = _write_priority.set(priority)
+    try:
+        yield
+    finally:
+        _write_priority.reset(token)
+
+
+def current_write_priority() -> WritePriority:
+    return _write_priority.get()
+
+
+class WriteTokenBucket:
+    """
+    Token bucket limiting the updates written to a switch to rate per second, with bursts of burst updates.
+    Writers wait in priority lanes, first come first served within a lane: a write only goes once no
+    write of a higher lane, or earlier in its lane, is waiting. FAILOVER writes go right away and take
+    their tokens on credit, delaying the writes after them instead.
+    Shared by threads and asyncio tasks; a rate of None disables the limit.
+    """
+
+    def __init__(self, rate: Optional[float] = DEFAULT_WRITE_RATE, burst: int = DEFAULT_WRITE_BURST) -> None:
+        if rate is not None and rate <= 0:
+            raise ValueError(f'the write rate must be positive, got {rate}')
+        if burst < 1:
+            raise ValueError(f'the write burst must be at least 1, got {burst}')
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._waiters: List[Tuple[int, int]] = list()  # (priority, arrival) of the writes being held back
+        self._arrivals = itertools.count()
+        self._changed = threading.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._refilled_at) * self.rate, self.burst)
+        self._refilled_at = now
+
+    def _claim(self, ticket: Tuple[int, int], updates: int) -> float:
+        """Take the tokens of a waiting write if it is its turn; otherwise return how long to wait before trying again."""
+        self._refill()
+        # a write larger than the bucket goes once it is full, and leaves the bucket in debt
+        needed = min(updates, self.burst)
+        if min(self._waiters) == ticket and self._tokens >= needed:
+            self._tokens -= updates
+            self._waiters.remove(ticket)
+            self._changed.notify_all()
+            return 0
+        return max(needed - self._tokens, 1) / self.rate
+
+    def _enter(self, updates: int, priority: WritePriority) -> Optional[Tuple[int, int]]:
+        """Queue a write in its lane; None if it does not have to wait."""
+        with self._changed:
+            if priority == WritePriority.FAILOVER:
+                self._refill()
+                self._tokens -= updates
+                return None
+            ticket = (int(priority), next(self._arrivals))
+            self._waiters.append(ticket)
+            self._changed.notify_all()
+            return ticket
+
+    def _leave(self, ticket: Tuple[int, int]) -> None:
+        with self._changed:
+            if ticket in self._waiters:
+                self._waiters.remove(ticket)
+                self._changed.notify_all()
+
+    def acquire(self, updates: int, priority: Optional[WritePriority] = None) -> None:
+        """Wait until a Write request of updates may be sent, in the lane of the current write_priority by default."""
+        if self.rate is None:
+            return
+        ticket = self._enter(updates, priority if priority is not None else current_write_priority())
+        if ticket is None:
+            return
+        try:
+            with self._changed:
+                while True:
+                    wait = self._claim(ticket, updates)
+                    if wait == 0:
+                        return
+                    self._changed.wait(wait)
+        finally:
+            self._leave(ticket)
+
+    async def acquire_async(self, updates: int, priority: Optional[WritePriority] = None) -> None:
+        """Same as acquire, sleeping on the event loop instead of blocking it."""
+        if self.rate is None:
+            return
+        ticket = self._enter(updates, priority if priority is not None else current_write_priority())
+        if ticket is None:
+            return
+        try:
+            while True:
+                with self._changed:
+                    wait = self._claim(ticket, updates)
+                if wait == 0:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            self._leave(ticket)
@@ -0,0 +1,176 @@
+import ipaddress
+import json
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from controller.p4forwardingtables import SwitchTableEntryFactory, TableEntry
+from controller.p4ratelimit import WritePriority, write_priority
+from controller.p4switch import P4SwitchConnection
+
+# (switch or host name, port), hosts having a single unnamed port 0
+Interface = Tuple[str, int]
+
+
+def _parse_interface(interface: str) -> Interface:
+    """'s1-p2' -> ('s1', 2), 'h1' -> ('h1', 0)"""
+    if '-p' in interface:
+        node, port = interface.split('-p')
+        return node, int(port)
+    return interface, 0
+
+
+@dataclass
+class NetworkGraph:
+    """Links and host networks of a mininet topology file."""
+
+    switches: Set[str] = field(default_factory=set)
+    links: Dict[str, Dict[int, Interface]] = field(default_factory=dict)  # node -> port -> neighbour interface
+    host_networks: Dict[str, str] = field(default_factory=dict)  # 'network/len' -> switch the host hangs off
+
+    @classmethod
+    def from_topology_file(cls, topology_path: str) -> 'NetworkGraph':
+        with open(topology_path) as f:
+            topology = json.load(f)
+
+        graph = cls(switches=set(topology["switches"]))
+        for end_a, end_b in topology["links"]:
+            (node_a, port_a), (node_b, port_b) = _parse_interface(end_a), _parse_interface(end_b)
+            graph.links.setdefault(node_a, dict())[port_a] = (node_b, port_b)
+            graph.links.setdefault(node_b, dict())[port_b] = (node_a, port_a)
+
+        for host, host_info in topology["hosts"].items():
+            network = ipaddress.IPv4Interface(host_info["ip"]).network
+            switch, _ = graph.links[host][0]
+            graph.host_networks[str(network)] = switch
+        return graph
+
+    def distances(self, destination: str) -> Dict[str, int]:
+        """Hop count of every switch to the destination switch."""
+        distances = {destination: 0}
+        queue = deque([destination])
+        while queue:
+            node = queue.popleft()
+            for neighbour, _ in self.links.get(node, dict()).values():
+                if neighbour in self.switches and neighbour not in distances:  # hosts do not forward
+                    distances[neighbour] = distances[node] + 1
+                    queue.append(neighbour)
+        return distances
+
+    def backup_port(self, switch: str, working_port: int, destination: str) -> Optional[int]:
+        """
+        Port of a loop-free alternate (RFC 5286) towards destination when the link at working_port fails:
+        a neighbour closer to the destination than going back through this switch, so that it does not
+        send the packets back. None if there is none.
+        """
+        distances = self.distances(destination)
+        if switch not in distances:
+            return None
+
+        best_port, best_distance = None, None
+        for port, (neighbour, _) in self.links[switch].items():
+            if port == working_port or neighbour not in distances:
+                continue
+            # RFC 5286 inequality 1, D(N,D) < D(N,S) + D(S,D) with D(N,S) = 1: a neighbour whose shortest path
+            # may run back through this switch is at 1 + distances[switch]; neighbours at the same distance
+            # as this switch, or closer, are loop-free
+            neighbour_distance = distances[neighbour]
+            if neighbour_distance >= 1 + distances[switch]:
+                continue
+            if best_distance is None or neighbour_distance < best_distance:
+                best_port, best_distance = port, neighbour_distance
+        return best_port
+
+
+def precompute_backup_route(graph: NetworkGraph,
+                            entry_factory: SwitchTableEntryFactory,
+                            switch: str,
+                            dst_network: str,
+                            prefix_len: int,
+                            working_port: int) -> Optional[TableEntry]:
+    """Backup routing entry of a switch for its working route to dst_network/prefix_len, None if it has none."""
+    destination = graph.host_networks.get(f'{dst_network}/{prefix_len}')
+    if destination is None or destination == switch:
+        return None  # the destination hosts hang off this switch, there is no alternate
+    backup_port = graph.backup_port(switch, working_port, destination)
+    if backup_port is None:
+        logging.warn(f'no loop-free backup route to {dst_network}/{prefix_len} from {switch} port {working_port}')
+        return None
+    return entry_factory.get_backup_routing_entry(dst_network, prefix_len, backup_port)
+
+
+def precompute_backup_routes(graph: NetworkGraph,
+                             entry_factory: SwitchTableEntryFactory,
+                             switch: str,
+                             working_routes: Dict[Tuple[str, int], int]) -> List[TableEntry]:
+    """Backup routing entries of a switch, for its working routes given as (network, prefix length) -> egress port."""
+    backup_routes = list()
+    for (dst_network, prefix_len), working_port in working_routes.items():
+        backup_route = precompute_backup_route(graph, entry_factory, switch, dst_network, prefix_len, working_port)
+        if backup_route is not None:
+            backup_routes.append(backup_route)
+    return backup_routes
+
+
+class FastReroute:
+    """
+    Failover of the pre-installed backup routes: a link direction going down is one ports_down write on
+    the switch sending into it, which moves its routes over that port to their backup routes.
+    Packets carrying a PH are not rerouted, the other copy of a protected flow covers the failure.
+    The topology configurations do not install the backup routes: the caller does, with
+    install_backup_routes once the switches are configured. A backup route needs nothing else, as the
+    configurations program every link between switches on both ends (see topology.point_to_point_link_entries).
+    A working route moved by the controller, e.g. by swap_protection_paths, gets its backup route
+    recomputed with update_backup_route.
+    """
+
+    def __init__(self, graph: NetworkGraph, switch_connections: Dict[str, P4SwitchConnection]) -> None:
+        self.graph = graph
+        self.switch_connections = switch_connections  # by switch name, e.g. 's1'
+        # installed backup routes, by switch name and (network, prefix length)
+        self.backup_routes: Dict[str, Dict[Tuple[str, int], TableEntry]] = dict()
+
+    def install_backup_routes(self,
+                              entry_factory: SwitchTableEntryFactory,
+                              working_routes: Dict[str, Dict[Tuple[str, int], int]]) -> None:
+        for switch, routes in working_routes.items():
+            for (dst_network, prefix_len), working_port in routes.items():
+                self.update_backup_route(entry_factory, switch, dst_network, prefix_len, working_port)
+
+    def update_backup_route(self,
+                            entry_factory: SwitchTableEntryFactory,
+                            switch: str,
+                            dst_network: str,
+                            prefix_len: int,
+                            working_port: int) -> None:
+        """Install, replace or remove the backup route of switch to dst_network/prefix_len for its working port."""
+        switch_connection = self.switch_connections.get(switch)
+        if switch_connection is None:
+            raise KeyError(f'no connection to {switch}')
+        routes = self.backup_routes.setdefault(switch, dict())
+        installed = routes.get((dst_network, prefix_len))
+        backup_route = precompute_backup_route(self.graph, entry_factory, switch, dst_network, prefix_len, working_port)
+        if backup_route == installed:
+            return
+        if backup_route is None:
+            switch_connection.delete_table_entry(installed)
+            del routes[(dst_network, prefix_len)]
+            return
+        if installed is None:
+            switch_connection.write_table_entry(backup_route)
+        else:
+            switch_connection.modify_table_entry(backup_route)
+        routes[(dst_network, prefix_len)] = backup_route
+
+    def set_link_state(self, switch: str, port: int, is_up: bool) -> None:
+        """
+        Mark the link direction leaving (switch, port) up or down, ahead of any other write, e.g. from the
+        verdicts of a LinkProbeMonitor. Only the sending end stops using the port: the other direction
+        may still work, and its own verdict comes from the probes of the neighbour.
+        """
+        switch_connection = self.switch_connections.get(switch)
+        if switch_connection is None:
+            raise KeyError(f'no connection to {switch}')
+        with write_priority(WritePriority.FAILOVER):
+            switch_connection.write_port_state(port, is_up)
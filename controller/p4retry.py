@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Tuple
+
+import grpc
+from google.rpc import code_pb2
+from p4.v1 import p4runtime_pb2
+
+from utils.p4runtime_lib.error_utils import P4RuntimeErrorFormatException, parseGrpcErrorBinaryDetails
+
+# status of a whole Write RPC that is worth sending again: the switch did not process it, or not yet
+RETRYABLE_STATUS_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.ABORTED,
+}
+# same for the per-update errors of a batch (google.rpc.Code); RESOURCE_EXHAUSTED is not one of them
+# as an update error says the table is full, which sending it again will not change
+RETRYABLE_UPDATE_CODES = {
+    code_pb2.UNAVAILABLE,
+    code_pb2.DEADLINE_EXCEEDED,
+    code_pb2.ABORTED,
+}
+# entities with an INSERT that clashes with an existing one that can be overwritten by a MODIFY instead
+MODIFIABLE_ENTITIES = {'table_entry', 'action_profile_member', 'action_profile_group', 'packet_replication_engine_entry'}
+
+# updates that failed for good, with the reason
+UpdateFailures = List[Tuple[p4runtime_pb2.Update, str]]
+
+
+class WriteFailure(Exception):
+    """Updates of a write that failed permanently, or still failed after every retry."""
+
+    def __init__(self, switch_name: str, failures: UpdateFailures) -> None:
+        self.failures = failures
+        super().__init__(f'{len(failures)} updates failed on {switch_name}, first: {failures[0][1]}')
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with full jitter between the attempts of a Write."""
+
+    max_attempts: int = 5
+    base_delay: float = 0.05
+    max_delay: float = 2.0
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before attempt (1 being the first retry)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+@dataclass
+class ClassifiedWriteError:
+    """Updates of a failed Write request, sorted by what to do with them."""
+
+    transient: List[p4runtime_pb2.Update]  # to send again after a backoff
+    rewritten: List[p4runtime_pb2.Update]  # INSERTs of existing entries turned into MODIFYs, to send right away
+    permanent: UpdateFailures
+    rpc_failed: bool = False  # the RPC itself failed, rather than some updates of a batch the switch processed
+
+    @property
+    def congested(self) -> bool:
+        """Whether the error says the switch is overloaded or unreachable, as opposed to rejecting some updates."""
+        return self.rpc_failed or bool(self.transient)
+
+
+def _as_modify(update: p4runtime_pb2.Update) -> p4runtime_pb2.Update:
+    modify = p4runtime_pb2.Update()
+    modify.CopyFrom(update)
+    modify.type = p4runtime_pb2.Update.MODIFY
+    return modify
+
+
+def classify_write_error(error: grpc.RpcError,
+                         updates: List[p4runtime_pb2.Update],
+                         outcome_unknown: bool = False) -> ClassifiedWriteError:
+    """
+    Sort the updates of a failed Write request from the error of the RPC, or from the per-update
+    errors of the batch when the switch processed it (parseGrpcErrorBinaryDetails).
+    The updates that succeeded are left out. A DELETE that is not found is done.
+    outcome_unknown says the updates are sent again after an RPC that failed without saying which of them
+    the switch applied: an INSERT may then find the entry of that attempt, and becomes a MODIFY.
+    On any other attempt, an INSERT that already exists clashes with another entry and fails for good.
+    """
+    classified = ClassifiedWriteError(transient=list(), rewritten=list(), permanent=list())
+    status_code = error.code()
+    if status_code in RETRYABLE_STATUS_CODES:
+        classified.transient = list(updates)
+        classified.rpc_failed = True
+        return classified
+
+    try:
+        update_errors = parseGrpcErrorBinaryDetails(error)
+    except P4RuntimeErrorFormatException as e:
+        update_errors = None
+        logging.error(f'unreadable Write error details: {e}')
+    if update_errors is None:
+        classified.permanent = [(update, f'{status_code.name}: {error.details()}') for update in updates]
+        classified.rpc_failed = True
+        return classified
+
+    for index, p4_error in update_errors:
+        update = updates[index]
+        code = p4_error.canonical_code
+        if code in RETRYABLE_UPDATE_CODES:
+            classified.transient.append(update)
+        elif (outcome_unknown and code == code_pb2.ALREADY_EXISTS and update.type == p4runtime_pb2.Update.INSERT
+              and update.entity.WhichOneof('entity') in MODIFIABLE_ENTITIES):
+            classified.rewritten.append(_as_modify(update))
+        elif code == code_pb2.NOT_FOUND and update.type == p4runtime_pb2.Update.DELETE:
+            continue
+        else:
+            code_name = code_pb2.Code.Name(code) if code in code_pb2.Code.values() else str(code)
+            classified.permanent.append((update, f'{code_name}: {p4_error.message}'))
+    return classified
+
+
+def write_with_retry(write: Callable[[List[p4runtime_pb2.Update]], None],
+                     updates: List[p4runtime_pb2.Update],
+                     policy: RetryPolicy) -> UpdateFailures:
+    """
+    Write the updates, sending the ones that failed transiently again with backoff, and after a failed RPC
+    the INSERTs of existing entries again as MODIFYs. Returns the updates that failed for good.
+    """
+    failures: UpdateFailures = list()
+    outcome_unknown = False
+    for attempt in range(policy.max_attempts):
+        try:
+            write(updates)
+            return failures
+        except grpc.RpcError as e:
+            classified = classify_write_error(e, updates, outcome_unknown)
+        # once an attempt may have been applied unseen, every later one may find its entries
+        outcome_unknown = outcome_unknown or classified.rpc_failed
+        failures += classified.permanent
+        updates = classified.rewritten + classified.transient
+        if not updates:
+            return failures
+        if attempt + 1 < policy.max_attempts and classified.transient:
+            delay = policy.delay(attempt + 1)
+            logging.warn(f'retrying {len(updates)} updates in {delay:.3f}s, attempt {attempt + 2}/{policy.max_attempts}')
+            time.sleep(delay)
+    return failures + [(update, f'still failing after {policy.max_attempts} attempts') for update in updates]
+
+
+async def write_with_retry_async(write: Callable[[List[p4runtime_pb2.Update]], Awaitable[None]],
+                                 updates: List[p4runtime_pb2.Update],
+                                 policy: RetryPolicy) -> UpdateFailures:
+    """Same as write_with_retry, with a coroutine write."""
+    failures: UpdateFailures = list()
+    outcome_unknown = False
+    for attempt in range(policy.max_attempts):
+        try:
+            await write(updates)
+            return failures
+        except grpc.RpcError as e:
+            classified = classify_write_error(e, updates, outcome_unknown)
+        # once an attempt may have been applied unseen, every later one may find its entries
+        outcome_unknown = outcome_unknown or classified.rpc_failed
+        failures += classified.permanent
+        updates = classified.rewritten + classified.transient
+        if not updates:
+            return failures
+        if attempt + 1 < policy.max_attempts and classified.transient:
+            delay = policy.delay(attempt + 1)
+            logging.warn(f'retrying {len(updates)} updates in {delay:.3f}s, attempt {attempt + 2}/{policy.max_attempts}')
+            await asyncio.sleep(delay)
+    return failures + [(update, f'still failing after {policy.max_attempts} attempts') for update in updates]
@@ -1,22 +1,364 @@
+import functools
 import logging
+import threading
+import time
 from dataclasses import dataclass
-from typing import Dict, Any
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from enum import Enum
 
-from utils.p4runtime_lib.bmv2 import Bmv2SwitchConnection
+import grpc
+
+from utils.p4runtime_lib.bmv2 import AsyncBmv2SwitchConnection, Bmv2SwitchConnection
 from utils.p4runtime_lib.helper import P4InfoHelper
+from utils.p4runtime_lib.convert import decodeNum
+from utils.p4runtime_lib.switch import buildTableEntryUpdate, buildUpdate
+from p4.v1 import p4runtime_pb2
+
+from controller.p4forwardingtables import ConnectionIdPool, TableEntry
+from controller.p4clonesession import CloneSession, CloneSessionRegistry, MulticastGroup
+from controller.p4ratelimit import DEFAULT_WRITE_BURST, DEFAULT_WRITE_RATE, WritePriority, WriteTokenBucket
+from controller.p4retry import (RetryPolicy, UpdateFailures, WriteFailure, classify_write_error, write_with_retry,
+                                write_with_retry_async)
+from controller.p4writecontrol import AdaptiveWriteControl, WriteMetrics
+
+class PipelinedWriteError(WriteFailure):
+    """Updates written by a PipelinedWriter that failed for good, or still failed after every retry."""
+
+
+class PipelinedWriter:
+    """
+    Keep several Write requests in flight on a switch instead of waiting for each reply
+    before sending the next one, so that n requests take about n / window round trips.
+    Updates are coalesced into requests of batch_size updates; both the batch size and the window
+    follow the AdaptiveWriteControl of the switch unless the caller fixes them. Requests go through
+    the write rate limiter of the switch in the priority lane of the writer, BULK by default.
+    In-flight requests may be applied in any order: call barrier() between writes that depend
+    on each other, e.g. a clone session and the protected_connections entry referring to it.
+    Failed updates are classified as the replies come in: the transient ones are sent again with backoff
+    (and, after a failed request, INSERTs of existing entries as MODIFYs) by the writing thread,
+    the others raised by barrier().
+    A writer is fed from a single thread.
+    """
+
+    def __init__(self,
+                 switch_connection: 'P4SwitchConnection',
+                 window: Optional[int] = None,
+                 batch_size: Optional[int] = None,
+                 priority: WritePriority = WritePriority.BULK) -> None:
+        if window is not None and window < 1:
+            raise ValueError(f'the write window must be at least 1, got {window}')
+        self.switch_connection = switch_connection
+        self.control = switch_connection.switch.write_control
+        self.retry_policy = switch_connection.switch.retry_policy
+        self.priority = priority
+        self.failures: UpdateFailures = list()
+        self.written = 0
+        self._window = window
+        self._batch_size = batch_size
+        self._pending: List[p4runtime_pb2.Update] = list()
+        # (due time, attempt, whether an earlier attempt may have been applied unseen, updates)
+        self._retries: List[Tuple[float, int, bool, List[p4runtime_pb2.Update]]] = list()
+        self._in_flight = 0
+        self._idle = threading.Condition()
+
+    @property
+    def window(self) -> int:
+        return self._window if self._window is not None else self.control.window
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size if self._batch_size is not None else self.control.batch_size
+
+    def write_updates(self, updates: List[p4runtime_pb2.Update]) -> None:
+        """Queue the updates, sending a Write request every batch_size updates; flush() sends the rest."""
+        self._resend_due()
+        self._pending.extend(updates)
+        while len(self._pending) >= self.batch_size:
+            batch_size = self.batch_size
+            batch, self._pending = self._pending[:batch_size], self._pending[batch_size:]
+            self._send(batch)
+
+    def write_table_entry(self, entry_info: TableEntry) -> None:
+        entry = self.switch_connection.build_table_entry(entry_info)
+        update_type = p4runtime_pb2.Update.MODIFY if entry.is_default_action else p4runtime_pb2.Update.INSERT
+        self.write_updates([buildUpdate(entry, update_type)])
+
+    def modify_table_entry(self, entry_info: TableEntry) -> None:
+        self.write_updates([buildUpdate(self.switch_connection.build_table_entry(entry_info), p4runtime_pb2.Update.MODIFY)])
+
+    def delete_table_entry(self, entry_info: TableEntry) -> None:
+        self.write_updates([buildUpdate(self.switch_connection.build_table_entry(entry_info), p4runtime_pb2.Update.DELETE)])
+
+    def flush(self) -> None:
+        """Send the queued updates without waiting for a full batch."""
+        if self._pending:
+            batch, self._pending = self._pending, list()
+            self._send(batch)
+
+    def _send(self, updates: List[p4runtime_pb2.Update], attempt: int = 0, outcome_unknown: bool = False) -> None:
+        self.switch_connection.switch.write_limiter.acquire(len(updates), self.priority)
+        # waits for a free slot in the window, which may shrink or grow with every reply
+        with self._idle:
+            self._idle.wait_for(lambda: self._in_flight < self.window)
+            self._in_flight += 1
+        sent_at = time.monotonic()
+        try:
+            future = self.switch_connection.connection.WriteUpdatesFuture(updates)
+        except Exception:
+            self.control.record(len(updates), sent_at, failed=True)
+            self._release()
+            raise
+        future.add_done_callback(functools.partial(self._on_reply, updates, sent_at, attempt, outcome_unknown))
+
+    def _on_reply(self,
+                  updates: List[p4runtime_pb2.Update],
+                  sent_at: float,
+                  attempt: int,
+                  outcome_unknown: bool,
+                  future: grpc.Future) -> None:
+        # runs on a gRPC thread, or on the writing thread if the reply is already there
+        if future.cancelled():
+            self.control.record(len(updates), sent_at, failed=True)
+            with self._idle:
+                self.failures += [(update, 'cancelled') for update in updates]
+            self._release()
+            return
+
+        error = future.exception()
+        if error is None:
+            self.control.record(len(updates), sent_at)
+            with self._idle:
+                self.written += len(updates)
+            self._release()
+            return
 
-from controller.p4forwardingtables import TableEntry
-from controller.p4clonesession import CloneSession
+        classified = classify_write_error(error, updates, outcome_unknown)
+        outcome_unknown = outcome_unknown or classified.rpc_failed
+        # entries that already exist, or are already gone, say nothing about the load of the switch
+        self.control.record(len(updates), sent_at, failed=classified.congested)
+        retried = classified.rewritten + classified.transient
+        with self._idle:
+            self.written += len(updates) - len(retried) - len(classified.permanent)
+            self.failures += classified.permanent
+            if retried and attempt + 1 < self.retry_policy.max_attempts:
+                delay = self.retry_policy.delay(attempt + 1) if classified.transient else 0
+                self._retries.append((time.monotonic() + delay, attempt + 1, outcome_unknown, retried))
+            else:
+                self.failures += [(update, f'still failing after {attempt + 1} attempts') for update in retried]
+        if classified.permanent:
+            logging.error(f'{len(classified.permanent)} pipelined updates failed on {self.switch_connection.switch}, '
+                          f'first: {classified.permanent[0][1]}')
+        self._release()
 
-class P4SwitchConnection:
+    def _resend_due(self) -> None:
+        now = time.monotonic()
+        with self._idle:
+            due = [retry for retry in self._retries if retry[0] <= now]
+            self._retries = [retry for retry in self._retries if retry[0] > now]
+        for _, attempt, outcome_unknown, updates in due:
+            logging.warn(f'retrying {len(updates)} pipelined updates on {self.switch_connection.switch}, attempt {attempt + 1}')
+            self._send(updates, attempt, outcome_unknown)
+
+    def _release(self) -> None:
+        with self._idle:
+            self._in_flight -= 1
+            self._idle.notify_all()
+
+    def barrier(self) -> None:
+        """
+        Send the queued updates and wait for the replies of every request in flight, retries included;
+        raise PipelinedWriteError if any update failed for good.
+        """
+        self.flush()
+        while True:
+            with self._idle:
+                self._idle.wait_for(lambda: self._in_flight == 0)
+                if not self._retries:
+                    failures, self.failures = self.failures, list()
+                    break
+                next_due = min(due for due, _, _, _ in self._retries)
+            time.sleep(max(next_due - time.monotonic(), 0))
+            self._resend_due()
+        if failures:
+            raise PipelinedWriteError(self.switch_connection.switch.name, failures)
+
+    def __enter__(self) -> 'PipelinedWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.barrier()
+            logging.warn(f'wrote {self.written} pipelined updates on {self.switch_connection.switch}')
+            return
+        # already failing: wait for the requests in flight, without hiding the original error
+        with self._idle:
+            self._idle.wait_for(lambda: self._in_flight == 0)
+
+
+class _SwitchConnectionBase:
+    """
+    What P4SwitchConnection and AsyncP4SwitchConnection share: building the updates and keeping the
+    state of the switch in step with them. The subclasses only send the updates, and block or await.
+    """
+
+    switch: 'P4Switch'
+
+    def _reset_pipeline_state(self, p4_api: P4InfoHelper, bmv2_json: str) -> None:
+        self.switch.p4_api = p4_api
+        self.switch.bmv2_json = bmv2_json
+        # a new pipeline comes with empty tables and packet replication engine
+        self.switch.clone_sessions = CloneSessionRegistry()
+        self.switch.multicast_groups = dict()
+        self.switch.connection_epochs = dict()
+        self.switch.connection_ids = ConnectionIdPool()
+        self.switch.working_path_members = set()
+        logging.warning(f'installed pipeline {bmv2_json} on {self.switch}')
+
+    def _record_write(self, batch: List[p4runtime_pb2.Update], sent_at: float, error: Optional[grpc.RpcError] = None) -> None:
+        # entries that already exist, or are already gone, say nothing about the load of the switch
+        failed = error is not None and classify_write_error(error, batch).congested
+        self.switch.write_control.record(len(batch), sent_at, failed=failed)
+
+    def _batches(self, updates: List[p4runtime_pb2.Update], batch_size: Optional[int]) -> Iterator[List[p4runtime_pb2.Update]]:
+        # the adaptive batch size is read again for every batch
+        start = 0
+        while start < len(updates):
+            batch = updates[start:start + (batch_size or self.switch.write_control.batch_size)]
+            yield batch
+            start += len(batch)
+
+    def _raise_failures(self, failures: UpdateFailures) -> None:
+        if failures:
+            raise WriteFailure(self.switch.name, failures)
+
+    def build_table_entry(self, entry_info: TableEntry) -> p4runtime_pb2.TableEntry:
+        return self.switch.p4_api.buildTableEntry(
+            table_name=entry_info.table_name,
+            match_fields=entry_info.match_fields,
+            action_name=entry_info.action_name,
+            action_params=entry_info.action_params,
+            priority=entry_info.priority,
+            group_id=entry_info.group_id,
+            idle_timeout_ns=entry_info.idle_timeout_ns
+        )
+
+    def _table_entry_update(self, entry_info: TableEntry, update_type: Optional[int] = None) -> p4runtime_pb2.Update:
+        """INSERT by default, or MODIFY for a default action."""
+        entry = self.build_table_entry(entry_info)
+        if update_type is None:
+            return buildTableEntryUpdate(entry)
+        return buildUpdate(entry, update_type)
+
+    def _record_connection_epoch(self, connection_id: int, epoch: int) -> None:
+        self.switch.connection_epochs[connection_id] = epoch
+        logging.warning(f'connection {connection_id} moved to epoch {epoch} on {self.switch}')
+
+    def _clone_session_update(self, clone_session: CloneSession) -> p4runtime_pb2.Update:
+        replica = [
+            {
+                "egress_port": clone_session.clone_port, 
+                "instance": clone_session.clone_instance_id
+            }
+        ]
+        clone_entry = self.switch.p4_api.buildCloneSessionEntry(
+            clone_session.clone_session_id, 
+            replica, 
+            clone_session.packet_length_bytes)
+        return buildUpdate(clone_entry)
+
+    def _clone_session_delete_update(self, clone_session: CloneSession) -> p4runtime_pb2.Update:
+        clone_entry = self.switch.p4_api.buildCloneSessionEntry(clone_session.clone_session_id, [])
+        return buildUpdate(clone_entry, p4runtime_pb2.Update.DELETE)
+
+    def _multicast_group_update(self, multicast_group_id: int, egress_ports: List[int]) -> p4runtime_pb2.Update:
+        replicas = [
+            {
+                "egress_port": egress_port,
+                "instance": instance
+            }
+            for instance, egress_port in enumerate(egress_ports, start=1)
+        ]
+        return buildUpdate(self.switch.p4_api.buildMulticastGroupEntry(multicast_group_id, replicas))
+
+    def _record_multicast_group(self, multicast_group_id: int, egress_ports: List[int]) -> MulticastGroup:
+        logging.warning(f'created multicast group {multicast_group_id} over ports {egress_ports} on {self.switch}')
+        multicast_group = MulticastGroup(multicast_group_id=multicast_group_id, egress_ports=list(egress_ports))
+        self.switch.multicast_groups[multicast_group_id] = multicast_group
+        return multicast_group
+
+    def _backup_rate_limit_update(self, connection_id: int, rate: int, burst: int) -> p4runtime_pb2.Update:
+        meter_entry = self.switch.p4_api.buildMeterConfigEntry(
+            "MyEgress.ph_backup_meters",
+            connection_id,
+            cir=rate,
+            cburst=burst,
+            pir=rate,
+            pburst=burst)
+        # meter cells always exist, configuring them is a MODIFY
+        return buildUpdate(meter_entry, p4runtime_pb2.Update.MODIFY)
+
+    def _port_state_update(self, port: int, is_up: bool) -> p4runtime_pb2.Update:
+        register_entry = self.switch.p4_api.buildRegisterEntry("MyIngress.ports_down", port, 0 if is_up else 1)
+        return buildUpdate(register_entry, p4runtime_pb2.Update.MODIFY)
+
+    def _digest_config_update(self,
+                              digest_name: str,
+                              max_timeout_ns: int,
+                              max_list_size: int,
+                              ack_timeout_ns: int) -> p4runtime_pb2.Update:
+        digest_entry = self.switch.p4_api.buildDigestEntry(digest_name, max_timeout_ns, max_list_size, ack_timeout_ns)
+        return buildUpdate(digest_entry)
+
+    def _working_path_member_updates(self, groups: Dict[int, List[int]]) -> Tuple[List[int], List[p4runtime_pb2.Update]]:
+        """Ports of the groups without a member yet, and the updates creating their members."""
+        p4_api = self.switch.p4_api
+        new_ports = sorted({port for ports in groups.values() for port in ports} - self.switch.working_path_members)
+        return new_ports, [
+            buildUpdate(p4_api.buildActionProfileMember(
+                "MyIngress.working_path_selector", port, "MyIngress.forward", {"port": port}))
+            for port in new_ports
+        ]
+
+    def _working_path_group_updates(self, groups: Dict[int, List[int]]) -> List[p4runtime_pb2.Update]:
+        return [
+            buildUpdate(self.switch.p4_api.buildActionProfileGroup(
+                "MyIngress.working_path_selector", group_id, ports, max_size=len(ports)))
+            for group_id, ports in groups.items()
+        ]
+
+    def _register_value(self, register_name: str, index: int, responses: Iterable[p4runtime_pb2.ReadResponse]) -> int:
+        for response in responses:
+            for entity in response.entities:
+                return decodeNum(entity.register_entry.data.bitstring)
+        raise KeyError(f'{register_name}[{index}] not found on {self.switch}')
+
+    @staticmethod
+    def _register_cells(response: p4runtime_pb2.ReadResponse) -> Dict[int, int]:
+        return {
+            entity.register_entry.index.index: decodeNum(entity.register_entry.data.bitstring)
+            for entity in response.entities
+        }
+
+    @staticmethod
+    def _counter_cells(response: p4runtime_pb2.ReadResponse) -> Dict[int, int]:
+        return {entity.counter_entry.index.index: entity.counter_entry.data.packet_count for entity in response.entities}
+
+    def _collisions(self, counts: Dict[int, int]) -> Dict[int, int]:
+        collisions = {index: packets for index, packets in counts.items() if packets > 0}
+        if collisions:
+            logging.warning(f'connection slot collisions on {self.switch}: {collisions}')
+        return collisions
+
+
+class P4SwitchConnection(_SwitchConnectionBase):
     """
     Context manager for the Bmv2SwitchConnection.
     Guarantee that the connection is closed at the end.
     """
 
-    def __init__(self, switch: 'P4Switch') -> None:
+    def __init__(self, switch: 'P4Switch', push_pipeline: bool = True) -> None:
         self.switch = switch
+        self.push_pipeline = push_pipeline
 
         logging.warn(f'connecting to {self.switch}')
         p4_logfile= f'logs/{self.switch.name}-p4runtime-requests.txt'
@@ -29,10 +371,8 @@ class P4SwitchConnection:
     
     def __enter__(self) -> 'P4SwitchConnection':
         self.connection.MasterArbitrationUpdate()
-        self.connection.SetForwardingPipelineConfig(
-            p4info=self.switch.p4_api.p4info,
-            bmv2_json_file_path=self.switch.bmv2_json
-        )
+        if self.push_pipeline:
+            self.install_pipeline(self.switch.p4_api, self.switch.bmv2_json)
         return self
     
     def __exit__(self, exc_type, exc_value, exc_traceback):
@@ -40,29 +380,371 @@ class P4SwitchConnection:
             self.connection.shutdown()
         logging.warn(f'closing connection to {self.switch}')
     
-    def write_table_entry(self, entry_info: TableEntry) -> None:
-        entry = self.switch.p4_api.buildTableEntry(
-            table_name=entry_info.table_name,
-            match_fields=entry_info.match_fields,
-            action_name=entry_info.action_name,
-            action_params=entry_info.action_params
+    def install_pipeline(self, p4_api: P4InfoHelper, bmv2_json: str) -> None:
+        """Push a P4 program to the switch, wiping all of its tables, registers and PRE entries."""
+        self.connection.SetForwardingPipelineConfig(
+            p4info=p4_api.p4info,
+            bmv2_json_file_path=bmv2_json
         )
-        self.connection.WriteTableEntry(entry)
+        self._reset_pipeline_state(p4_api, bmv2_json)
+
+    def _write(self, updates: List[p4runtime_pb2.Update]) -> UpdateFailures:
+        """
+        One Write request, retried as per the RetryPolicy of the switch and timed for its AdaptiveWriteControl.
+        Every attempt waits for the write rate limiter of the switch, in the lane of the current write_priority.
+        """
+        def write(batch: List[p4runtime_pb2.Update]) -> None:
+            self.switch.write_limiter.acquire(len(batch))
+            sent_at = time.monotonic()
+            try:
+                self.connection.WriteUpdates(batch)
+            except grpc.RpcError as e:
+                self._record_write(batch, sent_at, e)
+                raise
+            self._record_write(batch, sent_at)
+
+        return write_with_retry(write, updates, self.switch.retry_policy)
+
+    def _write_update(self, update: p4runtime_pb2.Update) -> None:
+        self._raise_failures(self._write([update]))
+
+    def write_updates(self, updates: List[p4runtime_pb2.Update], batch_size: Optional[int] = None) -> None:
+        """
+        Send the updates in batched Write requests of at most batch_size updates each, one after the other,
+        by default of the batch size the AdaptiveWriteControl of the switch settles on.
+        Updates failing for good do not stop the following batches; they are raised together as a WriteFailure.
+        """
+        failures: UpdateFailures = list()
+        for batch in self._batches(updates, batch_size):
+            failures += self._write(batch)
+        self._raise_failures(failures)
+        logging.warn(f'wrote {len(updates)} updates on {self.switch}')
+
+    def pipelined_writer(self,
+                         window: Optional[int] = None,
+                         batch_size: Optional[int] = None,
+                         priority: WritePriority = WritePriority.BULK) -> PipelinedWriter:
+        """Writer keeping several Write requests in flight; the with block waits for all of them on exit."""
+        return PipelinedWriter(self, window, batch_size, priority)
+
+    def write_table_entry(self, entry_info: TableEntry) -> None:
+        self._write_update(self._table_entry_update(entry_info))
         logging.warn(f'wrote table entry on {self.switch}')
 
+    def modify_table_entry(self, entry_info: TableEntry) -> None:
+        self._write_update(self._table_entry_update(entry_info, p4runtime_pb2.Update.MODIFY))
+        logging.warn(f'modified table entry on {self.switch}')
+
+    def delete_table_entry(self, entry_info: TableEntry) -> None:
+        self._write_update(self._table_entry_update(entry_info, p4runtime_pb2.Update.DELETE))
+        logging.warn(f'deleted table entry on {self.switch}')
+
+    def read_register(self, register_name: str, index: int) -> int:
+        register_id = self.switch.p4_api.get_registers_id(register_name)
+        return self._register_value(register_name, index, self.connection.ReadRegisters(register_id, index))
+
+    def read_register_array(self, register_name: str) -> Dict[int, int]:
+        """Read every cell of a register in a single request."""
+        register_id = self.switch.p4_api.get_registers_id(register_name)
+        cells: Dict[int, int] = dict()
+        for response in self.connection.ReadRegisters(register_id):
+            cells.update(self._register_cells(response))
+        return cells
+
+    def write_connection_epoch(self, epoch_entry: TableEntry, connection_id: int, epoch: int) -> None:
+        """Install or update the sequence epoch the PH ingress stamps on a connection."""
+        if connection_id in self.switch.connection_epochs:
+            self.modify_table_entry(epoch_entry)
+        else:
+            self.write_table_entry(epoch_entry)
+        self._record_connection_epoch(connection_id, epoch)
+
     def wite_protected_flow(self, clone_session: CloneSession) -> None:
-        replica = [
-            {
-                "egress_port": clone_session.clone_port, 
-                "instance": clone_session.clone_instance_id
-            }
-        ]
-        clone_entry = self.switch.p4_api.buildCloneSessionEntry(
-            clone_session.clone_session_id, 
-            replica, 
-            0) # never truncate
-        self.connection.WritePREEntry(clone_entry)
-        logging.warn(f'created clone session {clone_session.clone_instance_id} on {self.switch}')
+        self._write_update(self._clone_session_update(clone_session))
+        logging.warn(f'created clone session {clone_session.clone_session_id} on {self.switch}')
+
+    def acquire_clone_session(self,
+                              clone_port: int,
+                              clone_instance_id: int = 1,
+                              packet_length_bytes: int = 0) -> CloneSession:
+        """Get the clone session shared by all flows with the same replica, creating it on first use."""
+        clone_sessions = self.switch.clone_sessions
+        clone_session, created = clone_sessions.acquire(clone_port, clone_instance_id, packet_length_bytes)
+        try:
+            # a session another flow is still creating may not exist on the switch yet
+            if not created:
+                created = not clone_sessions.wait_written(clone_session)
+        except Exception:
+            self.release_clone_session(clone_session)
+            raise
+        if created:
+            try:
+                self.wite_protected_flow(clone_session)
+            except Exception:
+                clone_sessions.abort(clone_session)
+                raise
+            clone_sessions.confirm(clone_session)
+        else:
+            logging.info(f'reusing clone session {clone_session.clone_session_id} on {self.switch}')
+        return clone_session
+
+    def release_clone_session(self, clone_session: CloneSession) -> None:
+        """
+        Drop a flow from the clone session, removing the session when its last flow is gone.
+        If the removal fails the flow keeps its reference, to release it again.
+        """
+        clone_sessions = self.switch.clone_sessions
+        if not clone_sessions.release(clone_session):
+            return
+        try:
+            self._write_update(self._clone_session_delete_update(clone_session))
+        except Exception:
+            clone_sessions.abort_delete(clone_session)
+            raise
+        clone_sessions.confirm_delete(clone_session)
+        logging.warning(f'removed clone session {clone_session.clone_session_id} on {self.switch}')
+
+    def write_multipath_protected_flow(self, multicast_group_id: int, egress_ports: List[int]) -> MulticastGroup:
+        """Replicate protected packets onto every egress port, one disjoint path each (1+N protection)."""
+        self._write_update(self._multicast_group_update(multicast_group_id, egress_ports))
+        return self._record_multicast_group(multicast_group_id, egress_ports)
+
+    def write_backup_rate_limit(self, connection_id: int, rate: int, burst: int) -> None:
+        """Cap the copies a protected connection sends onto its backup path to rate bytes/s, with bursts of burst bytes."""
+        self._write_update(self._backup_rate_limit_update(connection_id, rate, burst))
+        logging.warn(f'backup rate of connection {connection_id} capped at {rate} B/s on {self.switch}')
+
+    def write_port_state(self, port: int, is_up: bool) -> None:
+        """Mark a port up or down; routes leading to a port that is down switch to their backup route."""
+        self.write_updates([self._port_state_update(port, is_up)])
+        logging.warn(f'port {port} is {"up" if is_up else "down"} on {self.switch}')
+
+    def write_digest_config(self,
+                            digest_name: str,
+                            max_timeout_ns: int = 0,
+                            max_list_size: int = 1,
+                            ack_timeout_ns: int = 0) -> None:
+        """Enable a digest: the switch batches up to max_list_size digests for at most max_timeout_ns."""
+        self.write_updates([self._digest_config_update(digest_name, max_timeout_ns, max_list_size, ack_timeout_ns)])
+        logging.warn(f'enabled digest {digest_name} on {self.switch}')
+
+    def write_working_path_groups(self, groups: Dict[int, List[int]]) -> None:
+        """
+        Program multipath groups of working_routing_multipath_table, group ID -> egress ports.
+        Each port is a member forwarding to it, shared among groups and created on first use.
+        Members are written before the groups referring to them, each in one batched Write.
+        """
+        new_ports, member_updates = self._working_path_member_updates(groups)
+        self.write_updates(member_updates)
+        self.switch.working_path_members.update(new_ports)
+        self.write_updates(self._working_path_group_updates(groups))
+        logging.warn(f'created {len(groups)} multipath groups on {self.switch}')
+
+    def read_counter_array(self, counter_name: str) -> Dict[int, int]:
+        """Read the packet count of every cell of a counter in a single request."""
+        counter_id = self.switch.p4_api.get_counters_id(counter_name)
+        cells: Dict[int, int] = dict()
+        for response in self.connection.ReadCounters(counter_id):
+            cells.update(self._counter_cells(response))
+        return cells
+
+    def read_connection_collisions(self) -> Dict[int, int]:
+        """Return the hash-derived connection slots shared by more than one flow, with the number of colliding packets."""
+        return self._collisions(self.read_counter_array("MyIngress.ph_connection_collisions"))
+
+
+class AsyncP4SwitchConnection(_SwitchConnectionBase):
+    """
+    Async context manager for the AsyncBmv2SwitchConnection, the asyncio counterpart of P4SwitchConnection:
+    the same methods as coroutines, so that one event loop can configure many switches concurrently.
+    The gRPC channel is opened on entering, on the running event loop.
+    """
+
+    def __init__(self, switch: 'P4Switch', push_pipeline: bool = True) -> None:
+        self.switch = switch
+        self.push_pipeline = push_pipeline
+        self.connection = None
+
+    async def __aenter__(self) -> 'AsyncP4SwitchConnection':
+        logging.warn(f'connecting to {self.switch}')
+        p4_logfile= f'logs/{self.switch.name}-p4runtime-requests.txt'
+        logging.info(f'storing p4 logs for {self.switch.name} in {p4_logfile}')
+        self.connection = AsyncBmv2SwitchConnection(
+            name=self.switch.name,
+            address=self.switch.uri,
+            device_id=self.switch.id,
+            proto_dump_file=p4_logfile)
+        try:
+            await self.connection.MasterArbitrationUpdate()
+            if self.push_pipeline:
+                await self.install_pipeline(self.switch.p4_api, self.switch.bmv2_json)
+        except BaseException:
+            await self.connection.shutdown()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        if self.connection is not None:
+            await self.connection.shutdown()
+        logging.warn(f'closing connection to {self.switch}')
+
+    async def install_pipeline(self, p4_api: P4InfoHelper, bmv2_json: str) -> None:
+        """Push a P4 program to the switch, wiping all of its tables, registers and PRE entries."""
+        await self.connection.SetForwardingPipelineConfig(
+            p4info=p4_api.p4info,
+            bmv2_json_file_path=bmv2_json
+        )
+        self._reset_pipeline_state(p4_api, bmv2_json)
+
+    async def _write(self, updates: List[p4runtime_pb2.Update]) -> UpdateFailures:
+        """
+        One Write request, retried as per the RetryPolicy of the switch and timed for its AdaptiveWriteControl.
+        Every attempt waits for the write rate limiter of the switch, in the lane of the current write_priority.
+        """
+        async def write(batch: List[p4runtime_pb2.Update]) -> None:
+            await self.switch.write_limiter.acquire_async(len(batch))
+            sent_at = time.monotonic()
+            try:
+                await self.connection.WriteUpdates(batch)
+            except grpc.RpcError as e:
+                self._record_write(batch, sent_at, e)
+                raise
+            self._record_write(batch, sent_at)
+
+        return await write_with_retry_async(write, updates, self.switch.retry_policy)
+
+    async def _write_update(self, update: p4runtime_pb2.Update) -> None:
+        self._raise_failures(await self._write([update]))
+
+    async def write_updates(self, updates: List[p4runtime_pb2.Update], batch_size: Optional[int] = None) -> None:
+        """Same as P4SwitchConnection.write_updates."""
+        failures: UpdateFailures = list()
+        for batch in self._batches(updates, batch_size):
+            failures += await self._write(batch)
+        self._raise_failures(failures)
+        logging.warn(f'wrote {len(updates)} updates on {self.switch}')
+
+    async def write_table_entry(self, entry_info: TableEntry) -> None:
+        await self._write_update(self._table_entry_update(entry_info))
+        logging.warn(f'wrote table entry on {self.switch}')
+
+    async def modify_table_entry(self, entry_info: TableEntry) -> None:
+        await self._write_update(self._table_entry_update(entry_info, p4runtime_pb2.Update.MODIFY))
+        logging.warn(f'modified table entry on {self.switch}')
+
+    async def delete_table_entry(self, entry_info: TableEntry) -> None:
+        await self._write_update(self._table_entry_update(entry_info, p4runtime_pb2.Update.DELETE))
+        logging.warn(f'deleted table entry on {self.switch}')
+
+    async def read_register(self, register_name: str, index: int) -> int:
+        register_id = self.switch.p4_api.get_registers_id(register_name)
+        responses = [response async for response in self.connection.ReadRegisters(register_id, index)]
+        return self._register_value(register_name, index, responses)
+
+    async def read_register_array(self, register_name: str) -> Dict[int, int]:
+        """Read every cell of a register in a single request."""
+        register_id = self.switch.p4_api.get_registers_id(register_name)
+        cells: Dict[int, int] = dict()
+        async for response in self.connection.ReadRegisters(register_id):
+            cells.update(self._register_cells(response))
+        return cells
+
+    async def write_connection_epoch(self, epoch_entry: TableEntry, connection_id: int, epoch: int) -> None:
+        """Install or update the sequence epoch the PH ingress stamps on a connection."""
+        if connection_id in self.switch.connection_epochs:
+            await self.modify_table_entry(epoch_entry)
+        else:
+            await self.write_table_entry(epoch_entry)
+        self._record_connection_epoch(connection_id, epoch)
+
+    async def wite_protected_flow(self, clone_session: CloneSession) -> None:
+        await self._write_update(self._clone_session_update(clone_session))
+        logging.warn(f'created clone session {clone_session.clone_session_id} on {self.switch}')
+
+    async def acquire_clone_session(self,
+                                    clone_port: int,
+                                    clone_instance_id: int = 1,
+                                    packet_length_bytes: int = 0) -> CloneSession:
+        """Get the clone session shared by all flows with the same replica, creating it on first use."""
+        clone_sessions = self.switch.clone_sessions
+        clone_session, created = clone_sessions.acquire(clone_port, clone_instance_id, packet_length_bytes)
+        try:
+            # a session another flow is still creating may not exist on the switch yet
+            if not created:
+                created = not await clone_sessions.wait_written_async(clone_session)
+        except BaseException:
+            await self.release_clone_session(clone_session)
+            raise
+        if created:
+            try:
+                await self.wite_protected_flow(clone_session)
+            except BaseException:
+                clone_sessions.abort(clone_session)
+                raise
+            clone_sessions.confirm(clone_session)
+        else:
+            logging.info(f'reusing clone session {clone_session.clone_session_id} on {self.switch}')
+        return clone_session
+
+    async def release_clone_session(self, clone_session: CloneSession) -> None:
+        """
+        Drop a flow from the clone session, removing the session when its last flow is gone.
+        If the removal fails the flow keeps its reference, to release it again.
+        """
+        clone_sessions = self.switch.clone_sessions
+        if not clone_sessions.release(clone_session):
+            return
+        try:
+            await self._write_update(self._clone_session_delete_update(clone_session))
+        except BaseException:
+            clone_sessions.abort_delete(clone_session)
+            raise
+        clone_sessions.confirm_delete(clone_session)
+        logging.warning(f'removed clone session {clone_session.clone_session_id} on {self.switch}')
+
+    async def write_multipath_protected_flow(self, multicast_group_id: int, egress_ports: List[int]) -> MulticastGroup:
+        """Replicate protected packets onto every egress port, one disjoint path each (1+N protection)."""
+        await self._write_update(self._multicast_group_update(multicast_group_id, egress_ports))
+        return self._record_multicast_group(multicast_group_id, egress_ports)
+
+    async def write_backup_rate_limit(self, connection_id: int, rate: int, burst: int) -> None:
+        """Cap the copies a protected connection sends onto its backup path to rate bytes/s, with bursts of burst bytes."""
+        await self._write_update(self._backup_rate_limit_update(connection_id, rate, burst))
+        logging.warn(f'backup rate of connection {connection_id} capped at {rate} B/s on {self.switch}')
+
+    async def write_port_state(self, port: int, is_up: bool) -> None:
+        """Mark a port up or down; routes leading to a port that is down switch to their backup route."""
+        await self.write_updates([self._port_state_update(port, is_up)])
+        logging.warn(f'port {port} is {"up" if is_up else "down"} on {self.switch}')
+
+    async def write_digest_config(self,
+                                  digest_name: str,
+                                  max_timeout_ns: int = 0,
+                                  max_list_size: int = 1,
+                                  ack_timeout_ns: int = 0) -> None:
+        """Enable a digest: the switch batches up to max_list_size digests for at most max_timeout_ns."""
+        await self.write_updates([self._digest_config_update(digest_name, max_timeout_ns, max_list_size, ack_timeout_ns)])
+        logging.warn(f'enabled digest {digest_name} on {self.switch}')
+
+    async def write_working_path_groups(self, groups: Dict[int, List[int]]) -> None:
+        """Same as P4SwitchConnection.write_working_path_groups."""
+        new_ports, member_updates = self._working_path_member_updates(groups)
+        await self.write_updates(member_updates)
+        self.switch.working_path_members.update(new_ports)
+        await self.write_updates(self._working_path_group_updates(groups))
+        logging.warn(f'created {len(groups)} multipath groups on {self.switch}')
+
+    async def read_counter_array(self, counter_name: str) -> Dict[int, int]:
+        """Read the packet count of every cell of a counter in a single request."""
+        counter_id = self.switch.p4_api.get_counters_id(counter_name)
+        cells: Dict[int, int] = dict()
+        async for response in self.connection.ReadCounters(counter_id):
+            cells.update(self._counter_cells(response))
+        return cells
+
+    async def read_connection_collisions(self) -> Dict[int, int]:
+        """Return the hash-derived connection slots shared by more than one flow, with the number of colliding packets."""
+        return self._collisions(await self.read_counter_array("MyIngress.ph_connection_collisions"))
 
 
 class SwitchRoles(str, Enum):
@@ -80,16 +762,37 @@ class P4Switch:
                  role: SwitchRoles,
                  uri: str, 
                  p4_dataplane_file_path: str,
-                 bmv2_json_file_path: str) -> None:
+                 bmv2_json_file_path: str,
+                 write_rate: Optional[float] = DEFAULT_WRITE_RATE,
+                 write_burst: int = DEFAULT_WRITE_BURST) -> None:
         self.id = switch_id
         self.name = name
         self.role = role
         self.uri = uri
         self.p4_api = P4InfoHelper(p4_dataplane_file_path)
         self.bmv2_json = bmv2_json_file_path
+        self.clone_sessions = CloneSessionRegistry()
+        self.multicast_groups: Dict[int, MulticastGroup] = dict()
+        self.connection_epochs: Dict[int, int] = dict()
+        self.connection_ids = ConnectionIdPool()  # slots of the per-connection registers, on a PH ingress
+        self.working_path_members: Set[int] = set()  # egress ports of working_path_selector members
+        # batch size and in-flight window of the Writes, adapted to the latency and errors of this switch
+        self.write_control = AdaptiveWriteControl()
+        self.retry_policy = RetryPolicy()
+        # updates per second the switch is sent, so that writes do not starve its packet processing
+        self.write_limiter = WriteTokenBucket(write_rate, write_burst)
+
+    def write_metrics(self) -> WriteMetrics:
+        """Current batch size and window of the Writes to the switch, with their latency and throughput."""
+        return self.write_control.metrics()
+
+    def connect(self, push_pipeline: bool = True) -> P4SwitchConnection:
+        """Connect to the switch; unless push_pipeline is False the P4 program is (re)installed, wiping its state."""
+        return P4SwitchConnection(self, push_pipeline)
 
-    def connect(self) -> P4SwitchConnection:
-        return P4SwitchConnection(self)
+    def connect_async(self, push_pipeline: bool = True) -> AsyncP4SwitchConnection:
+        """Same as connect, as an async context manager to use from a running event loop."""
+        return AsyncP4SwitchConnection(self, push_pipeline)
 
     def __str__(self) -> str:
         return f'Switch {self.name}, id {self.id}, role {self.role}'
@@ -0,0 +1,78 @@
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from p4.v1 import p4runtime_pb2
+
+from utils.p4runtime_lib.convert import decodeNum
+
+from controller.p4switch import P4SwitchConnection
+
+DROP_DIGEST_NAME = "ph_drop_digest_t"
+
+
+@dataclass
+class ConnectionDrops:
+    """Copies of a protected connection dropped by its PH egress, as reported by drop digests."""
+
+    duplicates: int = 0
+    out_of_window: int = 0
+    last_clone_id: Optional[int] = None
+    digests: int = 0
+
+
+class DropTelemetry:
+    """
+    Consumer of the ph_drop_digest_t digests of a PH egress switch, aggregating the dropped copies
+    per connection. The switch pushes them, rate-limited per connection, without any polling.
+    """
+
+    def __init__(self,
+                 switch_connection: P4SwitchConnection,
+                 max_timeout_ns: int = 100_000_000,
+                 max_list_size: int = 64,
+                 ack_timeout_ns: int = 1_000_000_000) -> None:
+        self.switch_connection = switch_connection
+        self.max_timeout_ns = max_timeout_ns
+        self.max_list_size = max_list_size
+        self.ack_timeout_ns = ack_timeout_ns
+        self._drops: Dict[int, ConnectionDrops] = dict()
+        self._digest_id: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def on_digest(self, digest_list: p4runtime_pb2.DigestList) -> None:
+        """Stream handler, runs on the stream reader thread of the switch connection."""
+        if digest_list.digest_id != self._digest_id:
+            return
+        # acknowledge first so that the switch can send the next list while this one is accounted
+        self.switch_connection.connection.AckDigestList(digest_list)
+        with self._lock:
+            for data in digest_list.data:
+                connection_id, duplicates, out_of_window, last_clone_id = [
+                    decodeNum(member.bitstring) for member in data.struct.members
+                ]
+                drops = self._drops.setdefault(connection_id, ConnectionDrops())
+                drops.duplicates += duplicates
+                drops.out_of_window += out_of_window
+                drops.last_clone_id = last_clone_id
+                drops.digests += 1
+
+    def drops(self, connection_id: int) -> ConnectionDrops:
+        with self._lock:
+            drops = self._drops.get(connection_id, ConnectionDrops())
+            return ConnectionDrops(**vars(drops))
+
+    def snapshot(self) -> Dict[int, ConnectionDrops]:
+        with self._lock:
+            return {connection_id: ConnectionDrops(**vars(drops)) for connection_id, drops in self._drops.items()}
+
+    def start(self) -> None:
+        self._digest_id = self.switch_connection.switch.p4_api.get_digests_id(DROP_DIGEST_NAME)
+        self.switch_connection.connection.AddStreamHandler('digest', self.on_digest)
+        self.switch_connection.write_digest_config(
+            DROP_DIGEST_NAME, self.max_timeout_ns, self.max_list_size, self.ack_timeout_ns)
+
+    def stop(self) -> None:
+        self.switch_connection.connection.RemoveStreamHandler('digest', self.on_digest)
+        logging.info(f'stopped drop telemetry on {self.switch_connection.switch}')
@@ -0,0 +1,314 @@
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+from p4.v1 import p4runtime_pb2
+
+from utils.p4runtime_lib.convert import decodeNum
+from utils.p4runtime_lib.helper import P4InfoHelper
+from utils.p4runtime_lib.switch import buildUpdate
+
+from controller.p4clonesession import CloneSessionRegistry, MulticastGroup
+from controller.p4forwardingtables import ConnectionIdPool, SwitchTableEntryFactory
+from controller.p4ratelimit import WritePriority, write_priority
+from controller.p4switch import P4Switch, P4SwitchConnection, SwitchRoles
+from controller.topology import bump_connection_epoch
+
+# egress first, so that it already de-duplicates with the new program when the ingress is upgraded
+UPGRADE_ORDER = [SwitchRoles.EGRESS, SwitchRoles.TRANSIT, SwitchRoles.INGRESS]
+
+# sequence state of the PH ingress: by the time it is restored, the PH egress has moved past the snapshot,
+# so it is not written back and the connections are resynchronised through their epoch instead
+INGRESS_SEQUENCE_REGISTERS = {"MyIngress.ph_expected_next_clone_ids"}
+
+
+@dataclass
+class PipelineSnapshot:
+    """Runtime state of a switch, taken before its pipeline is replaced."""
+
+    p4_api: P4InfoHelper
+    table_entries: List[p4runtime_pb2.TableEntry]
+    pre_entries: List[p4runtime_pb2.PacketReplicationEngineEntry]
+    action_profile_members: List[p4runtime_pb2.ActionProfileMember]
+    action_profile_groups: List[p4runtime_pb2.ActionProfileGroup]
+    meter_entries: List[p4runtime_pb2.MeterEntry]  # configured cells only
+    digest_entries: List[p4runtime_pb2.DigestEntry]
+    registers: Dict[str, Dict[int, int]]  # register name -> index -> value, zeroes omitted
+    clone_sessions: CloneSessionRegistry
+    connection_ids: ConnectionIdPool
+    multicast_groups: Dict[int, MulticastGroup]
+    connection_epochs: Dict[int, int]
+    working_path_members: Set[int]
+
+
+def snapshot_switch(switch_connection: P4SwitchConnection) -> PipelineSnapshot:
+    switch = switch_connection.switch
+    # IDs in the switch state refer to the program it is running, not to the one about to be installed
+    running_config = switch_connection.connection.GetForwardingPipelineConfig()
+    p4_api = P4InfoHelper.fromP4Info(running_config.p4info)
+
+    table_entries = [
+        entity.table_entry
+        for response in switch_connection.connection.ReadTableEntries()
+        for entity in response.entities
+    ]
+
+    pre_entries = [
+        entity.packet_replication_engine_entry
+        for response in switch_connection.connection.ReadPREEntries()
+        for entity in response.entities
+    ]
+
+    action_profile_members = list()
+    action_profile_groups = list()
+    for action_profile in p4_api.p4info.action_profiles:
+        for response in switch_connection.connection.ReadActionProfileEntries(action_profile.preamble.id):
+            for entity in response.entities:
+                if entity.HasField('action_profile_member'):
+                    action_profile_members.append(entity.action_profile_member)
+                else:
+                    action_profile_groups.append(entity.action_profile_group)
+
+    meter_entries = [
+        entity.meter_entry
+        for meter in p4_api.p4info.meters
+        for response in switch_connection.connection.ReadMeters(meter.preamble.id)
+        for entity in response.entities
+        if entity.meter_entry.HasField('config')
+    ]
+
+    digest_entries = [
+        entity.digest_entry
+        for digest in p4_api.p4info.digests
+        for response in switch_connection.connection.ReadDigestEntries(digest.preamble.id)
+        for entity in response.entities
+        if entity.digest_entry.HasField('config')
+    ]
+
+    registers: Dict[str, Dict[int, int]] = dict()
+    for register in p4_api.p4info.registers:
+        values: Dict[int, int] = dict()
+        for response in switch_connection.connection.ReadRegisters(register.preamble.id):
+            for entity in response.entities:
+                value = decodeNum(entity.register_entry.data.bitstring)
+                if value != 0:
+                    values[entity.register_entry.index.index] = value
+        registers[register.preamble.name] = values
+
+    logging.warn(f'snapshot of {switch}: {len(table_entries)} table entries, {len(pre_entries)} PRE entries, '
+                 f'{len(meter_entries)} meter cells, {len(digest_entries)} digests, '
+                 f'{sum(len(values) for values in registers.values())} register cells')
+    return PipelineSnapshot(
+        p4_api=p4_api,
+        table_entries=table_entries,
+        pre_entries=pre_entries,
+        action_profile_members=action_profile_members,
+        action_profile_groups=action_profile_groups,
+        meter_entries=meter_entries,
+        digest_entries=digest_entries,
+        registers=registers,
+        clone_sessions=switch.clone_sessions,
+        connection_ids=switch.connection_ids,
+        multicast_groups=dict(switch.multicast_groups),
+        connection_epochs=dict(switch.connection_epochs),
+        working_path_members=set(switch.working_path_members))
+
+
+def _translate_action(action: p4runtime_pb2.Action, old_api: P4InfoHelper, new_api: P4InfoHelper) -> None:
+    action_name = old_api.get_actions_name(action.action_id)
+    action.action_id = new_api.get_actions_id(action_name)
+    for param in action.params:
+        param_name = old_api.get_action_param_name(action_name, param.param_id)
+        param.param_id = new_api.get_action_param_id(action_name, param_name)
+
+
+def translate_action_profile_entry(entry, old_api: P4InfoHelper, new_api: P4InfoHelper):
+    """Same as translate_table_entry, for action profile members and groups."""
+    action_profile_name = old_api.get_action_profiles_name(entry.action_profile_id)
+    translated = type(entry)()
+    translated.CopyFrom(entry)
+    try:
+        translated.action_profile_id = new_api.get_action_profiles_id(action_profile_name)
+        if isinstance(translated, p4runtime_pb2.ActionProfileMember):
+            _translate_action(translated.action, old_api, new_api)
+    except AttributeError as e:
+        logging.warn(f'dropping entry of {action_profile_name} not supported by the new pipeline: {e}')
+        return None
+    return translated
+
+
+def translate_table_entry(entry: p4runtime_pb2.TableEntry,
+                          old_api: P4InfoHelper,
+                          new_api: P4InfoHelper) -> Optional[p4runtime_pb2.TableEntry]:
+    """
+    Re-map the P4Info IDs of a table entry by name onto the new program.
+    Return None if its table, keys or action no longer exist.
+    """
+    table_name = old_api.get_tables_name(entry.table_id)
+    translated = p4runtime_pb2.TableEntry()
+    translated.CopyFrom(entry)
+    translated.ClearField('time_since_last_hit')
+    try:
+        translated.table_id = new_api.get_tables_id(table_name)
+        for match in translated.match:
+            match_field_name = old_api.get_match_field_name(table_name, match.field_id)
+            match.field_id = new_api.get_match_field_id(table_name, match_field_name)
+        if translated.action.WhichOneof('type') == 'action':
+            _translate_action(translated.action.action, old_api, new_api)
+    except AttributeError as e:
+        logging.warn(f'dropping entry of {table_name} not supported by the new pipeline: {e}')
+        return None
+    return translated
+
+
+def translate_meter_entry(entry: p4runtime_pb2.MeterEntry,
+                          old_api: P4InfoHelper,
+                          new_api: P4InfoHelper) -> Optional[p4runtime_pb2.MeterEntry]:
+    meter_name = old_api.get_meters_name(entry.meter_id)
+    translated = p4runtime_pb2.MeterEntry()
+    translated.CopyFrom(entry)
+    try:
+        translated.meter_id = new_api.get_meters_id(meter_name)
+    except AttributeError:
+        logging.warn(f'dropping meter {meter_name} not supported by the new pipeline')
+        return None
+    return translated
+
+
+def translate_digest_entry(entry: p4runtime_pb2.DigestEntry,
+                           old_api: P4InfoHelper,
+                           new_api: P4InfoHelper) -> Optional[p4runtime_pb2.DigestEntry]:
+    digest_name = old_api.get_digests_name(entry.digest_id)
+    translated = p4runtime_pb2.DigestEntry()
+    translated.CopyFrom(entry)
+    try:
+        translated.digest_id = new_api.get_digests_id(digest_name)
+    except AttributeError:
+        logging.warn(f'dropping digest {digest_name} not supported by the new pipeline')
+        return None
+    return translated
+
+
+def restore_switch(switch_connection: P4SwitchConnection,
+                   snapshot: PipelineSnapshot,
+                   batch_size: Optional[int] = None,
+                   skipped_registers: Set[str] = frozenset()) -> None:
+    """
+    Write the snapshot back onto the freshly installed pipeline,
+    PRE entries and action profiles first as tables refer to them.
+    Without a batch_size, the adaptive batch size of the switch is used.
+    """
+    switch = switch_connection.switch
+    new_api = switch.p4_api
+
+    # PRE entries do not refer to P4Info IDs, they are written back as they were read
+    pre_updates = [buildUpdate(pre_entry) for pre_entry in snapshot.pre_entries]
+    switch_connection.write_updates(pre_updates, batch_size)
+    switch.clone_sessions = snapshot.clone_sessions
+    switch.multicast_groups = dict(snapshot.multicast_groups)
+
+    # groups refer to members, so they go in a later Write
+    for action_profile_entries in (snapshot.action_profile_members, snapshot.action_profile_groups):
+        action_profile_updates = list()
+        for entry in action_profile_entries:
+            translated = translate_action_profile_entry(entry, snapshot.p4_api, new_api)
+            if translated is not None:
+                action_profile_updates.append(buildUpdate(translated))
+        switch_connection.write_updates(action_profile_updates, batch_size)
+    switch.working_path_members = set(snapshot.working_path_members)
+
+    register_updates = list()
+    for register_name, values in snapshot.registers.items():
+        if register_name in skipped_registers:
+            continue
+        try:
+            register_updates += [
+                buildUpdate(new_api.buildRegisterEntry(register_name, index, value), p4runtime_pb2.Update.MODIFY)
+                for index, value in values.items()
+            ]
+        except AttributeError:
+            logging.warn(f'dropping register {register_name} not supported by the new pipeline')
+    switch_connection.write_updates(register_updates, batch_size)
+
+    # meter cells always exist, their configuration is a MODIFY
+    meter_updates = list()
+    for entry in snapshot.meter_entries:
+        translated = translate_meter_entry(entry, snapshot.p4_api, new_api)
+        if translated is not None:
+            meter_updates.append(buildUpdate(translated, p4runtime_pb2.Update.MODIFY))
+    switch_connection.write_updates(meter_updates, batch_size)
+
+    digest_updates = list()
+    for entry in snapshot.digest_entries:
+        translated = translate_digest_entry(entry, snapshot.p4_api, new_api)
+        if translated is not None:
+            digest_updates.append(buildUpdate(translated))
+    switch_connection.write_updates(digest_updates, batch_size)
+
+    table_updates = list()
+    for entry in snapshot.table_entries:
+        translated = translate_table_entry(entry, snapshot.p4_api, new_api)
+        if translated is not None:
+            table_updates.append(buildUpdate(translated))
+    switch_connection.write_updates(table_updates, batch_size)
+    switch.connection_epochs = dict(snapshot.connection_epochs)
+    switch.connection_ids = snapshot.connection_ids
+
+
+def resync_ingress_connections(ingress_connection: P4SwitchConnection,
+                               snapshot: PipelineSnapshot,
+                               egress_switches: List[P4Switch]) -> None:
+    """
+    Move every connection the PH ingress had sequence state for to its next epoch,
+    so that the PH egress restarts from the reset sequence instead of dropping it as duplicates.
+    """
+    connection_ids = set(snapshot.connection_epochs)
+    for register_name in INGRESS_SEQUENCE_REGISTERS:
+        connection_ids.update(snapshot.registers.get(register_name, dict()))
+    if not connection_ids or not egress_switches:
+        return
+
+    entry_factory = SwitchTableEntryFactory()
+    remaining = set(connection_ids)
+    for index, egress_switch in enumerate(egress_switches):
+        with egress_switch.connect(push_pipeline=False) as egress_connection:
+            last_epochs = egress_connection.read_register_array("MyIngress.ph_last_epochs")
+            is_last = index == len(egress_switches) - 1
+            # a connection belongs to the PH egress that has seen it, the last one takes the rest
+            for connection_id in sorted(remaining):
+                if last_epochs.get(connection_id, 0) != 0 or is_last:
+                    bump_connection_epoch(ingress_connection, egress_connection, entry_factory, connection_id)
+                    remaining.discard(connection_id)
+    logging.warn(f'resynchronised {len(connection_ids)} connections of {ingress_connection.switch}')
+
+
+def upgrade_switch(switch: P4Switch,
+                   p4_dataplane_path: str,
+                   bmv2_json_path: str,
+                   batch_size: Optional[int] = None,
+                   egress_switches: Optional[List[P4Switch]] = None) -> None:
+    """Upgrade one switch; a PH ingress is resynchronised with egress_switches, upgraded before it."""
+    new_api = P4InfoHelper(p4_dataplane_path)
+    is_ingress = switch.role == SwitchRoles.INGRESS
+    with switch.connect(push_pipeline=False) as conn:
+        snapshot = snapshot_switch(conn)
+        conn.install_pipeline(new_api, bmv2_json_path)
+        with write_priority(WritePriority.BULK):
+            restore_switch(conn, snapshot, batch_size, INGRESS_SEQUENCE_REGISTERS if is_ingress else frozenset())
+        if is_ingress:
+            resync_ingress_connections(conn, snapshot, egress_switches or list())
+
+
+def upgrade_topology(switch_topology: Dict[str, P4Switch],
+                     p4_dataplane_path: str,
+                     bmv2_json_path: str,
+                     batch_size: Optional[int] = None) -> None:
+    """
+    Replace the P4 program of every switch while keeping tables, registers and PRE entries,
+    one switch at a time so that protection stays in force: egress, then transit, then ingress.
+    """
+    egress_switches = [switch for switch in switch_topology.values() if switch.role == SwitchRoles.EGRESS]
+    for role in UPGRADE_ORDER:
+        for switch in switch_topology.values():
+            if switch.role == role:
+                upgrade_switch(switch, p4_dataplane_path, bmv2_json_path, batch_size, egress_switches)
@@ -0,0 +1,51 @@
+import logging
+import threading
+from typing import Optional
+
+
+class BackgroundWorker:
+    """
+    Daemon thread of a controller loop: start runs _run on it, stop asks it to stop and joins it.
+    Subclasses implement _run, returning once _stopped is set, and _wake if _run blocks on anything else.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _wake(self) -> None:
+        """Unblock _run, which only waits on _stopped by default."""
+
+    def _run(self) -> None:
+        raise NotImplementedError
+
+
+class PeriodicWorker(BackgroundWorker):
+    """Worker running run_round every interval seconds; a failing round is logged and the next one goes ahead."""
+
+    def __init__(self, name: str, interval: float) -> None:
+        super().__init__(name)
+        self.interval = interval
+
+    def run_round(self) -> None:
+        raise NotImplementedError
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_round()
+            except Exception as e:
+                logging.error(f'{self.name} round failed: {e}')
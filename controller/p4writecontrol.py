@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Optional, Tuple
+
+# starting points of the adaptive control, and the fixed values when it is frozen
+DEFAULT_WRITE_BATCH_SIZE = 100
+DEFAULT_WRITE_WINDOW = 16
+
+
+@dataclass
+class WriteMetrics:
+    """Snapshot of the write path of a switch."""
+
+    batch_size: int
+    window: int
+    latency: Optional[float]  # smoothed Write RPC latency in seconds, None before the first reply
+    throughput: float  # updates acknowledged per second over the last throughput_period
+    requests: int
+    updates: int
+    failures: int
+
+
+class AdaptiveWriteControl:
+    """
+    AIMD control of the batch size and in-flight window of the Write requests to one switch.
+    Every reply under the target latency grows the batch by batch_step updates and the window
+    by about one request per round trip; a failure, or a smoothed latency over the target,
+    multiplies both by decrease_factor. Decreases only react to requests sent after the previous
+    one, so that a single congestion event does not collapse the window reply after reply.
+    """
+
+    def __init__(self,
+                 initial_batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+                 initial_window: int = DEFAULT_WRITE_WINDOW,
+                 min_batch_size: int = 1,
+                 max_batch_size: int = 1000,
+                 min_window: int = 1,
+                 max_window: int = 64,
+                 target_latency: float = 0.05,
+                 batch_step: int = 10,
+                 decrease_factor: float = 0.5,
+                 smoothing: float = 0.2,
+                 throughput_period: float = 1.0) -> None:
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_window = min_window
+        self.max_window = max_window
+        self.target_latency = target_latency
+        self.batch_step = batch_step
+        self.decrease_factor = decrease_factor
+        self.smoothing = smoothing
+        self.throughput_period = throughput_period
+        self._batch_size = float(initial_batch_size)
+        self._window = float(initial_window)
+        self._latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._acknowledged: Deque[Tuple[float, int]] = deque()  # (time.monotonic() of the reply, updates)
+        self._requests = 0
+        self._updates = 0
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def batch_size(self) -> int:
+        return int(self._batch_size)
+
+    @property
+    def window(self) -> int:
+        return int(self._window)
+
+    def record(self, updates: int, sent_at: float, failed: bool = False) -> None:
+        """Account for the reply to a Write request of updates sent at sent_at (time.monotonic())."""
+        now = time.monotonic()
+        latency = now - sent_at
+        with self._lock:
+            self._requests += 1
+            if failed:
+                self._failures += 1
+            else:
+                self._updates += updates
+                self._acknowledged.append((now, updates))
+                if self._latency is None:
+                    self._latency = latency
+                else:
+                    self._latency += self.smoothing * (latency - self._latency)
+
+            if failed or self._latency > self.target_latency:
+                if sent_at >= self._last_decrease:
+                    self._batch_size = max(self._batch_size * self.decrease_factor, self.min_batch_size)
+                    self._window = max(self._window * self.decrease_factor, self.min_window)
+                    self._last_decrease = now
+            else:
+                self._batch_size = min(self._batch_size + self.batch_step, self.max_batch_size)
+                self._window = min(self._window + 1 / self._window, self.max_window)
+
+    def metrics(self) -> WriteMetrics:
+        with self._lock:
+            horizon = time.monotonic() - self.throughput_period
+            while self._acknowledged and self._acknowledged[0][0] < horizon:
+                self._acknowledged.popleft()
+            return WriteMetrics(
+                batch_size=self.batch_size,
+                window=self.window,
+                latency=self._latency,
+                throughput=sum(updates for _, updates in self._acknowledged) / self.throughput_period,
+                requests=self._requests,
+                updates=self._updates,
+                failures=self._failures,
+            )
@@ -1,8 +1,20 @@
-from typing import Dict
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
-from controller.p4forwardingtables import SwitchTableEntryFactory
 from controller.p4clonesession import CloneSession
-from controller.p4switch import P4Switch, SwitchRoles, P4SwitchConnection
+from controller.p4forwardingtables import SwitchTableEntryFactory, TableEntry, PH_NUM_EPOCHS, hashed_connection_id
+from controller.p4switch import AsyncP4SwitchConnection, P4Switch, SwitchRoles, P4SwitchConnection
+from controller.p4pathselect import ProtectedPathPair
+
+# The demo configuration programs the same network as controller.py:
+# - the demo flow (10.0.1.100 -> 10.0.2.100) uses the slot hashed from its addresses (hashed_connection_id)
+#   rather than connection 1, like the flows protected at run time, whose slots it is reserved among
+# - port MACs are 00:00:00:00:<switch>:<port>; the baseline configuration had s1 port 2 send with s6's
+#   00:00:00:00:06:02 and s3 port 2 with s2's 00:00:00:00:02:03, which controller.py already had right
+# - the PH egress reaches the hosts of its LAN through one /32 next hop each, as next_hop_table intends
+#   for ports facing a LAN, where the baseline had a single /24 entry towards h2
+# Unlike controller.py, it also programs the links only backup routes use (see point_to_point_link_entries).
+
 
 def specify_switch_topology(p4_dataplane_path: str, bmv2_json_path: str) -> Dict[str,P4Switch]:
     """Create switch objects matching the mininet topology in topology.json"""
@@ -64,152 +76,301 @@ def specify_switch_topology(p4_dataplane_path: str, bmv2_json_path: str) -> Dict
     return topology
     
 
-def configure_ingress_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> None:
-    int_to_host_entry = entry_factory.get_ingress_MAC_entry(
-        mac_addr="08:00:00:00:01:00", 
-        ingress_port=1
-    )
-    switch_connection.write_table_entry(int_to_host_entry)
+def point_to_point_link_entries(entry_factory: SwitchTableEntryFactory,
+                                links: Dict[int, Tuple[str, str]]) -> List[TableEntry]:
+    """
+    Entries of point-to-point links, port -> (port MAC, neighbour MAC): the MAC rewrite of what is sent over
+    the link, and the interface_mac_address entry accepting what the neighbour sends over it.
+    Every link between switches is programmed on both ends, whether routes use it or only backup routes.
+    """
+    entries = list()
+    for egress_port, (port_mac, neighbour_mac) in links.items():
+        entries.append(entry_factory.get_ingress_MAC_entry(mac_addr=port_mac, ingress_port=egress_port))
+        entries.append(entry_factory.get_port_mac_entry(egress_port=egress_port, mac_addr=port_mac))
+        entries.append(entry_factory.get_next_hop_entry(egress_port=egress_port, next_hop_mac=neighbour_mac))
+    return entries
+
+
+def write_point_to_point_links(switch_connection: P4SwitchConnection,
+                               entry_factory: SwitchTableEntryFactory,
+                               links: Dict[int, Tuple[str, str]]) -> None:
+    """Program point-to-point links, port -> (port MAC, neighbour MAC), see point_to_point_link_entries."""
+    _write_entries(switch_connection, point_to_point_link_entries(entry_factory, links))
+
+
+def _write_entries(switch_connection: P4SwitchConnection, entries: List[TableEntry]) -> None:
+    # the entries do not refer to one another, they are pipelined and applied in any order
+    with switch_connection.pipelined_writer() as writer:
+        for entry in entries:
+            writer.write_table_entry(entry)
 
-    protected_session = CloneSession(clone_instance_id=1, clone_port=2, clone_session_id=500)
-    protection_header_entry = entry_factory.get_traffic_protect_entry(
+
+def _ingress_protected_path_pair(entry_factory: SwitchTableEntryFactory, protected_session: CloneSession) -> ProtectedPathPair:
+    protection_header_entry = entry_factory.get_hashed_traffic_protect_entry(
         source_ip="10.0.1.100",
         destination_ip="10.0.2.100",
-        connection_id=protected_session.clone_instance_id,
         is_ph_ingress=True,  
         is_ph_egress=False,
         clone_session_id=protected_session.clone_session_id
     )
-    switch_connection.wite_protected_flow(protected_session)
-    switch_connection.write_table_entry(protection_header_entry)
-
-    working_route = entry_factory.get_routing_entry(dst_network="10.0.2.0", prefix_len=24, egress_port=3)
-    port2_route_rewrite = entry_factory.get_route_by_egress_entry(
-        dst_network="10.0.2.0", 
-        prefix_len=24, 
-        egress_port=3, 
-        src_mac="00:00:00:00:01:03", 
-        next_hop_mac="00:00:00:00:06:03"
+    return ProtectedPathPair(
+        connection_id=hashed_connection_id("10.0.1.100", "10.0.2.100"),
+        dst_network="10.0.2.0",
+        prefix_len=24,
+        working_port=3,
+        backup_port=protected_session.clone_port,
+        protect_entry=protection_header_entry,
+        clone_session=protected_session
     )
-    port3_route_rewrite = entry_factory.get_route_by_egress_entry(
-        dst_network="10.0.2.0", 
-        prefix_len=24, 
-        egress_port=2, 
-        src_mac="00:00:00:00:06:02", 
-        next_hop_mac="00:00:00:00:02:02"
+
+
+def _ingress_switch_entries(entry_factory: SwitchTableEntryFactory, path_pair: ProtectedPathPair) -> List[TableEntry]:
+    int_to_host_entry = entry_factory.get_ingress_MAC_entry(
+        mac_addr="08:00:00:00:01:00", 
+        ingress_port=1
     )
-    switch_connection.write_table_entry(working_route)
-    switch_connection.write_table_entry(port2_route_rewrite)
-    switch_connection.write_table_entry(port3_route_rewrite)
+    working_route = entry_factory.get_routing_entry(dst_network="10.0.2.0", prefix_len=24, egress_port=path_pair.working_port)
+    return [int_to_host_entry, path_pair.protect_entry, working_route] + point_to_point_link_entries(entry_factory, {
+        3: ("00:00:00:00:01:03", "00:00:00:00:06:03"),
+        2: ("00:00:00:00:01:02", "00:00:00:00:02:02"),
+    })
 
 
-def configure_egress_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> None:
-    mac_to_primary = entry_factory.get_ingress_MAC_entry(
-        mac_addr="00:00:00:00:04:02", 
-        ingress_port=2
+def configure_ingress_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> ProtectedPathPair:
+    # the clone session is written, and acknowledged, before the protected_connections entry referring to it
+    protected_session = switch_connection.acquire_clone_session(clone_port=2)
+    path_pair = _ingress_protected_path_pair(entry_factory, protected_session)
+    switch_connection.switch.connection_ids.reserve(path_pair.connection_id)
+    _write_entries(switch_connection, _ingress_switch_entries(entry_factory, path_pair))
+    return path_pair
+
+
+async def configure_ingress_switch_async(switch_connection: AsyncP4SwitchConnection,
+                                         entry_factory: SwitchTableEntryFactory) -> ProtectedPathPair:
+    protected_session = await switch_connection.acquire_clone_session(clone_port=2)
+    path_pair = _ingress_protected_path_pair(entry_factory, protected_session)
+    switch_connection.switch.connection_ids.reserve(path_pair.connection_id)
+    await _write_entries_async(switch_connection, _ingress_switch_entries(entry_factory, path_pair))
+    return path_pair
+
+
+def protect_flow_multipath(ingress_connection: P4SwitchConnection,
+                           egress_connection: P4SwitchConnection,
+                           entry_factory: SwitchTableEntryFactory,
+                           source_ip: str,
+                           destination_ip: str,
+                           egress_ports: List[int],
+                           multicast_group_id: int) -> None:
+    """
+    Protect (src, dst) with one copy per egress port of the PH ingress switch, i.e. 1+N protection.
+    The PH egress switch is programmed first, so that it removes the duplicates of the very first copies.
+    """
+    egress_connection.write_table_entry(_multipath_egress_entry(entry_factory, source_ip, destination_ip))
+    ingress_connection.switch.connection_ids.reserve(hashed_connection_id(source_ip, destination_ip))
+    ingress_connection.write_multipath_protected_flow(multicast_group_id, egress_ports)
+    protection_header_entry = _multipath_protect_entry(entry_factory, source_ip, destination_ip, multicast_group_id)
+    ingress_connection.write_table_entry(protection_header_entry)
+
+
+async def protect_flow_multipath_async(ingress_connection: AsyncP4SwitchConnection,
+                                       egress_connection: AsyncP4SwitchConnection,
+                                       entry_factory: SwitchTableEntryFactory,
+                                       source_ip: str,
+                                       destination_ip: str,
+                                       egress_ports: List[int],
+                                       multicast_group_id: int) -> None:
+    await egress_connection.write_table_entry(_multipath_egress_entry(entry_factory, source_ip, destination_ip))
+    ingress_connection.switch.connection_ids.reserve(hashed_connection_id(source_ip, destination_ip))
+    await ingress_connection.write_multipath_protected_flow(multicast_group_id, egress_ports)
+    protection_header_entry = _multipath_protect_entry(entry_factory, source_ip, destination_ip, multicast_group_id)
+    await ingress_connection.write_table_entry(protection_header_entry)
+
+
+def _multipath_egress_entry(entry_factory: SwitchTableEntryFactory, source_ip: str, destination_ip: str) -> TableEntry:
+    # associate_multipath_protected_details picks the hashed connection slot, the PH egress looks up the same one
+    return entry_factory.get_hashed_traffic_protect_entry(
+        source_ip=source_ip,
+        destination_ip=destination_ip,
+        is_ph_ingress=False,
+        is_ph_egress=True
     )
-    mac_to_backup = entry_factory.get_ingress_MAC_entry(
-        mac_addr="00:00:00:00:04:03", 
-        ingress_port=3
+
+
+def _multipath_protect_entry(entry_factory: SwitchTableEntryFactory,
+                             source_ip: str,
+                             destination_ip: str,
+                             multicast_group_id: int) -> TableEntry:
+    return entry_factory.get_multipath_protect_entry(
+        source_network=source_ip,
+        source_prefix_len=32,
+        destination_network=destination_ip,
+        destination_prefix_len=32,
+        multicast_group_id=multicast_group_id
     )
-    switch_connection.write_table_entry(mac_to_primary)
-    switch_connection.write_table_entry(mac_to_backup)
 
-    protected_session = CloneSession(clone_instance_id=1, clone_port=1, clone_session_id=500)
-    protection_header_entry = entry_factory.get_traffic_protect_entry(
+
+def _egress_switch_entries(entry_factory: SwitchTableEntryFactory) -> List[TableEntry]:
+    protection_header_entry = entry_factory.get_hashed_traffic_protect_entry(
         source_ip="10.0.1.100",
         destination_ip="10.0.2.100",
-        connection_id=protected_session.clone_instance_id,
         is_ph_ingress=False,  
-        is_ph_egress=True,
-        clone_session_id=protected_session.clone_session_id
+        is_ph_egress=True
     )
-    switch_connection.write_table_entry(protection_header_entry)
-
     destination_route = entry_factory.get_routing_entry(dst_network="10.0.2.0", prefix_len=24, egress_port=1)
-    forward_destination_entry = entry_factory.get_route_by_egress_entry(
-        dst_network="10.0.2.0", 
-        prefix_len=24, 
-        egress_port=1, 
-        src_mac="08:00:00:00:02:00", 
-        next_hop_mac="08:00:00:00:02:22"
-    )
-    switch_connection.write_table_entry(destination_route)
-    switch_connection.write_table_entry(forward_destination_entry)
+    port1_mac = entry_factory.get_port_mac_entry(egress_port=1, mac_addr="08:00:00:00:02:00")
+    # port 1 faces a LAN: one next hop per host
+    destination_hosts = [
+        entry_factory.get_next_hop_entry(egress_port=1, next_hop_mac=host_mac, dst_network=host_ip, prefix_len=32)
+        for host_ip, host_mac in [("10.0.2.100", "08:00:00:00:02:22"), ("10.0.2.101", "08:00:00:00:02:23")]
+    ]
+    return [protection_header_entry, destination_route, port1_mac] + destination_hosts + point_to_point_link_entries(entry_factory, {
+        2: ("00:00:00:00:04:02", "00:00:00:00:03:02"),
+        3: ("00:00:00:00:04:03", "00:00:00:00:05:03"),
+    })
 
 
-def configure_transit_top_left_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> None:
-    int_to_ingress_sw = entry_factory.get_ingress_MAC_entry(
-        mac_addr="00:00:00:00:02:02", 
-        ingress_port=2
-    )
+def _transit_top_left_switch_entries(entry_factory: SwitchTableEntryFactory) -> List[TableEntry]:
     route_to_destination = entry_factory.get_routing_entry(dst_network="10.0.2.0", prefix_len=24, egress_port=3)
-    port2_route_rewrite = entry_factory.get_route_by_egress_entry(
-        dst_network="10.0.2.0", 
-        prefix_len=24, 
-        egress_port=3, 
-        src_mac="00:00:00:00:02:03", 
-        next_hop_mac="00:00:00:00:03:03"
-    )
+    return [route_to_destination] + point_to_point_link_entries(entry_factory, {
+        1: ("00:00:00:00:02:01", "00:00:00:00:06:01"),
+        2: ("00:00:00:00:02:02", "00:00:00:00:01:02"),
+        3: ("00:00:00:00:02:03", "00:00:00:00:03:03"),
+    })
 
-    switch_connection.write_table_entry(int_to_ingress_sw)
-    switch_connection.write_table_entry(route_to_destination)
-    switch_connection.write_table_entry(port2_route_rewrite)
 
+def _transit_top_right_switch_entries(entry_factory: SwitchTableEntryFactory) -> List[TableEntry]:
+    route_to_destination = entry_factory.get_routing_entry(dst_network="10.0.2.0", prefix_len=24, egress_port=2)
+    return [route_to_destination] + point_to_point_link_entries(entry_factory, {
+        1: ("00:00:00:00:03:01", "00:00:00:00:05:01"),
+        2: ("00:00:00:00:03:02", "00:00:00:00:04:02"),
+        3: ("00:00:00:00:03:03", "00:00:00:00:02:03"),
+    })
 
-def configure_transit_top_right_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> None:
-    int_to_previous_switch = entry_factory.get_ingress_MAC_entry(
-        mac_addr="00:00:00:00:03:03", 
-        ingress_port=3
-    )
+
+def _transit_bottom_left_switch_entries(entry_factory: SwitchTableEntryFactory) -> List[TableEntry]:
     route_to_destination = entry_factory.get_routing_entry(dst_network="10.0.2.0", prefix_len=24, egress_port=2)
-    port2_route_rewrite = entry_factory.get_route_by_egress_entry(
-        dst_network="10.0.2.0", 
-        prefix_len=24, 
-        egress_port=2, 
-        src_mac="00:00:00:00:02:03", 
-        next_hop_mac="00:00:00:00:04:02"
-    )
+    return [route_to_destination] + point_to_point_link_entries(entry_factory, {
+        1: ("00:00:00:00:06:01", "00:00:00:00:02:01"),
+        2: ("00:00:00:00:06:02", "00:00:00:00:05:02"),
+        3: ("00:00:00:00:06:03", "00:00:00:00:01:03"),
+    })
 
-    switch_connection.write_table_entry(int_to_previous_switch)
-    switch_connection.write_table_entry(route_to_destination)
-    switch_connection.write_table_entry(port2_route_rewrite)
 
+def _transit_bottom_right_switch_entries(entry_factory: SwitchTableEntryFactory) -> List[TableEntry]:
+    route_to_destination = entry_factory.get_routing_entry(dst_network="10.0.2.0", prefix_len=24, egress_port=3)
+    return [route_to_destination] + point_to_point_link_entries(entry_factory, {
+        1: ("00:00:00:00:05:01", "00:00:00:00:03:01"),
+        2: ("00:00:00:00:05:02", "00:00:00:00:06:02"),
+        3: ("00:00:00:00:05:03", "00:00:00:00:04:03"),
+    })
 
-def configure_transit_bottom_left_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> None:
-    int_to_ingress_switch = entry_factory.get_ingress_MAC_entry(
-        mac_addr="00:00:00:00:06:03", 
-        ingress_port=3
-    )
-    route_to_destination = entry_factory.get_routing_entry(dst_network="10.0.2.0", prefix_len=24, egress_port=2)
-    port2_route_rewrite = entry_factory.get_route_by_egress_entry(
-        dst_network="10.0.2.0", 
-        prefix_len=24, 
-        egress_port=2, 
-        src_mac="00:00:00:00:06:02", 
-        next_hop_mac="00:00:00:00:05:02"
-    )
 
-    switch_connection.write_table_entry(int_to_ingress_switch)
-    switch_connection.write_table_entry(route_to_destination)
-    switch_connection.write_table_entry(port2_route_rewrite)
+def configure_egress_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> None:
+    _write_entries(switch_connection, _egress_switch_entries(entry_factory))
+
+
+def configure_transit_top_left_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> None:
+    _write_entries(switch_connection, _transit_top_left_switch_entries(entry_factory))
+
+
+def configure_transit_top_right_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> None:
+    _write_entries(switch_connection, _transit_top_right_switch_entries(entry_factory))
+
+
+def configure_transit_bottom_left_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> None:
+    _write_entries(switch_connection, _transit_bottom_left_switch_entries(entry_factory))
 
 
 def configure_transit_bottom_right_switch(switch_connection: P4SwitchConnection, entry_factory: SwitchTableEntryFactory) -> None:
-    int_to_previous_switch = entry_factory.get_ingress_MAC_entry(
-        mac_addr="00:00:00:00:05:02", 
-        ingress_port=2
-    )
-    route_to_destination = entry_factory.get_routing_entry(dst_network="10.0.2.0", prefix_len=24, egress_port=3)
-    port2_route_rewrite = entry_factory.get_route_by_egress_entry(
-        dst_network="10.0.2.0", 
-        prefix_len=24, 
-        egress_port=3, 
-        src_mac="00:00:00:00:05:03", 
-        next_hop_mac="00:00:00:00:04:03"
-    )
+    _write_entries(switch_connection, _transit_bottom_right_switch_entries(entry_factory))
+
+
+async def _write_entries_async(switch_connection: AsyncP4SwitchConnection,
+                               entries: List[TableEntry],
+                               window: Optional[int] = None) -> None:
+    # same as _write_entries: up to window Writes in flight, applied in any order
+    slots = asyncio.Semaphore(window or switch_connection.switch.write_control.window)
+
+    async def write(entry: TableEntry) -> None:
+        async with slots:
+            await switch_connection.write_table_entry(entry)
+
+    await asyncio.gather(*(write(entry) for entry in entries))
+
+
+async def configure_egress_switch_async(switch_connection: AsyncP4SwitchConnection,
+                                        entry_factory: SwitchTableEntryFactory) -> None:
+    await _write_entries_async(switch_connection, _egress_switch_entries(entry_factory))
+
+
+async def configure_transit_top_left_switch_async(switch_connection: AsyncP4SwitchConnection,
+                                                  entry_factory: SwitchTableEntryFactory) -> None:
+    await _write_entries_async(switch_connection, _transit_top_left_switch_entries(entry_factory))
+
+
+async def configure_transit_top_right_switch_async(switch_connection: AsyncP4SwitchConnection,
+                                                   entry_factory: SwitchTableEntryFactory) -> None:
+    await _write_entries_async(switch_connection, _transit_top_right_switch_entries(entry_factory))
+
+
+async def configure_transit_bottom_left_switch_async(switch_connection: AsyncP4SwitchConnection,
+                                                     entry_factory: SwitchTableEntryFactory) -> None:
+    await _write_entries_async(switch_connection, _transit_bottom_left_switch_entries(entry_factory))
+
+
+async def configure_transit_bottom_right_switch_async(switch_connection: AsyncP4SwitchConnection,
+                                                      entry_factory: SwitchTableEntryFactory) -> None:
+    await _write_entries_async(switch_connection, _transit_bottom_right_switch_entries(entry_factory))
+
+
+# switch of specify_switch_topology -> its configuration, in the order they are configured;
+# loop-free backup routes are not part of it, see p4reroute.FastReroute.install_backup_routes
+SWITCH_CONFIGURATIONS: Dict[str, Callable[[P4SwitchConnection, SwitchTableEntryFactory], Any]] = {
+    'ingress_switch': configure_ingress_switch,
+    'egress_switch': configure_egress_switch,
+    'transit_top_left': configure_transit_top_left_switch,
+    'transit_top_right': configure_transit_top_right_switch,
+    'transit_bottom_left': configure_transit_bottom_left_switch,
+    'transit_bottom_right': configure_transit_bottom_right_switch,
+}
+
+# same, for configure_topology_async
+ASYNC_SWITCH_CONFIGURATIONS: Dict[str, Callable[[AsyncP4SwitchConnection, SwitchTableEntryFactory], Awaitable[Any]]] = {
+    'ingress_switch': configure_ingress_switch_async,
+    'egress_switch': configure_egress_switch_async,
+    'transit_top_left': configure_transit_top_left_switch_async,
+    'transit_top_right': configure_transit_top_right_switch_async,
+    'transit_bottom_left': configure_transit_bottom_left_switch_async,
+    'transit_bottom_right': configure_transit_bottom_right_switch_async,
+}
+
+
+async def configure_topology_async(switch_topology: Dict[str, P4Switch], entry_factory: SwitchTableEntryFactory) -> Dict[str, Any]:
+    """
+    Push the pipeline to every switch of the topology and configure them concurrently from a single event loop.
+    Returns the result of each configuration by switch, e.g. the ProtectedPathPair of the ingress switch,
+    or the exception it failed with: one switch failing does not stop the others.
+    """
+    async def configure(name: str) -> Any:
+        async with switch_topology[name].connect_async() as switch_connection:
+            return await ASYNC_SWITCH_CONFIGURATIONS[name](switch_connection, entry_factory)
+
+    names = [name for name in ASYNC_SWITCH_CONFIGURATIONS if name in switch_topology]
+    results = await asyncio.gather(*(configure(name) for name in names), return_exceptions=True)
+    return dict(zip(names, results))
 
-    switch_connection.write_table_entry(int_to_previous_switch)
-    switch_connection.write_table_entry(route_to_destination)
-    switch_connection.write_table_entry(port2_route_rewrite)
 
+def bump_connection_epoch(ingress_connection: P4SwitchConnection,
+                          egress_connection: P4SwitchConnection,
+                          entry_factory: SwitchTableEntryFactory,
+                          connection_id: int) -> int:
+    """
+    Move a protected connection to the epoch after the last one seen by the PH egress,
+    so that the egress restarts its expected clone ID instead of rejecting the reset sequence.
+    Call it after the PH ingress has been restarted or re-provisioned.
+    """
+    last_epoch = egress_connection.read_register("MyIngress.ph_last_epochs", connection_id)
+    epoch = last_epoch % PH_NUM_EPOCHS  # stored as epoch + 1, 0 if no epoch has been seen yet
+    epoch_entry = entry_factory.get_connection_epoch_entry(connection_id, epoch)
+    ingress_connection.write_connection_epoch(epoch_entry, connection_id, epoch)
+    return epoch
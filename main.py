@@ -1,48 +1,53 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
 import os
 import logging
 from typing import Dict
 
+import grpc
+
 import controller.topology as tp
 from controller.p4forwardingtables import SwitchTableEntryFactory
+from controller.p4retry import WriteFailure
 from controller.p4switch import P4Switch
+from controller.p4upgrade import upgrade_topology
 
 
 # type aliases
 Path = str
 
 
-def main(p4_dataplane_info: Path, bmv2_json: Path) -> None:
-    
+def main(p4_dataplane_info: Path, bmv2_json: Path, upgrade: bool = False, concurrent: bool = False) -> bool:
+    """Configure the topology; returns False if a switch could not be configured."""
     switch_topology: Dict[str, P4Switch] = tp.specify_switch_topology(p4_dataplane_info, bmv2_json)
     logging.info(f'created switch topology')
 
-    entry_factory = SwitchTableEntryFactory()
-
-    ingress_switch = switch_topology['ingress_switch']
-    with ingress_switch.connect() as conn:
-        tp.configure_ingress_switch(conn, entry_factory)
-    
-    egress_switch = switch_topology['egress_switch']
-    with egress_switch.connect() as conn:
-        tp.configure_egress_switch(conn, entry_factory)
+    if upgrade:
+        # keep the running state, only replace the P4 program
+        upgrade_topology(switch_topology, p4_dataplane_info, bmv2_json)
+        return True
 
-    egress_switch = switch_topology['transit_top_left']
-    with egress_switch.connect() as conn:
-        tp.configure_transit_top_left_switch(conn, entry_factory)
-
-    egress_switch = switch_topology['transit_top_right']
-    with egress_switch.connect() as conn:
-        tp.configure_transit_top_right_switch(conn, entry_factory)
+    entry_factory = SwitchTableEntryFactory()
 
-    egress_switch = switch_topology['transit_bottom_left']
-    with egress_switch.connect() as conn:
-        tp.configure_transit_bottom_left_switch(conn, entry_factory)
+    if concurrent:
+        # all the switches at once, from a single event loop
+        results = asyncio.run(tp.configure_topology_async(switch_topology, entry_factory))
+        failed = [name for name, result in results.items() if isinstance(result, Exception)]
+        for name in failed:
+            logging.error(f'configuring {switch_topology[name]} failed: {results[name]}')
+        return not failed
 
-    egress_switch = switch_topology['transit_bottom_right']
-    with egress_switch.connect() as conn:
-        tp.configure_transit_bottom_right_switch(conn, entry_factory)
+    # transient errors are retried by the write layer, what is left fails this switch only
+    failed = list()
+    for name, configure_switch in tp.SWITCH_CONFIGURATIONS.items():
+        try:
+            with switch_topology[name].connect() as conn:
+                configure_switch(conn, entry_factory)
+        except (grpc.RpcError, WriteFailure) as e:
+            logging.error(f'configuring {switch_topology[name]} failed: {e}')
+            failed.append(name)
+    return not failed
 
 
 if __name__ == '__main__':
@@ -56,6 +61,12 @@ if __name__ == '__main__':
     parser.add_argument('--debug', help='BMv2 JSON file from p4c',
                         type=bool, action="store", required=False,
                         default=False)
+    parser.add_argument('--upgrade', help='replace the P4 program of running switches keeping their state',
+                        action="store_true", required=False,
+                        default=False)
+    parser.add_argument('--concurrent', help='configure all the switches concurrently with the asyncio client',
+                        action="store_true", required=False,
+                        default=False)
     args = parser.parse_args()
 
     if args.debug:
@@ -70,4 +81,5 @@ if __name__ == '__main__':
         logging.critical("fBMv2 JSON file not found: {args.bmv2_json}; have you run 'make'?")
         parser.exit(1)
     
-    main(args.p4info, args.bmv2_json)
\ No newline at end of file
+    if not main(args.p4info, args.bmv2_json, args.upgrade, args.concurrent):
+        parser.exit(1)
\ No newline at end of file
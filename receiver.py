@@ -1,16 +1,39 @@
+import argparse
+import os
 import socket
 import time
 
+from controller.p4protectionheader import PROTOCOL_PROTECTION_HEADER, HeaderFormat, ProtectionHeader
+
 SRV_IP = "10.0.2.100"
 SRV_PORT = 5005
 BUFF_SIZE = 1024
 
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock.bind((SRV_IP, SRV_PORT))
+parser = argparse.ArgumentParser(description='Print the datagrams H2 receives')
+parser.add_argument('--protection-header', action='store_true',
+                    help='receive the packets still carrying a Protection Header and decode it (needs root)')
+parser.add_argument('--compact', action='store_true', default=bool(os.environ.get('PH_COMPACT_HEADER')),
+                    help='4-byte Protection Header with a 16-bit clone ID, as built with make PH_COMPACT_HEADER=1')
+args = parser.parse_args()
+header_format = HeaderFormat.COMPACT if args.compact else HeaderFormat.STANDARD
 
-print(f'listening on port {SRV_PORT}')
+if args.protection_header:
+    # raw sockets get the IPv4 header along with the packet
+    sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, PROTOCOL_PROTECTION_HEADER)
+    print(f'listening for {header_format.value} Protection Headers')
+else:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((SRV_IP, SRV_PORT))
+    print(f'listening on port {SRV_PORT}')
 
 while True:
     data, addr = sock.recvfrom(BUFF_SIZE)
-    print(f'received seq {data} from {addr} -- {time.time()}')
-    
+    if not args.protection_header:
+        print(f'received seq {data} from {addr} -- {time.time()}')
+        continue
+    ip_header_length = (data[0] & 0x0F) * 4
+    protection_header = ProtectionHeader.unpack(data[ip_header_length:], header_format)
+    # the UDP header follows the PH, and its ingress timestamp if any
+    payload_offset = ip_header_length + len(protection_header.pack(header_format)) + 8
+    print(f'received seq {data[payload_offset:]} from {addr} clone ID {protection_header.clone_id} '
+          f'path {protection_header.path.name} epoch {protection_header.epoch} -- {time.time()}')
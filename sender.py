@@ -1,22 +1,49 @@
 """Send 10 to H2 10.0.2.100"""
 
+import argparse
+import os
 import socket
+import struct
 import time
 
+from controller.p4protectionheader import PROTOCOL_PROTECTION_HEADER, HeaderFormat, ProtectionHeader
+
 
 DST_IP = "10.0.2.100"
 DST_PORT = 5005
 
 NUM_MESSAGES = 100
 
+
+def protected_datagram(sequence: int, payload: bytes, header_format: HeaderFormat) -> bytes:
+    """Protection Header numbered after the sequence, then the UDP datagram it protects (no checksum)."""
+    protection_header = ProtectionHeader(clone_id=sequence, upper_protocol=socket.IPPROTO_UDP)
+    udp_header = struct.pack('!HHHH', DST_PORT, DST_PORT, 8 + len(payload), 0)
+    return protection_header.pack(header_format) + udp_header + payload
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send numbered UDP datagrams to H2')
+    parser.add_argument('--protection-header', action='store_true',
+                        help='send the datagrams with a Protection Header already in front of them (needs root)')
+    parser.add_argument('--compact', action='store_true', default=bool(os.environ.get('PH_COMPACT_HEADER')),
+                        help='4-byte Protection Header with a 16-bit clone ID, as built with make PH_COMPACT_HEADER=1')
+    args = parser.parse_args()
+    header_format = HeaderFormat.COMPACT if args.compact else HeaderFormat.STANDARD
+
     print(f'STARTING -- send {NUM_MESSAGES} UDP to {DST_IP}:{DST_PORT}')
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # open UDP socket
+    if args.protection_header:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, PROTOCOL_PROTECTION_HEADER) # open raw PH socket
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # open UDP socket
     for sequence in range(NUM_MESSAGES):
         # send a datagram with incrementing sequence number
         print(f'sending seq {sequence} -- {time.time()}')
         bytes_seq = str(sequence).encode('utf-8')
-        sock.sendto(bytes_seq, (DST_IP, DST_PORT))
+        if args.protection_header:
+            sock.sendto(protected_datagram(sequence, bytes_seq, header_format), (DST_IP, 0))
+        else:
+            sock.sendto(bytes_seq, (DST_IP, DST_PORT))
         # time.sleep(1) # wait 1 sec
 
-    print(f'DONE!')
\ No newline at end of file
+    print(f'DONE!')
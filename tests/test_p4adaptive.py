@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+from typing import Dict, List
+
+from p4.v1 import p4runtime_pb2
+
+from controller.p4adaptive import AdaptiveProtection
+from controller.p4clonesession import CloneSession
+from controller.p4forwardingtables import ProtectionMode, TableEntry
+from controller.p4pathselect import ProtectedPathPair
+from controller.p4protectionheader import PathRole, path_register_index
+
+
+class FakeCounterConnection:
+    """Switch whose counters are set by the test, recording the modes written to it."""
+
+    def __init__(self, counter_name: str) -> None:
+        self.counter_name = counter_name
+        self.counters: Dict[int, int] = dict()
+        self.modes: List[List[int]] = list()
+        self._built: List[TableEntry] = list()
+
+    def read_counter_array(self, counter_name: str) -> Dict[int, int]:
+        assert counter_name == self.counter_name
+        return dict(self.counters)
+
+    def build_table_entry(self, entry_info: TableEntry) -> p4runtime_pb2.TableEntry:
+        self._built.append(entry_info)
+        return p4runtime_pb2.TableEntry()
+
+    def write_updates(self, updates) -> None:
+        assert all(update.type == p4runtime_pb2.Update.MODIFY for update in updates)
+        self.modes.append([entry.action_params["protectionMode"] for entry in self._built])
+        self._built.clear()
+
+
+def _path_pair(mode: ProtectionMode, connection_id: int = 3) -> ProtectedPathPair:
+    return ProtectedPathPair(
+        connection_id=connection_id,
+        dst_network="10.0.2.0",
+        prefix_len=24,
+        working_port=2,
+        backup_port=3,
+        protect_entry=TableEntry("MyIngress.protected_connections", {}, "MyIngress.protect",
+                                 {"sessionID": 500, "protectionMode": int(mode)}),
+        clone_session=CloneSession(clone_instance_id=1, clone_port=3, clone_session_id=500))
+
+
+def _adaptive(path_pair: ProtectedPathPair, **kwargs):
+    ingress_connection = FakeCounterConnection("MyIngress.ph_protected_sent")
+    egress_connection = FakeCounterConnection("MyIngress.ph_path_received")
+    adaptive = AdaptiveProtection(ingress_connection, egress_connection, [path_pair], **kwargs)
+
+    def round_with(sent: int, working_received: int, backup_received: int = 0) -> None:
+        connection_id = path_pair.connection_id
+        ingress_connection.counters[connection_id] = sent
+        egress_connection.counters[path_register_index(connection_id, PathRole.WORKING)] = working_received
+        egress_connection.counters[path_register_index(connection_id, PathRole.BACKUP)] = backup_received
+        adaptive.adapt()
+
+    return adaptive, ingress_connection, round_with
+
+
+def test_working_path_losses_switch_to_always_on_despite_the_backup():
+    path_pair = _path_pair(ProtectionMode.ON_DEMAND)
+    _, ingress_connection, round_with = _adaptive(path_pair)
+    round_with(0, 0)
+    # every packet made it over the backup path, but 10% were lost on the working path
+    round_with(1000, 900, backup_received=1000)
+    assert ingress_connection.modes == [[int(ProtectionMode.ALWAYS_ON)]]
+    assert path_pair.protect_entry.action_params["protectionMode"] == int(ProtectionMode.ALWAYS_ON)
+
+
+def test_healthy_rounds_switch_back_to_on_demand():
+    path_pair = _path_pair(ProtectionMode.ALWAYS_ON)
+    _, ingress_connection, round_with = _adaptive(path_pair, healthy_rounds_before_on_demand=2)
+    round_with(0, 0)
+    round_with(1000, 1000)
+    assert ingress_connection.modes == []
+    round_with(2000, 2000)
+    assert ingress_connection.modes == [[int(ProtectionMode.ON_DEMAND)]]
+
+
+def test_rounds_with_little_traffic_are_ignored():
+    path_pair = _path_pair(ProtectionMode.ON_DEMAND)
+    _, ingress_connection, round_with = _adaptive(path_pair, min_packets=100)
+    round_with(0, 0)
+    round_with(50, 0)
+    assert ingress_connection.modes == []
+
+
+def test_counter_reset_starts_over():
+    path_pair = _path_pair(ProtectionMode.ON_DEMAND)
+    _, ingress_connection, round_with = _adaptive(path_pair)
+    round_with(1000, 1000)
+    # only the egress counters were reset: the received delta is negative, not a 100% loss
+    round_with(1500, 0)
+    # then the deltas are taken from the reset values again
+    round_with(2000, 500)
+    assert ingress_connection.modes == []
+
+
+def test_high_latency_switches_to_always_on():
+    path_pair = _path_pair(ProtectionMode.ON_DEMAND)
+    latency_poller = SimpleNamespace(latest=lambda connection_id, path: SimpleNamespace(avg_latency=900.0))
+    _, ingress_connection, round_with = _adaptive(path_pair, latency_poller=latency_poller, latency_threshold=500.0)
+    round_with(0, 0)
+    round_with(1000, 1000)
+    assert ingress_connection.modes == [[int(ProtectionMode.ALWAYS_ON)]]
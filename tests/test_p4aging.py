@@ -0,0 +1,27 @@
+from p4.v1 import p4runtime_pb2
+
+from controller.p4aging import table_entry_key
+
+
+def _entry(src: bytes, dst: bytes, mask: bytes, port: bytes) -> p4runtime_pb2.TableEntry:
+    entry = p4runtime_pb2.TableEntry(table_id=7, priority=10)
+    entry.match.add(field_id=1).ternary.CopyFrom(p4runtime_pb2.FieldMatch.Ternary(value=src, mask=mask))
+    entry.match.add(field_id=2).lpm.CopyFrom(p4runtime_pb2.FieldMatch.LPM(value=dst, prefix_len=24))
+    entry.match.add(field_id=3).exact.value = port
+    return entry
+
+
+def test_key_ignores_the_width_of_match_values():
+    written = _entry(b'\x0a\x00\x01\x64', b'\x0a\x00\x02\x00', b'\xff\xff\xff\xff', b'\x00\x01')
+    # as read back from the switch: shortest bytestrings, fields in another order
+    notified = _entry(b'\x0a\x00\x01\x64', b'\x0a\x00\x02\x00', b'\xff\xff\xff\xff', b'\x01')
+    notified.match.insert(0, notified.match.pop())
+    assert table_entry_key(written) == table_entry_key(notified)
+
+
+def test_zero_may_be_empty():
+    assert table_entry_key(_entry(b'\x01', b'\x02', b'\xff', b'\x00\x00')) == table_entry_key(_entry(b'\x01', b'\x02', b'\xff', b''))
+
+
+def test_different_matches_differ():
+    assert table_entry_key(_entry(b'\x01', b'\x02', b'\xff', b'\x01')) != table_entry_key(_entry(b'\x01', b'\x02', b'\xff', b'\x02'))
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+
+import pytest
+
+from controller.p4clonesession import CloneSessionRegistry
+
+
+def test_flows_with_the_same_replica_share_a_session():
+    registry = CloneSessionRegistry(first_session_id=500)
+    session, created = registry.acquire(clone_port=2)
+    assert created
+    registry.confirm(session)
+    shared, created = registry.acquire(clone_port=2)
+    assert not created
+    assert shared is session
+    assert registry.users(session) == 2
+
+    other, created = registry.acquire(clone_port=2, packet_length_bytes=64)
+    assert created
+    assert other.clone_session_id == 501
+
+
+def test_session_is_removed_with_its_last_user():
+    registry = CloneSessionRegistry(first_session_id=500)
+    session, _ = registry.acquire(clone_port=2)
+    registry.confirm(session)
+    registry.acquire(clone_port=2)
+    assert not registry.release(session)
+    assert registry.release(session)
+    registry.confirm_delete(session)
+    assert registry.sessions() == []
+    with pytest.raises(KeyError):
+        registry.release(session)
+
+
+def test_session_ids_are_reused_once_deleted():
+    registry = CloneSessionRegistry(first_session_id=500)
+    session, _ = registry.acquire(clone_port=2)
+    registry.confirm(session)
+    assert registry.release(session)
+    other, _ = registry.acquire(clone_port=3)
+    assert other.clone_session_id == 501  # 500 is still on the switch
+    registry.confirm_delete(session)
+    reused, created = registry.acquire(clone_port=4)
+    assert created
+    assert reused.clone_session_id == 500
+
+
+def test_failed_delete_keeps_the_session():
+    registry = CloneSessionRegistry(first_session_id=500)
+    session, _ = registry.acquire(clone_port=2)
+    registry.confirm(session)
+    assert registry.release(session)
+    registry.abort_delete(session)
+    assert registry.users(session) == 1
+    assert registry.wait_written(session) is True
+    # released again, the delete is retried
+    assert registry.release(session)
+
+
+def test_users_wait_for_a_pending_delete():
+    registry = CloneSessionRegistry()
+    session, _ = registry.acquire(clone_port=2)
+    registry.confirm(session)
+    assert registry.release(session)
+    shared, created = registry.acquire(clone_port=2)
+    assert not created
+    assert shared is session
+    written = list()
+    waiter = threading.Thread(target=lambda: written.append(registry.wait_written(shared)))
+    waiter.start()
+    waiter.join(0.05)
+    assert waiter.is_alive()
+    registry.confirm_delete(session)
+    waiter.join()
+    # gone from the switch: the new user creates it again, under the same id
+    assert written == [False]
+    assert registry.users(shared) == 1
+
+
+def test_user_leaving_during_a_delete():
+    registry = CloneSessionRegistry(first_session_id=500)
+    session, _ = registry.acquire(clone_port=2)
+    registry.confirm(session)
+    assert registry.release(session)
+    registry.acquire(clone_port=2)
+    assert not registry.release(session)
+    registry.confirm_delete(session)
+    assert registry.sessions() == []
+
+
+def test_users_wait_for_a_pending_session():
+    registry = CloneSessionRegistry()
+    session, _ = registry.acquire(clone_port=2)
+    shared, created = registry.acquire(clone_port=2)
+    assert not created
+    written = list()
+    waiter = threading.Thread(target=lambda: written.append(registry.wait_written(shared)))
+    waiter.start()
+    waiter.join(0.05)
+    assert waiter.is_alive()
+    registry.confirm(session)
+    waiter.join()
+    assert written == [True]
+
+
+def test_aborted_creation_only_drops_the_creator():
+    registry = CloneSessionRegistry()
+    session, _ = registry.acquire(clone_port=2)
+    shared, _ = registry.acquire(clone_port=2)
+    registry.abort(session)
+    assert registry.users(shared) == 1
+    # the waiting user takes over the creation
+    assert registry.wait_written(shared) is False
+    registry.confirm(shared)
+    assert registry.wait_written(shared) is True
+
+
+def test_unwritten_session_needs_no_delete():
+    registry = CloneSessionRegistry()
+    session, _ = registry.acquire(clone_port=2)
+    shared, _ = registry.acquire(clone_port=2)
+    registry.abort(session)
+    assert registry.release(shared) is False
+    assert registry.sessions() == []
+
+
+def test_async_users_wait_for_a_pending_session():
+    registry = CloneSessionRegistry()
+    session, _ = registry.acquire(clone_port=2)
+    shared, _ = registry.acquire(clone_port=2)
+
+    async def scenario():
+        waiter = asyncio.ensure_future(registry.wait_written_async(shared))
+        await asyncio.sleep(0.02)
+        assert not waiter.done()
+        registry.confirm(session)
+        return await waiter
+
+    assert asyncio.run(scenario()) is True
@@ -0,0 +1,94 @@
+import pytest
+
+from controller.p4forwardingtables import (ConnectionIdPool, Dscp, ProtectionMode, SwitchTableEntryFactory, dscp_to_ternary,
+                                         hashed_connection_id, prefix_pair_priority, prefix_to_ternary)
+
+
+def test_connection_id_is_a_stable_register_slot():
+    connection_id = hashed_connection_id("10.0.1.100", "10.0.2.100")
+    assert 0 <= connection_id < 256
+    assert connection_id == hashed_connection_id("10.0.1.100", "10.0.2.100")
+
+
+def test_more_specific_prefix_pairs_win():
+    assert prefix_pair_priority(32, 32) > prefix_pair_priority(24, 32)
+    assert prefix_pair_priority(24, 24, class_specific=True) > prefix_pair_priority(24, 24)
+    assert prefix_pair_priority(24, 24, class_specific=True) < prefix_pair_priority(24, 25)
+
+
+def test_acquire_hands_out_the_lowest_free_id():
+    pool = ConnectionIdPool(size=4)
+    assert [pool.acquire() for _ in range(3)] == [0, 1, 2]
+    assert pool.release(1)
+    assert pool.acquire() == 1
+
+
+def test_pool_exhaustion():
+    pool = ConnectionIdPool(size=1)
+    pool.acquire()
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+
+
+def test_shared_slot_is_free_after_its_last_reference():
+    pool = ConnectionIdPool(size=8)
+    connection_id = hashed_connection_id("10.0.1.100", "10.0.2.100")
+    assert 0 <= connection_id < 256
+    slot = connection_id % 8
+    assert pool.reserve(slot)
+    assert not pool.reserve(slot)  # a colliding flow
+    assert pool.references(slot) == 2
+    assert not pool.release(slot)
+    assert pool.release(slot)
+    assert pool.in_use() == 0
+
+
+def test_reserved_slot_is_not_acquired():
+    pool = ConnectionIdPool(size=2)
+    pool.reserve(0)
+    assert pool.acquire() == 1
+
+
+def test_reserve_out_of_range():
+    with pytest.raises(ValueError):
+        ConnectionIdPool(size=2).reserve(2)
+
+
+def test_prefix_to_ternary_masks_the_host_bits():
+    assert prefix_to_ternary("10.0.2.100", 24) == ("10.0.2.0", "255.255.255.0")
+    assert prefix_to_ternary("10.0.2.100", 32) == ("10.0.2.100", "255.255.255.255")
+    assert prefix_to_ternary("10.0.2.100", 0) == ("0.0.0.0", "0.0.0.0")
+
+
+def test_prefix_protect_entry_hashes_each_flow():
+    entry = SwitchTableEntryFactory().get_prefix_protect_entry(
+        source_network="10.0.1.0", source_prefix_len=24,
+        destination_network="10.0.2.0", destination_prefix_len=16,
+        is_ph_ingress=True, is_ph_egress=False, clone_session_id=500)
+    assert entry.action_name == "MyIngress.associate_hashed_protected_details"
+    assert entry.match_fields == {
+        "hdr.ipv4.srcAddr": ("10.0.1.0", "255.255.255.0"),
+        "hdr.ipv4.dstAddr": ("10.0.0.0", "255.255.0.0"),
+    }
+    assert entry.priority == prefix_pair_priority(24, 16)
+    assert entry.action_params["isPHIngressFlag"] == 1
+
+
+def test_dscp_to_ternary_ignores_ecn():
+    assert dscp_to_ternary(Dscp.EF) == (46 << 2, 0xFC)
+    with pytest.raises(ValueError):
+        dscp_to_ternary(64)
+
+
+def test_class_protect_entries_match_one_class_each():
+    entries = SwitchTableEntryFactory().get_class_protect_entries(
+        source_network="10.0.1.0", source_prefix_len=24,
+        destination_network="10.0.2.0", destination_prefix_len=24,
+        clone_session_id=500,
+        class_policy={Dscp.EF: ProtectionMode.ALWAYS_ON, Dscp.AF41: ProtectionMode.ON_DEMAND})
+    assert [(entry.match_fields["hdr.ipv4.diffserv"], entry.action_params["protectionMode"]) for entry in entries] == [
+        (dscp_to_ternary(Dscp.EF), int(ProtectionMode.ALWAYS_ON)),
+        (dscp_to_ternary(Dscp.AF41), int(ProtectionMode.ON_DEMAND)),
+    ]
+    # a class entry wins over the class-agnostic entry of the same prefix pair
+    assert all(entry.priority == prefix_pair_priority(24, 24, class_specific=True) for entry in entries)
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+from controller.p4latency import PathLatencyPoller
+from controller.p4protectionheader import PathRole, path_register_index
+
+
+class FakeSwitchConnection:
+    """Serves the latency registers of a PH egress; registers maps a register name to its cells."""
+
+    def __init__(self):
+        self.switch = SimpleNamespace(name='s4')
+        self.registers = dict()
+
+    def read_register_array(self, register_name):
+        return dict(self.registers.get(register_name, dict()))
+
+    def set_path(self, connection_id, path, count, total, minimum, maximum):
+        index = path_register_index(connection_id, path)
+        for name, value in (("count", count), ("sum", total), ("min", minimum), ("max", maximum)):
+            self.registers.setdefault(f"MyIngress.ph_path_latency_{name}", dict())[index] = value
+
+
+def test_poll_averages_over_the_last_interval():
+    switch_connection = FakeSwitchConnection()
+    poller = PathLatencyPoller(switch_connection, [1])
+    switch_connection.set_path(1, PathRole.WORKING, count=10, total=1000, minimum=50, maximum=200)
+    poller.poll()
+    switch_connection.set_path(1, PathRole.WORKING, count=14, total=1800, minimum=50, maximum=300)
+    poller.poll()
+
+    samples = poller.history(1, PathRole.WORKING)
+    assert [(sample.packets, sample.avg_latency) for sample in samples] == [(10, 100.0), (4, 200.0)]
+    assert (samples[-1].min_latency, samples[-1].max_latency) == (50, 300)
+
+
+def test_poll_skips_paths_without_new_packets():
+    switch_connection = FakeSwitchConnection()
+    poller = PathLatencyPoller(switch_connection, [1])
+    switch_connection.set_path(1, PathRole.WORKING, count=3, total=30, minimum=10, maximum=10)
+    poller.poll()
+    poller.poll()
+    assert len(poller.history(1, PathRole.WORKING)) == 1
+    assert poller.latest(1, PathRole.BACKUP) is None
+
+
+def test_poll_reads_negative_latencies_and_counter_wraps():
+    switch_connection = FakeSwitchConnection()
+    poller = PathLatencyPoller(switch_connection, [2])
+    switch_connection.set_path(2, PathRole.BACKUP, count=(1 << 32) - 1, total=0, minimum=0, maximum=0)
+    poller.poll()
+    # two packets later the count wrapped to 1; unsynchronised clocks gave them -5 us each
+    switch_connection.set_path(2, PathRole.BACKUP, count=1, total=(1 << 64) - 10,
+                               minimum=(1 << 48) - 5, maximum=(1 << 48) - 5)
+    poller.poll()
+
+    sample = poller.latest(2, PathRole.BACKUP)
+    assert (sample.packets, sample.avg_latency, sample.min_latency, sample.max_latency) == (2, -5.0, -5, -5)
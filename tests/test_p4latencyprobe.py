@@ -0,0 +1,102 @@
+from typing import List
+
+import pytest
+from p4.v1 import p4runtime_pb2
+
+from controller import p4latencyprobe
+from controller.p4clonesession import CloneSession
+from controller.p4forwardingtables import SwitchTableEntryFactory
+from controller.p4latencyprobe import (LatencyProbeService, _ipv4_checksum, build_latency_probe, parse_latency_probe,
+                                       percentile)
+from controller.p4pathselect import ProtectedPathPair
+from controller.p4protectionheader import PathRole
+
+# Ethernet and IPv4 header, then connection ID, egress port and sequence number before the timestamps
+_DEPARTURE_OFFSET = 14 + 20 + 10
+
+
+def _stamped(frame: bytes, departure: int, arrival: int) -> bytes:
+    """Probe as punted by the PH egress, with the timestamps of both switches filled in."""
+    return frame[:_DEPARTURE_OFFSET] + departure.to_bytes(6, 'big') + arrival.to_bytes(6, 'big')
+
+
+def test_probe_round_trip():
+    frame = build_latency_probe("10.0.1.100", "10.0.2.100", connection_id=3, egress_port=2, sequence=9)
+    assert _ipv4_checksum(frame[14:34]) == 0  # a valid header sums up to 0xFFFF
+    assert parse_latency_probe(_stamped(frame, departure=1000, arrival=1250)) == (3, 2, 9, 250)
+
+
+def test_other_frames_are_not_probes():
+    frame = bytearray(build_latency_probe("10.0.1.100", "10.0.2.100", 3, 2, 9))
+    assert parse_latency_probe(bytes(frame[:40])) is None
+    frame[23] = 17  # UDP
+    assert parse_latency_probe(bytes(frame)) is None
+
+
+def test_percentile_interpolates():
+    assert percentile([10, 20, 30, 40], 50) == 25
+    assert percentile([10, 20, 30, 40], 100) == 40
+    assert percentile([7], 99) == 7
+
+
+def _path_pair() -> ProtectedPathPair:
+    entry_factory = SwitchTableEntryFactory()
+    protect_entry = entry_factory.get_hashed_traffic_protect_entry("10.0.1.100", "10.0.2.100", True, False, 500)
+    return ProtectedPathPair(connection_id=3, dst_network="10.0.2.0", prefix_len=24, working_port=2, backup_port=3,
+                             protect_entry=protect_entry,
+                             clone_session=CloneSession(clone_instance_id=1, clone_port=3, clone_session_id=500))
+
+
+@pytest.fixture
+def swaps(monkeypatch) -> List[int]:
+    swaps = list()
+
+    def swap_protection_paths(ingress_connection, entry_factory, path_pair, fast_reroute=None):
+        swaps.append(path_pair.connection_id)
+        path_pair.working_port, path_pair.backup_port = path_pair.backup_port, path_pair.working_port
+
+    monkeypatch.setattr(p4latencyprobe, 'swap_protection_paths', swap_protection_paths)
+    return swaps
+
+
+def _service(**kwargs) -> LatencyProbeService:
+    return LatencyProbeService(None, None, SwitchTableEntryFactory(), [_path_pair()],
+                               min_samples=2, rounds_before_swap=2, **kwargs)
+
+
+def _receive(service: LatencyProbeService, egress_port: int, latency: int) -> None:
+    frame = build_latency_probe("10.0.1.100", "10.0.2.100", 3, egress_port, 1)
+    service.on_packet_in(p4runtime_pb2.PacketIn(payload=_stamped(frame, 1000, 1000 + latency)))
+
+
+def test_a_faster_backup_path_takes_over_after_a_few_rounds(swaps):
+    service = _service()
+    for _ in range(2):
+        _receive(service, 2, 500)
+        _receive(service, 3, 300)
+    service.select()
+    assert swaps == []
+    service.select()
+    assert swaps == [3]
+    # samples are kept per egress port: the former backup is now the working path
+    assert service.percentiles(3, PathRole.WORKING, qs=(50,)) == {50: 300}
+
+
+def test_a_slightly_faster_backup_path_is_kept_as_backup(swaps):
+    service = _service(hysteresis=0.1)
+    for _ in range(2):
+        _receive(service, 2, 500)
+        _receive(service, 3, 460)
+    for _ in range(3):
+        service.select()
+    assert swaps == []
+
+
+def test_no_selection_without_enough_samples(swaps):
+    service = _service()
+    _receive(service, 2, 500)
+    _receive(service, 3, 100)
+    for _ in range(3):
+        service.select()
+    assert swaps == []
+    assert service.percentiles(3, PathRole.BACKUP) == {50: 100, 90: 100, 99: 100}
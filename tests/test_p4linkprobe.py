@@ -0,0 +1,96 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from p4.v1 import p4runtime_pb2
+
+from controller.p4linkprobe import LinkProbeMonitor
+from controller.p4reroute import NetworkGraph
+
+TOPOLOGY_PATH = os.path.join(os.path.dirname(__file__), '..', 'topology.json')
+
+
+class FakeP4Api:
+    """Packet-outs carry their metadata as is, packet-ins their ingress port in metadata 1."""
+
+    def buildPacketOut(self, payload, metadata=None):
+        return SimpleNamespace(payload=payload, metadata=dict(metadata or dict()))
+
+    def get_packet_in_metadata(self, packet_in):
+        return {"ingress_port": packet_in.metadata[0].value[0]} if packet_in.metadata else dict()
+
+
+class FakeSwitchConnection:
+    def __init__(self, switch_id: int, name: str) -> None:
+        self.switch = SimpleNamespace(id=switch_id, name=name, p4_api=FakeP4Api())
+        self.connection = SimpleNamespace(packet_outs=list())
+        self.connection.PacketOut = lambda packet_out, block=True: self.connection.packet_outs.append(packet_out)
+
+
+@pytest.fixture
+def monitor():
+    graph = NetworkGraph.from_topology_file(TOPOLOGY_PATH)
+    switch_connections = {
+        name: FakeSwitchConnection(switch_id, name)
+        for switch_id, name in enumerate(sorted(graph.switches))
+    }
+    changes = list()
+    monitor = LinkProbeMonitor(graph, switch_connections, interval=0.01, multiplier=3,
+                               on_link_state=lambda switch, port, is_up: changes.append((switch, port, is_up)))
+    monitor.changes = changes
+    return monitor
+
+
+def _packet_in(payload: bytes, ingress_port: int) -> p4runtime_pb2.PacketIn:
+    packet_in = p4runtime_pb2.PacketIn(payload=payload)
+    packet_in.metadata.add(metadata_id=1, value=bytes([ingress_port]))
+    return packet_in
+
+
+def _sent_probe(monitor: LinkProbeMonitor, switch: str, port: int) -> bytes:
+    [packet_out] = [packet_out for packet_out in monitor.switch_connections[switch].connection.packet_outs
+                    if packet_out.metadata["egress_port"] == port]
+    return packet_out.payload
+
+
+def test_only_links_between_switches_are_probed(monitor):
+    monitor.probe()
+    # h1 and h2 hang off s1 port 1 and s4 port 1
+    assert ('s1', 1) not in monitor.link_ends and ('s4', 1) not in monitor.link_ends
+    assert len(monitor.link_ends) == 16
+    assert sum(len(switch_connection.connection.packet_outs)
+               for switch_connection in monitor.switch_connections.values()) == 16
+
+
+def test_a_probe_across_its_link_brings_the_link_end_up(monitor):
+    monitor._started = time.monotonic() - 1
+    monitor.probe()
+    # s1 port 2 is linked to s2 port 2
+    monitor.on_packet_in('s2', _packet_in(_sent_probe(monitor, 's1', 2), ingress_port=2))
+    monitor.detect()
+    assert monitor.link_states()[('s1', 2)] is True
+    assert monitor.link_states()[('s2', 2)] is False
+    assert ('s1', 2, True) in monitor.changes
+
+
+@pytest.mark.parametrize("receiving_switch, ingress_port", [('s2', 3), ('s6', 2)])
+def test_probes_off_their_link_are_ignored(monitor, receiving_switch, ingress_port):
+    monitor._started = time.monotonic() - 1
+    monitor.probe()
+    monitor.on_packet_in(receiving_switch, _packet_in(_sent_probe(monitor, 's1', 2), ingress_port=ingress_port))
+    monitor.detect()
+    assert monitor.link_states()[('s1', 2)] is False
+
+
+def test_no_verdict_before_a_full_detection_time(monitor):
+    monitor._started = time.monotonic()
+    monitor.detect()
+    assert monitor.changes == []
+    assert set(monitor.link_states().values()) == {None}
+
+
+def test_other_packet_ins_are_ignored(monitor):
+    monitor.on_packet_in('s2', _packet_in(b'\x00' * 64, ingress_port=2))
+    monitor.on_packet_in('s2', _packet_in(b'\x00', ingress_port=2))
+    assert all(state.last_received is None for state in monitor._states.values())
@@ -0,0 +1,150 @@
+from types import SimpleNamespace
+from typing import Dict, List
+
+import pytest
+from p4.v1 import p4runtime_pb2
+
+from controller import p4pathselect
+from controller.p4clonesession import CloneSession
+from controller.p4forwardingtables import SwitchTableEntryFactory, TableEntry
+from controller.p4pathselect import PathSelector, ProtectedPathPair, swap_protection_paths
+from controller.p4protectionheader import PathRole, path_register_index
+
+
+class FakeEgressConnection:
+    """Egress switch whose ph_path_wins counters are set by the test."""
+
+    def __init__(self) -> None:
+        self.wins: Dict[int, int] = dict()
+
+    def read_counter_array(self, counter_name: str) -> Dict[int, int]:
+        assert counter_name == "MyIngress.ph_path_wins"
+        return dict(self.wins)
+
+
+def _path_pair(connection_id: int = 3) -> ProtectedPathPair:
+    return ProtectedPathPair(
+        connection_id=connection_id,
+        dst_network="10.0.2.0",
+        prefix_len=24,
+        working_port=2,
+        backup_port=3,
+        protect_entry=TableEntry("MyIngress.protected_connections", {}, "MyIngress.protect", {"sessionID": 500}),
+        clone_session=CloneSession(clone_instance_id=1, clone_port=3, clone_session_id=500))
+
+
+class FakeIngressConnection:
+    """Ingress switch recording the clone session and write calls of a swap."""
+
+    switch = SimpleNamespace(name='s1')
+
+    def __init__(self, fail_write: bool = False) -> None:
+        self.fail_write = fail_write
+        self.calls: List[tuple] = list()
+        self.entries: List[TableEntry] = list()
+
+    def acquire_clone_session(self, clone_port, clone_instance_id=1, packet_length_bytes=0) -> CloneSession:
+        self.calls.append(('acquire', clone_port))
+        return CloneSession(clone_instance_id, clone_port, 501, packet_length_bytes)
+
+    def release_clone_session(self, clone_session: CloneSession) -> None:
+        self.calls.append(('release', clone_session.clone_session_id))
+
+    def build_table_entry(self, entry_info: TableEntry) -> p4runtime_pb2.TableEntry:
+        self.entries.append(entry_info)
+        return p4runtime_pb2.TableEntry()
+
+    def write_updates(self, updates) -> None:
+        self.calls.append(('write', [update.type for update in updates]))
+        if self.fail_write:
+            raise RuntimeError('write failed')
+
+
+def test_swap_clones_onto_the_former_working_port():
+    ingress, path_pair = FakeIngressConnection(), _path_pair()
+    swap_protection_paths(ingress, SwitchTableEntryFactory(), path_pair)
+    # the new session exists before the entry refers to it, the old one goes once nothing does
+    assert ingress.calls == [
+        ('acquire', 2), ('write', [p4runtime_pb2.Update.MODIFY] * 2), ('release', 500)]
+    route, protect_entry = ingress.entries
+    assert route.action_params == {"port": 3}
+    assert protect_entry.action_params == {"sessionID": 501}
+    assert (path_pair.working_port, path_pair.backup_port) == (3, 2)
+    assert path_pair.clone_session.clone_session_id == 501
+
+
+def test_swap_moves_the_backup_route_along():
+    updates = list()
+    fast_reroute = SimpleNamespace(update_backup_route=lambda *args: updates.append(args[1:]))
+    swap_protection_paths(FakeIngressConnection(), SwitchTableEntryFactory(), _path_pair(), fast_reroute)
+    assert updates == [('s1', "10.0.2.0", 24, 3)]
+
+
+def test_failed_swap_keeps_the_paths():
+    ingress, path_pair = FakeIngressConnection(fail_write=True), _path_pair()
+    with pytest.raises(RuntimeError):
+        swap_protection_paths(ingress, SwitchTableEntryFactory(), path_pair)
+    assert ingress.calls[-1] == ('release', 501)
+    assert (path_pair.working_port, path_pair.backup_port) == (2, 3)
+    assert path_pair.clone_session.clone_session_id == 500
+
+
+@pytest.fixture
+def swaps(monkeypatch) -> List[ProtectedPathPair]:
+    swapped: List[ProtectedPathPair] = list()
+    monkeypatch.setattr(p4pathselect, 'swap_protection_paths', lambda _, __, path_pair, ___: swapped.append(path_pair))
+    return swapped
+
+
+def _selector(egress: FakeEgressConnection, path_pair: ProtectedPathPair) -> PathSelector:
+    return PathSelector(None, egress, None, [path_pair], min_packets=100, backup_win_ratio=0.8, rounds_before_swap=2)
+
+
+def _win(egress: FakeEgressConnection, path_pair: ProtectedPathPair, working: int, backup: int) -> None:
+    egress.wins[path_register_index(path_pair.connection_id, PathRole.WORKING)] = working
+    egress.wins[path_register_index(path_pair.connection_id, PathRole.BACKUP)] = backup
+
+
+def test_backup_is_promoted_after_consecutive_rounds(swaps):
+    egress, path_pair = FakeEgressConnection(), _path_pair()
+    selector = _selector(egress, path_pair)
+    _win(egress, path_pair, working=10, backup=190)
+    selector.select()
+    assert swaps == []
+    _win(egress, path_pair, working=20, backup=380)
+    selector.select()
+    assert swaps == [path_pair]
+
+
+def test_a_working_round_breaks_the_streak(swaps):
+    egress, path_pair = FakeEgressConnection(), _path_pair()
+    selector = _selector(egress, path_pair)
+    for working, backup in [(10, 190), (200, 200), (210, 390)]:
+        _win(egress, path_pair, working, backup)
+        selector.select()
+    assert swaps == []
+
+
+def test_quiet_rounds_are_ignored(swaps):
+    egress, path_pair = FakeEgressConnection(), _path_pair()
+    selector = _selector(egress, path_pair)
+    for backup in [50, 100, 150]:
+        _win(egress, path_pair, working=0, backup=backup)
+        selector.select()
+    assert swaps == []
+
+
+def test_counter_reset_starts_over(swaps):
+    egress, path_pair = FakeEgressConnection(), _path_pair()
+    selector = _selector(egress, path_pair)
+    _win(egress, path_pair, working=100, backup=0)
+    selector.select()
+    # a new pipeline zeroed the counters: -100 working wins and 300 backup wins are no round at all
+    _win(egress, path_pair, working=0, backup=300)
+    selector.select()
+    _win(egress, path_pair, working=10, backup=490)
+    selector.select()
+    assert swaps == []
+    _win(egress, path_pair, working=20, backup=680)
+    selector.select()
+    assert swaps == [path_pair]
@@ -0,0 +1,36 @@
+import pytest
+
+from controller.p4protectionheader import (PH_FLAG_BACKUP_PATH, HeaderFormat, PathRole, ProtectionHeader,
+                                           header_length, path_register_index)
+
+
+@pytest.mark.parametrize('header_format, length', [(HeaderFormat.STANDARD, 6), (HeaderFormat.COMPACT, 4)])
+def test_header_length(header_format, length):
+    assert header_length(header_format) == length
+    assert len(ProtectionHeader(clone_id=1, upper_protocol=17).pack(header_format)) == length
+
+
+@pytest.mark.parametrize('header_format, clone_id', [(HeaderFormat.STANDARD, 0xFFFFFFFF), (HeaderFormat.COMPACT, 0xFFFF)])
+@pytest.mark.parametrize('ingress_timestamp', [None, 0, (1 << 48) - 1])
+def test_pack_unpack_round_trip(header_format, clone_id, ingress_timestamp):
+    header = ProtectionHeader(clone_id=clone_id, upper_protocol=17, flags=PH_FLAG_BACKUP_PATH | 2,
+                              ingress_timestamp=ingress_timestamp)
+    data = header.pack(header_format)
+    unpacked = ProtectionHeader.unpack(data + b'payload', header_format)
+    assert unpacked.clone_id == clone_id
+    assert unpacked.upper_protocol == 17
+    assert unpacked.ingress_timestamp == ingress_timestamp
+    assert unpacked.path == PathRole.BACKUP
+    assert unpacked.epoch == 2
+    assert unpacked.pack(header_format) == data
+
+
+def test_compact_header_does_not_fit_a_32_bit_clone_id():
+    with pytest.raises(Exception):
+        ProtectionHeader(clone_id=1 << 16, upper_protocol=17).pack(HeaderFormat.COMPACT)
+
+
+def test_path_register_index():
+    assert path_register_index(0, PathRole.WORKING) == 0
+    assert path_register_index(3, PathRole.WORKING) == 6
+    assert path_register_index(3, PathRole.BACKUP) == 7
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from controller.p4ratelimit import WritePriority, WriteTokenBucket, current_write_priority, write_priority
+
+
+def test_burst_goes_right_away():
+    bucket = WriteTokenBucket(rate=1.0, burst=10)
+    started = time.monotonic()
+    bucket.acquire(10)
+    assert time.monotonic() - started < 0.5
+
+
+def test_writes_are_held_back_to_the_rate():
+    bucket = WriteTokenBucket(rate=100.0, burst=1)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire(1)
+    # the first update goes with the burst, the others wait about 10ms each
+    assert time.monotonic() - started >= 0.04
+
+
+def test_no_rate_means_no_limit():
+    bucket = WriteTokenBucket(rate=None, burst=1)
+    for _ in range(1000):
+        bucket.acquire(100)
+
+
+@pytest.mark.parametrize('rate, burst', [(0, 1), (-1.0, 1), (1.0, 0)])
+def test_invalid_settings(rate, burst):
+    with pytest.raises(ValueError):
+        WriteTokenBucket(rate=rate, burst=burst)
+
+
+def test_failover_goes_on_credit():
+    bucket = WriteTokenBucket(rate=1.0, burst=1)
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.acquire(1, WritePriority.FAILOVER)
+    assert time.monotonic() - started < 0.5
+    assert bucket._tokens < 0
+
+
+def test_higher_lanes_go_first():
+    bucket = WriteTokenBucket(rate=1.0, burst=1)
+    bucket._tokens = 0
+    bulk = bucket._enter(1, WritePriority.BULK)
+    normal = bucket._enter(1, WritePriority.NORMAL)
+    bucket._tokens = 1
+    with bucket._changed:
+        assert bucket._claim(bulk, 1) > 0  # held back by the NORMAL write
+        assert bucket._claim(normal, 1) == 0
+        bucket._tokens = 1
+        assert bucket._claim(bulk, 1) == 0
+
+
+def test_first_come_first_served_within_a_lane():
+    bucket = WriteTokenBucket(rate=1.0, burst=1)
+    bucket._tokens = 1
+    first = bucket._enter(1, WritePriority.NORMAL)
+    second = bucket._enter(1, WritePriority.NORMAL)
+    with bucket._changed:
+        assert bucket._claim(second, 1) > 0
+        assert bucket._claim(first, 1) == 0
+
+
+def test_large_write_leaves_the_bucket_in_debt():
+    bucket = WriteTokenBucket(rate=1000.0, burst=10)
+    bucket.acquire(50)
+    assert bucket._tokens < 0
+
+
+def test_write_priority_is_per_thread():
+    seen = list()
+    with write_priority(WritePriority.BULK):
+        thread = threading.Thread(target=lambda: seen.append(current_write_priority()))
+        thread.start()
+        thread.join()
+        assert current_write_priority() == WritePriority.BULK
+    assert current_write_priority() == WritePriority.NORMAL
+    assert seen == [WritePriority.NORMAL]
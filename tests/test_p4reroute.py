@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from controller.p4forwardingtables import SwitchTableEntryFactory
+from controller.p4reroute import FastReroute, NetworkGraph, precompute_backup_routes
+
+TOPOLOGY_PATH = os.path.join(os.path.dirname(__file__), '..', 'topology.json')
+
+
+@pytest.fixture
+def graph():
+    return NetworkGraph.from_topology_file(TOPOLOGY_PATH)
+
+
+def _line_graph():
+    # s1 - s2 - s3, with s4 hanging off s1 only
+    graph = NetworkGraph(switches={'s1', 's2', 's3', 's4'})
+    for (node_a, port_a), (node_b, port_b) in [(('s1', 1), ('s2', 1)), (('s2', 2), ('s3', 1)), (('s1', 2), ('s4', 1))]:
+        graph.links.setdefault(node_a, dict())[port_a] = (node_b, port_b)
+        graph.links.setdefault(node_b, dict())[port_b] = (node_a, port_a)
+    return graph
+
+
+def test_topology_file(graph):
+    assert graph.switches == {'s1', 's2', 's3', 's4', 's5', 's6'}
+    assert graph.links['s1'][2] == ('s2', 2)
+    assert graph.host_networks == {'10.0.1.0/24': 's1', '10.0.2.0/24': 's4'}
+    assert graph.distances('s4') == {'s4': 0, 's3': 1, 's5': 1, 's2': 2, 's6': 2, 's1': 3}
+
+
+def test_closer_neighbour_is_a_loop_free_alternate(graph):
+    # s1 works over s2 (port 2), s6 is as close to s4 and does not route back through s1
+    assert graph.backup_port('s1', 2, 's4') == 3
+
+
+def test_neighbour_at_the_same_distance_is_loop_free(graph):
+    # s2 works over s3 (port 3); s6 is at distance 2 like s2 itself: D(N,D) < D(N,S) + D(S,D) holds
+    assert graph.backup_port('s2', 3, 's4') == 1
+
+
+def test_neighbour_routing_back_is_not_loop_free():
+    graph = _line_graph()
+    # the only other neighbour of s1, s4, reaches s3 through s1
+    assert graph.backup_port('s1', 1, 's3') is None
+
+
+def test_unreachable_destination():
+    graph = _line_graph()
+    graph.switches.add('s9')
+    assert graph.backup_port('s9', 1, 's3') is None
+
+
+def test_precompute_backup_routes(graph):
+    routes = precompute_backup_routes(graph, SwitchTableEntryFactory(), 's1', {
+        ("10.0.2.0", 24): 2,
+        ("10.0.1.0", 24): 1,  # hosts of s1 itself, no alternate
+    })
+    assert len(routes) == 1
+    assert routes[0].table_name == "MyIngress.backup_routing_path_table"
+    assert routes[0].action_params == {"port": 3}
+
+
+class FakeSwitchConnection:
+    """Switch recording the table writes of FastReroute."""
+
+    def __init__(self) -> None:
+        self.writes = list()
+
+    def write_table_entry(self, entry_info):
+        self.writes.append(('insert', entry_info.action_params))
+
+    def modify_table_entry(self, entry_info):
+        self.writes.append(('modify', entry_info.action_params))
+
+    def delete_table_entry(self, entry_info):
+        self.writes.append(('delete', entry_info.action_params))
+
+
+def test_backup_route_follows_the_working_route(graph):
+    connection = FakeSwitchConnection()
+    fast_reroute = FastReroute(graph, {'s1': connection})
+    entry_factory = SwitchTableEntryFactory()
+    fast_reroute.install_backup_routes(entry_factory, {'s1': {("10.0.2.0", 24): 2}})
+    assert connection.writes == [('insert', {"port": 3})]
+
+    # the working route moved over the former backup port, e.g. by swap_protection_paths
+    fast_reroute.update_backup_route(entry_factory, 's1', "10.0.2.0", 24, 3)
+    assert connection.writes[-1] == ('modify', {"port": 2})
+    # nothing changed, nothing written
+    fast_reroute.update_backup_route(entry_factory, 's1', "10.0.2.0", 24, 3)
+    assert len(connection.writes) == 2
+
+
+def test_backup_route_without_alternate_is_removed():
+    graph = _line_graph()
+    graph.host_networks['10.0.3.0/24'] = 's3'
+    connection = FakeSwitchConnection()
+    fast_reroute = FastReroute(graph, {'s1': connection})
+    entry_factory = SwitchTableEntryFactory()
+    # towards s3 over s4 (port 2), s2 is a loop-free alternate
+    fast_reroute.update_backup_route(entry_factory, 's1', "10.0.3.0", 24, 2)
+    # back over s2 (port 1), s4 routes back through s1
+    fast_reroute.update_backup_route(entry_factory, 's1', "10.0.3.0", 24, 1)
+    assert connection.writes == [('insert', {"port": 1}), ('delete', {"port": 1})]
+    assert fast_reroute.backup_routes['s1'] == {}
+
+
+def test_unknown_switch():
+    with pytest.raises(KeyError):
+        FastReroute(_line_graph(), {}).update_backup_route(SwitchTableEntryFactory(), 's1', "10.0.3.0", 24, 1)
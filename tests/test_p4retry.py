@@ -0,0 +1,155 @@
+import grpc
+import pytest
+from google.protobuf import any_pb2
+from google.rpc import code_pb2, status_pb2
+from p4.v1 import p4runtime_pb2
+
+from controller.p4retry import RetryPolicy, classify_write_error, write_with_retry
+
+
+class FakeRpcError(grpc.RpcError):
+    """Write error as raised by the gRPC stub, with the per-update errors of a batch in its binary details."""
+
+    def __init__(self, status_code, update_codes=None):
+        self._status_code = status_code
+        self._metadata = ()
+        if update_codes is not None:
+            status = status_pb2.Status(code=code_pb2.UNKNOWN)
+            for update_code in update_codes:
+                detail = any_pb2.Any()
+                detail.Pack(p4runtime_pb2.Error(canonical_code=update_code, message=code_pb2.Code.Name(update_code)))
+                status.details.append(detail)
+            self._metadata = (("grpc-status-details-bin", status.SerializeToString()),)
+
+    def code(self):
+        return self._status_code
+
+    def details(self):
+        return self._status_code.name
+
+    def trailing_metadata(self):
+        return self._metadata
+
+
+def _update(update_type=p4runtime_pb2.Update.INSERT, table_id=1):
+    update = p4runtime_pb2.Update(type=update_type)
+    update.entity.table_entry.table_id = table_id
+    return update
+
+
+def test_unavailable_switch_is_transient():
+    updates = [_update(), _update()]
+    classified = classify_write_error(FakeRpcError(grpc.StatusCode.UNAVAILABLE), updates)
+    assert classified.transient == updates
+    assert classified.permanent == []
+    assert classified.congested
+
+
+def test_error_without_details_is_permanent():
+    classified = classify_write_error(FakeRpcError(grpc.StatusCode.INVALID_ARGUMENT), [_update()])
+    assert classified.transient == []
+    assert len(classified.permanent) == 1
+    assert classified.rpc_failed
+
+
+def test_per_update_errors_of_a_retry():
+    updates = [
+        _update(),  # succeeded
+        _update(),  # exists since the unacknowledged attempt, INSERT again as MODIFY
+        _update(p4runtime_pb2.Update.DELETE),  # already gone, done
+        _update(),  # switch busy, retry
+        _update(),  # table full
+        _update(),  # rejected
+    ]
+    error = FakeRpcError(grpc.StatusCode.UNKNOWN, [
+        code_pb2.OK, code_pb2.ALREADY_EXISTS, code_pb2.NOT_FOUND, code_pb2.UNAVAILABLE, code_pb2.RESOURCE_EXHAUSTED,
+        code_pb2.INVALID_ARGUMENT,
+    ])
+    classified = classify_write_error(error, updates, outcome_unknown=True)
+    assert [update.type for update in classified.rewritten] == [p4runtime_pb2.Update.MODIFY]
+    assert classified.transient == [updates[3]]
+    assert [update for update, _ in classified.permanent] == updates[4:]
+    assert classified.congested
+
+
+def test_existing_entry_on_a_first_attempt_is_a_clash():
+    updates = [_update()]
+    error = FakeRpcError(grpc.StatusCode.UNKNOWN, [code_pb2.ALREADY_EXISTS])
+    classified = classify_write_error(error, updates)
+    assert classified.rewritten == []
+    assert [update for update, _ in classified.permanent] == updates
+
+
+def test_full_table_is_not_congestion():
+    error = FakeRpcError(grpc.StatusCode.UNKNOWN, [code_pb2.RESOURCE_EXHAUSTED])
+    classified = classify_write_error(error, [_update()])
+    assert classified.transient == []
+    assert len(classified.permanent) == 1
+    assert not classified.congested
+
+
+def test_benign_errors_are_not_congestion():
+    updates = [_update(), _update(p4runtime_pb2.Update.DELETE)]
+    error = FakeRpcError(grpc.StatusCode.UNKNOWN, [code_pb2.ALREADY_EXISTS, code_pb2.NOT_FOUND])
+    assert not classify_write_error(error, updates, outcome_unknown=True).congested
+
+
+@pytest.mark.parametrize('attempt', [1, 3, 10])
+def test_backoff_is_jittered_and_capped(attempt):
+    policy = RetryPolicy(base_delay=0.05, max_delay=0.3)
+    delays = [policy.delay(attempt) for _ in range(200)]
+    assert all(0 <= delay <= min(0.3, 0.05 * 2 ** attempt) for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_write_with_retry_retries_transient_failures():
+    policy = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+    attempts = list()
+
+    def write(updates):
+        attempts.append(list(updates))
+        if len(attempts) < 3:
+            raise FakeRpcError(grpc.StatusCode.UNAVAILABLE)
+
+    assert write_with_retry(write, [_update()], policy) == []
+    assert len(attempts) == 3
+
+
+def test_write_with_retry_gives_up():
+    policy = RetryPolicy(max_attempts=2, base_delay=0, max_delay=0)
+
+    def write(updates):
+        raise FakeRpcError(grpc.StatusCode.DEADLINE_EXCEEDED)
+
+    failures = write_with_retry(write, [_update()], policy)
+    assert len(failures) == 1
+    assert 'after 2 attempts' in failures[0][1]
+
+
+def test_write_with_retry_resends_existing_entries_as_modify_after_a_failed_rpc():
+    policy = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+    attempts = list()
+
+    def write(updates):
+        attempts.append([update.type for update in updates])
+        if len(attempts) == 1:
+            raise FakeRpcError(grpc.StatusCode.DEADLINE_EXCEEDED)
+        if len(attempts) == 2:
+            raise FakeRpcError(grpc.StatusCode.UNKNOWN, [code_pb2.ALREADY_EXISTS, code_pb2.INVALID_ARGUMENT])
+
+    failures = write_with_retry(write, [_update(), _update(table_id=2)], policy)
+    assert attempts == [[p4runtime_pb2.Update.INSERT] * 2] * 2 + [[p4runtime_pb2.Update.MODIFY]]
+    assert len(failures) == 1
+
+
+def test_write_with_retry_does_not_overwrite_on_a_first_attempt():
+    policy = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+    attempts = list()
+
+    def write(updates):
+        attempts.append(list(updates))
+        raise FakeRpcError(grpc.StatusCode.UNKNOWN, [code_pb2.ALREADY_EXISTS])
+
+    failures = write_with_retry(write, [_update()], policy)
+    assert len(attempts) == 1
+    assert 'ALREADY_EXISTS' in failures[0][1]
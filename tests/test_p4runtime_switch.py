@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+from p4.v1 import p4runtime_pb2
+
+from utils.p4runtime_lib import switch
+from utils.p4runtime_lib.switch import SwitchConnection
+
+
+class FakeStreamChannel:
+    """Switch end of the stream: answers the arbitration, then sends messages, until the requests end."""
+
+    def __init__(self, requests, messages) -> None:
+        self.requests = requests
+        self.messages = messages
+        self.received = list()
+
+    def __iter__(self):
+        for request in self.requests:
+            self.received.append(request)
+            if request.HasField('arbitration'):
+                response = p4runtime_pb2.StreamMessageResponse()
+                response.arbitration.device_id = request.arbitration.device_id
+                yield response
+                yield from self.messages
+
+    def cancel(self) -> None:
+        pass
+
+
+class FakeP4RuntimeStub:
+    def __init__(self, channel) -> None:
+        self.stream_channel = None
+
+    def StreamChannel(self, requests):
+        self.stream_channel = FakeStreamChannel(requests, list())
+        return self.stream_channel
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    monkeypatch.setattr(switch.grpc, 'insecure_channel', lambda address: None)
+    monkeypatch.setattr(switch.p4runtime_pb2_grpc, 'P4RuntimeStub', FakeP4RuntimeStub)
+    monkeypatch.setattr(switch, 'connections', list())
+    connection = SwitchConnection(name='s1', device_id=3)
+    yield connection
+    connection.shutdown()
+
+
+def _packet_in(payload: bytes) -> p4runtime_pb2.StreamMessageResponse:
+    response = p4runtime_pb2.StreamMessageResponse()
+    response.packet.payload = payload
+    return response
+
+
+def test_stream_messages_go_to_the_handlers_of_their_type(connection):
+    connection.client_stub.stream_channel.messages = [_packet_in(b'one'), _packet_in(b'two')]
+    payloads = list()
+    received = threading.Event()
+
+    def on_packet(packet_in):
+        payloads.append(packet_in.payload)
+        if len(payloads) == 2:
+            received.set()
+
+    connection.AddStreamHandler('packet', on_packet)
+    connection.AddStreamHandler('digest', lambda digest_list: payloads.append('digest'))
+    # the handlers were registered after the stream was opened, the messages come after the arbitration
+    assert connection.MasterArbitrationUpdate().arbitration.device_id == 3
+    assert received.wait(timeout=5)
+    assert payloads == [b'one', b'two']
+
+
+def test_a_failing_handler_does_not_stop_the_stream(connection):
+    connection.client_stub.stream_channel.messages = [_packet_in(b'one'), _packet_in(b'two')]
+    payloads = list()
+    received = threading.Event()
+
+    def failing_handler(packet_in):
+        raise RuntimeError('handler failed')
+
+    def on_packet(packet_in):
+        payloads.append(packet_in.payload)
+        if len(payloads) == 2:
+            received.set()
+
+    connection.AddStreamHandler('packet', failing_handler)
+    connection.AddStreamHandler('packet', on_packet)
+    connection.MasterArbitrationUpdate()
+    assert received.wait(timeout=5)
+
+
+def test_unknown_message_types_are_rejected(connection):
+    with pytest.raises(ValueError):
+        connection.AddStreamHandler('packets', print)
+
+
+def test_shutdown_stops_the_reader(connection):
+    connection.shutdown()
+    assert not connection.stream_reader.is_alive()
@@ -0,0 +1,261 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import List, Optional
+
+import grpc
+import pytest
+from google.protobuf import any_pb2
+from google.rpc import code_pb2, status_pb2
+from p4.v1 import p4runtime_pb2
+
+from utils.p4runtime_lib.convert import decodeNum
+
+from controller import p4switch
+from controller.p4retry import RetryPolicy, WriteFailure
+from controller.p4switch import P4Switch, PipelinedWriteError, SwitchRoles
+
+P4INFO = """
+actions {
+  preamble { id: 1000 name: "MyIngress.forward" }
+  params { id: 1 name: "port" bitwidth: 9 }
+}
+action_profiles {
+  preamble { id: 2000 name: "MyIngress.working_path_selector" }
+  with_selector: true
+  size: 128
+}
+meters {
+  preamble { id: 5000 name: "MyEgress.ph_backup_meters" }
+  spec { unit: BYTES }
+  size: 1024
+}
+"""
+
+
+class FakeBmv2SwitchConnection:
+    """
+    Records the batches of updates written to the switch. Pipelined Writes are answered right away
+    with the next of replies (None for a success, or an error), or left in flight once there are none.
+    """
+
+    def __init__(self, name, address, device_id, proto_dump_file=None) -> None:
+        self.writes: List[List[p4runtime_pb2.Update]] = list()
+        self.replies: List[Optional[grpc.RpcError]] = list()
+        self.in_flight: List[Future] = list()
+        self.sent = threading.Semaphore(0)
+
+    def MasterArbitrationUpdate(self) -> None:
+        pass
+
+    def WriteUpdates(self, updates) -> None:
+        self.writes.append(list(updates))
+
+    def WriteUpdatesFuture(self, updates) -> Future:
+        self.writes.append(list(updates))
+        future = Future()
+        if self.replies:
+            error = self.replies.pop(0)
+            if error is None:
+                future.set_result(p4runtime_pb2.WriteResponse())
+            else:
+                future.set_exception(error)
+        else:
+            self.in_flight.append(future)
+        self.sent.release()
+        return future
+
+    def shutdown(self) -> None:
+        pass
+
+
+class FakeRpcError(grpc.RpcError):
+    """Write error, with the per-update errors of a batch in its binary details if update_codes are given."""
+
+    def __init__(self, status_code, update_codes=None) -> None:
+        self._status_code = status_code
+        self._metadata = ()
+        if update_codes is not None:
+            status = status_pb2.Status(code=code_pb2.UNKNOWN)
+            for update_code in update_codes:
+                detail = any_pb2.Any()
+                detail.Pack(p4runtime_pb2.Error(canonical_code=update_code, message=code_pb2.Code.Name(update_code)))
+                status.details.append(detail)
+            self._metadata = (("grpc-status-details-bin", status.SerializeToString()),)
+
+    def code(self):
+        return self._status_code
+
+    def details(self):
+        return self._status_code.name
+
+    def trailing_metadata(self):
+        return self._metadata
+
+
+class FakeAsyncBmv2SwitchConnection:
+    """Same as FakeBmv2SwitchConnection, each Write letting the other tasks run; failures are raised in turn."""
+
+    def __init__(self, name, address, device_id, proto_dump_file=None) -> None:
+        self.writes: List[List[p4runtime_pb2.Update]] = list()
+        self.failures: List[grpc.RpcError] = list()
+
+    async def MasterArbitrationUpdate(self) -> None:
+        pass
+
+    async def WriteUpdates(self, updates) -> None:
+        await asyncio.sleep(0)
+        if self.failures:
+            raise self.failures.pop(0)
+        self.writes.append(list(updates))
+
+    async def shutdown(self) -> None:
+        pass
+
+
+@pytest.fixture
+def switch(tmp_path):
+    p4info_path = tmp_path / 'switch.p4info.txt'
+    p4info_path.write_text(P4INFO)
+    return P4Switch(switch_id=0, name='s1', role=SwitchRoles.INGRESS, uri='localhost:50051',
+                    p4_dataplane_file_path=str(p4info_path), bmv2_json_file_path='switch.json', write_rate=None)
+
+
+@pytest.fixture
+def switch_connection(switch, monkeypatch):
+    monkeypatch.setattr(p4switch, 'Bmv2SwitchConnection', FakeBmv2SwitchConnection)
+    with switch.connect(push_pipeline=False) as switch_connection:
+        yield switch_connection
+
+
+def test_backup_rate_limit_modifies_the_meter_of_the_connection(switch_connection):
+    switch_connection.write_backup_rate_limit(7, rate=125000, burst=3000)
+    [[update]] = switch_connection.connection.writes
+    assert update.type == p4runtime_pb2.Update.MODIFY
+    meter_entry = update.entity.meter_entry
+    assert (meter_entry.meter_id, meter_entry.index.index) == (5000, 7)
+    config = meter_entry.config
+    assert (config.cir, config.cburst, config.pir, config.pburst) == (125000, 3000, 125000, 3000)
+
+
+def test_working_path_groups_create_each_member_once_before_the_groups(switch_connection):
+    switch_connection.write_working_path_groups({1: [2, 3]})
+    switch_connection.write_working_path_groups({2: [3, 4]})
+
+    writes = [[update.entity.WhichOneof('entity') for update in updates] for updates in switch_connection.connection.writes]
+    assert writes == [['action_profile_member'] * 2, ['action_profile_group'],
+                      ['action_profile_member'], ['action_profile_group']]
+    members = [update.entity.action_profile_member for updates in switch_connection.connection.writes
+               for update in updates if update.entity.HasField('action_profile_member')]
+    # a member is named after its port and forwards to it
+    assert [(member.member_id, decodeNum(member.action.params[0].value)) for member in members] == [(2, 2), (3, 3), (4, 4)]
+    group = switch_connection.connection.writes[-1][0].entity.action_profile_group
+    assert (group.group_id, group.max_size, [member.member_id for member in group.members]) == (2, 2, [3, 4])
+    assert switch_connection.switch.working_path_members == {2, 3, 4}
+
+
+def _clone_session_writes(connection):
+    return [update.type for updates in connection.writes for update in updates
+            if update.entity.packet_replication_engine_entry.HasField('clone_session_entry')]
+
+
+def test_async_clone_session_is_shared_and_removed_with_its_last_flow(switch, monkeypatch):
+    monkeypatch.setattr(p4switch, 'AsyncBmv2SwitchConnection', FakeAsyncBmv2SwitchConnection)
+
+    async def scenario():
+        async with switch.connect_async(push_pipeline=False) as switch_connection:
+            first, second = await asyncio.gather(switch_connection.acquire_clone_session(3),
+                                                 switch_connection.acquire_clone_session(3))
+            assert first.clone_session_id == second.clone_session_id
+            assert _clone_session_writes(switch_connection.connection) == [p4runtime_pb2.Update.INSERT]
+            await switch_connection.release_clone_session(first)
+            assert _clone_session_writes(switch_connection.connection) == [p4runtime_pb2.Update.INSERT]
+            await switch_connection.release_clone_session(second)
+            assert _clone_session_writes(switch_connection.connection) == [p4runtime_pb2.Update.INSERT,
+                                                                           p4runtime_pb2.Update.DELETE]
+
+    asyncio.run(scenario())
+
+
+def test_async_clone_session_is_written_again_after_a_failed_creation(switch, monkeypatch):
+    monkeypatch.setattr(p4switch, 'AsyncBmv2SwitchConnection', FakeAsyncBmv2SwitchConnection)
+
+    async def scenario():
+        async with switch.connect_async(push_pipeline=False) as switch_connection:
+            switch_connection.connection.failures.append(FakeRpcError(grpc.StatusCode.INVALID_ARGUMENT))
+            with pytest.raises(WriteFailure):
+                await switch_connection.acquire_clone_session(3)
+            await switch_connection.acquire_clone_session(3)
+            assert _clone_session_writes(switch_connection.connection) == [p4runtime_pb2.Update.INSERT]
+
+    asyncio.run(scenario())
+
+
+def test_async_clone_session_stays_after_a_failed_removal(switch, monkeypatch):
+    monkeypatch.setattr(p4switch, 'AsyncBmv2SwitchConnection', FakeAsyncBmv2SwitchConnection)
+
+    async def scenario():
+        async with switch.connect_async(push_pipeline=False) as switch_connection:
+            clone_session = await switch_connection.acquire_clone_session(3)
+            switch_connection.connection.failures.append(FakeRpcError(grpc.StatusCode.INVALID_ARGUMENT))
+            with pytest.raises(WriteFailure):
+                await switch_connection.release_clone_session(clone_session)
+            # the flow kept its reference and releases it again
+            await switch_connection.release_clone_session(clone_session)
+            assert _clone_session_writes(switch_connection.connection) == [p4runtime_pb2.Update.INSERT,
+                                                                           p4runtime_pb2.Update.DELETE]
+
+    asyncio.run(scenario())
+
+
+def _table_updates(count: int) -> List[p4runtime_pb2.Update]:
+    updates = [p4runtime_pb2.Update(type=p4runtime_pb2.Update.INSERT) for _ in range(count)]
+    for table_id, update in enumerate(updates, start=1):
+        update.entity.table_entry.table_id = table_id
+    return updates
+
+
+def test_pipelined_writer_keeps_at_most_window_requests_in_flight(switch_connection):
+    connection = switch_connection.connection
+    writer = switch_connection.pipelined_writer(window=2, batch_size=1)
+    feeder = threading.Thread(target=writer.write_updates, args=(_table_updates(3),))
+    feeder.start()
+    for _ in range(2):
+        assert connection.sent.acquire(timeout=5)
+    assert not connection.sent.acquire(timeout=0.1)
+
+    connection.in_flight.pop(0).set_result(p4runtime_pb2.WriteResponse())
+    assert connection.sent.acquire(timeout=5)
+    feeder.join(timeout=5)
+    for future in connection.in_flight:
+        future.set_result(p4runtime_pb2.WriteResponse())
+    writer.barrier()
+    assert writer.written == 3
+
+
+def test_pipelined_writer_rewrites_inserts_applied_by_a_failed_request(switch_connection):
+    switch_connection.switch.retry_policy = RetryPolicy(base_delay=0)
+    connection = switch_connection.connection
+    connection.replies = [
+        FakeRpcError(grpc.StatusCode.UNAVAILABLE),
+        # the first request was applied after all
+        FakeRpcError(grpc.StatusCode.UNKNOWN, [code_pb2.ALREADY_EXISTS, code_pb2.OK]),
+        None,
+    ]
+    with switch_connection.pipelined_writer(window=1, batch_size=2) as writer:
+        writer.write_updates(_table_updates(2))
+    assert [update.type for update in connection.writes[-1]] == [p4runtime_pb2.Update.MODIFY]
+    assert writer.written == 2
+
+
+def test_pipelined_writer_raises_updates_failing_for_good(switch_connection):
+    connection = switch_connection.connection
+    # without an unknown outcome before it, an existing entry is a clash
+    connection.replies = [FakeRpcError(grpc.StatusCode.UNKNOWN, [code_pb2.OK, code_pb2.ALREADY_EXISTS]), None]
+    writer = switch_connection.pipelined_writer(window=2, batch_size=2)
+    writer.write_updates(_table_updates(4))
+    with pytest.raises(PipelinedWriteError) as failure:
+        writer.barrier()
+    assert [update.entity.table_entry.table_id for update, _ in failure.value.failures] == [2]
+    assert writer.written == 3
+    assert len(connection.writes) == 2
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+from p4.v1 import p4runtime_pb2
+
+from utils.p4runtime_lib.convert import encodeNum
+
+from controller.p4telemetry import DROP_DIGEST_NAME, ConnectionDrops, DropTelemetry
+
+DIGEST_ID = 400
+
+
+class FakeStreamConnection:
+    def __init__(self) -> None:
+        self.acked = list()
+        self.handlers = list()
+
+    def AckDigestList(self, digest_list) -> None:
+        self.acked.append(digest_list.list_id)
+
+    def AddStreamHandler(self, message_type, handler) -> None:
+        self.handlers.append((message_type, handler))
+
+    def RemoveStreamHandler(self, message_type, handler) -> None:
+        self.handlers.remove((message_type, handler))
+
+
+class FakeSwitchConnection:
+    def __init__(self) -> None:
+        self.connection = FakeStreamConnection()
+        self.switch = SimpleNamespace(name='s4', p4_api=SimpleNamespace(get_digests_id=lambda name: DIGEST_ID))
+        self.digest_configs = list()
+
+    def write_digest_config(self, digest_name, max_timeout_ns, max_list_size, ack_timeout_ns) -> None:
+        self.digest_configs.append(digest_name)
+
+
+def _digest_list(list_id, *drops, digest_id=DIGEST_ID):
+    digest_list = p4runtime_pb2.DigestList(digest_id=digest_id, list_id=list_id)
+    for fields in drops:
+        data = digest_list.data.add()
+        for value, bitwidth in zip(fields, (8, 32, 32, 32)):
+            data.struct.members.add().bitstring = encodeNum(value, bitwidth)
+    return digest_list
+
+
+def test_drops_are_aggregated_per_connection():
+    switch_connection = FakeSwitchConnection()
+    telemetry = DropTelemetry(switch_connection)
+    telemetry.start()
+    assert switch_connection.digest_configs == [DROP_DIGEST_NAME]
+    [(message_type, handler)] = switch_connection.connection.handlers
+    assert message_type == 'digest'
+
+    # connection ID, duplicates, out of window copies, last clone ID
+    handler(_digest_list(1, (3, 10, 0, 100), (5, 1, 2, 7)))
+    handler(_digest_list(2, (3, 4, 1, 120)))
+
+    assert switch_connection.connection.acked == [1, 2]
+    assert telemetry.drops(3) == ConnectionDrops(duplicates=14, out_of_window=1, last_clone_id=120, digests=2)
+    assert telemetry.snapshot() == {
+        3: ConnectionDrops(duplicates=14, out_of_window=1, last_clone_id=120, digests=2),
+        5: ConnectionDrops(duplicates=1, out_of_window=2, last_clone_id=7, digests=1),
+    }
+    assert telemetry.drops(9) == ConnectionDrops()
+
+
+def test_other_digests_are_left_alone():
+    switch_connection = FakeSwitchConnection()
+    telemetry = DropTelemetry(switch_connection)
+    telemetry.start()
+    telemetry.on_digest(_digest_list(1, (3, 10, 0, 100), digest_id=DIGEST_ID + 1))
+    assert switch_connection.connection.acked == []
+    assert telemetry.snapshot() == dict()
+    telemetry.stop()
+    assert switch_connection.connection.handlers == []
+
+
+def test_drops_are_copies():
+    switch_connection = FakeSwitchConnection()
+    telemetry = DropTelemetry(switch_connection)
+    telemetry.start()
+    telemetry.on_digest(_digest_list(1, (3, 10, 0, 100)))
+    telemetry.drops(3).duplicates = 0
+    assert telemetry.drops(3).duplicates == 10
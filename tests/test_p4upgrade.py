@@ -0,0 +1,160 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import google.protobuf.text_format
+from p4.config.v1 import p4info_pb2
+from p4.v1 import p4runtime_pb2
+
+from utils.p4runtime_lib.helper import P4InfoHelper
+
+from controller import p4upgrade
+from controller.p4clonesession import CloneSessionRegistry
+from controller.p4forwardingtables import ConnectionIdPool
+
+
+def _p4_api(table_id, match_field_id, action_id, param_id, register_id, has_meter=True):
+    """P4Info of a program with one table, one action, one register and, optionally, one meter."""
+    p4info = p4info_pb2.P4Info()
+    google.protobuf.text_format.Merge(f"""
+        tables {{
+          preamble {{ id: {table_id} name: "MyIngress.ipv4_lpm" }}
+          match_fields {{ id: {match_field_id} name: "hdr.ipv4.dstAddr" bitwidth: 32 match_type: LPM }}
+          action_refs {{ id: {action_id} }}
+        }}
+        actions {{
+          preamble {{ id: {action_id} name: "MyIngress.forward" }}
+          params {{ id: {param_id} name: "port" bitwidth: 9 }}
+        }}
+        registers {{
+          preamble {{ id: {register_id} name: "MyIngress.ph_expected_next_clone_ids" }}
+          type_spec {{ bitstring {{ bit {{ bitwidth: 16 }} }} }}
+          size: 8
+        }}
+        registers {{
+          preamble {{ id: {register_id + 1} name: "MyIngress.ph_last_epochs" }}
+          type_spec {{ bitstring {{ bit {{ bitwidth: 8 }} }} }}
+          size: 8
+        }}
+    """, p4info)
+    if has_meter:
+        meter = p4info.meters.add()
+        meter.preamble.id = 5000
+        meter.preamble.name = "MyEgress.ph_backup_meters"
+    return P4InfoHelper.fromP4Info(p4info)
+
+
+OLD_API = _p4_api(table_id=100, match_field_id=1, action_id=200, param_id=1, register_id=300)
+NEW_API = _p4_api(table_id=101, match_field_id=2, action_id=201, param_id=3, register_id=310, has_meter=False)
+
+
+def _table_entry(p4_api, port):
+    entry = p4runtime_pb2.TableEntry()
+    entry.table_id = p4_api.get_tables_id("MyIngress.ipv4_lpm")
+    match = entry.match.add()
+    match.field_id = p4_api.get_match_field_id("MyIngress.ipv4_lpm", "hdr.ipv4.dstAddr")
+    match.lpm.value = b'\x0a\x00\x02\x00'
+    match.lpm.prefix_len = 24
+    entry.action.action.action_id = p4_api.get_actions_id("MyIngress.forward")
+    param = entry.action.action.params.add()
+    param.param_id = p4_api.get_action_param_id("MyIngress.forward", "port")
+    param.value = bytes([port])
+    return entry
+
+
+def _snapshot(**fields):
+    snapshot = dict(
+        p4_api=OLD_API,
+        table_entries=[],
+        pre_entries=[],
+        action_profile_members=[],
+        action_profile_groups=[],
+        meter_entries=[],
+        digest_entries=[],
+        registers=dict(),
+        clone_sessions=CloneSessionRegistry(),
+        connection_ids=ConnectionIdPool(),
+        multicast_groups=dict(),
+        connection_epochs=dict(),
+        working_path_members=set())
+    snapshot.update(fields)
+    return p4upgrade.PipelineSnapshot(**snapshot)
+
+
+class FakeSwitchConnection:
+    def __init__(self, p4_api):
+        self.switch = SimpleNamespace(name='s1', p4_api=p4_api, clone_sessions=None, multicast_groups=None,
+                                      working_path_members=None, connection_epochs=None, connection_ids=None)
+        self.writes = []
+
+    def write_updates(self, updates, batch_size=None):
+        self.writes.append(list(updates))
+
+
+def test_translate_table_entry_maps_ids_by_name():
+    translated = p4upgrade.translate_table_entry(_table_entry(OLD_API, 3), OLD_API, NEW_API)
+    assert translated.SerializeToString() == _table_entry(NEW_API, 3).SerializeToString()
+
+
+def test_translate_table_entry_drops_entries_the_new_program_lacks():
+    old_api = _p4_api(table_id=100, match_field_id=1, action_id=200, param_id=1, register_id=300)
+    old_api.p4info.tables[0].preamble.name = "MyIngress.removed_table"
+    entry = _table_entry(OLD_API, 3)
+    assert p4upgrade.translate_table_entry(entry, old_api, NEW_API) is None
+
+
+def test_restore_switch_writes_tables_last():
+    pre_entry = p4runtime_pb2.PacketReplicationEngineEntry()
+    pre_entry.clone_session_entry.session_id = 1
+    meter_entry = p4runtime_pb2.MeterEntry(meter_id=5000)
+    meter_entry.config.cir = 100
+    snapshot = _snapshot(pre_entries=[pre_entry],
+                         table_entries=[_table_entry(OLD_API, 2)],
+                         meter_entries=[meter_entry],
+                         registers={"MyIngress.ph_expected_next_clone_ids": {1: 7},
+                                    "MyIngress.ph_last_epochs": {1: 2}},
+                         connection_epochs={1: 1})
+    switch_connection = FakeSwitchConnection(NEW_API)
+    p4upgrade.restore_switch(switch_connection, snapshot,
+                             skipped_registers=p4upgrade.INGRESS_SEQUENCE_REGISTERS)
+
+    written = [[update.entity.WhichOneof('entity') for update in updates]
+               for updates in switch_connection.writes if updates]
+    # PRE entries before the tables referring to them; the meter is gone from the new program
+    assert written == [['packet_replication_engine_entry'], ['register_entry'], ['table_entry']]
+    register_update = switch_connection.writes[3][0]
+    assert register_update.type == p4runtime_pb2.Update.MODIFY
+    assert register_update.entity.register_entry.register_id == NEW_API.get_registers_id("MyIngress.ph_last_epochs")
+    assert switch_connection.writes[-1][0].entity.table_entry.table_id == 101
+    assert switch_connection.switch.connection_epochs == {1: 1}
+    assert switch_connection.switch.connection_ids is snapshot.connection_ids
+
+
+class FakeEgressSwitch:
+    def __init__(self, last_epochs):
+        self.last_epochs = last_epochs
+
+    @contextmanager
+    def connect(self, push_pipeline=True):
+        yield self
+
+    def read_register_array(self, register_name):
+        return dict(self.last_epochs)
+
+
+def test_resync_ingress_connections_bumps_each_connection_once_on_its_egress(monkeypatch):
+    bumped = []
+    monkeypatch.setattr(p4upgrade, 'bump_connection_epoch',
+                        lambda ingress, egress, entry_factory, connection_id: bumped.append((egress, connection_id)))
+    first_egress = FakeEgressSwitch({2: 1})
+    last_egress = FakeEgressSwitch({})
+    # connection 1 only has an epoch, 2 and 3 only sequence state
+    snapshot = _snapshot(connection_epochs={1: 0}, registers={"MyIngress.ph_expected_next_clone_ids": {2: 5, 3: 9}})
+    p4upgrade.resync_ingress_connections(FakeSwitchConnection(NEW_API), snapshot, [first_egress, last_egress])
+    assert sorted(bumped, key=lambda bump: bump[1]) == [(last_egress, 1), (first_egress, 2), (last_egress, 3)]
+
+
+def test_resync_ingress_connections_without_state_reads_nothing(monkeypatch):
+    monkeypatch.setattr(p4upgrade, 'bump_connection_epoch', None)
+    egress = FakeEgressSwitch({})
+    egress.connect = None
+    p4upgrade.resync_ingress_connections(FakeSwitchConnection(NEW_API), _snapshot(), [egress])
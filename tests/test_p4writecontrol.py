@@ -0,0 +1,61 @@
+import time
+
+from controller.p4writecontrol import AdaptiveWriteControl
+
+
+def test_replies_under_the_target_grow_batch_and_window():
+    control = AdaptiveWriteControl(initial_batch_size=100, initial_window=4, batch_step=10, target_latency=10.0)
+    control.record(100, time.monotonic())
+    assert control.batch_size == 110
+    assert control._window == 4.25
+
+
+def test_growth_is_bounded():
+    control = AdaptiveWriteControl(initial_batch_size=995, initial_window=64, max_batch_size=1000, max_window=64,
+                                   target_latency=10.0)
+    control.record(1, time.monotonic())
+    assert control.batch_size == 1000
+    assert control.window == 64
+
+
+def test_failure_halves_batch_and_window():
+    control = AdaptiveWriteControl(initial_batch_size=100, initial_window=16, decrease_factor=0.5)
+    control.record(100, time.monotonic(), failed=True)
+    assert control.batch_size == 50
+    assert control.window == 8
+    assert control.metrics().failures == 1
+
+
+def test_single_congestion_event_decreases_once():
+    control = AdaptiveWriteControl(initial_batch_size=100, initial_window=16, decrease_factor=0.5)
+    sent_at = time.monotonic()
+    # replies to requests that were all in flight when the first failure came back
+    for _ in range(4):
+        control.record(100, sent_at, failed=True)
+    assert control.batch_size == 50
+    assert control.window == 8
+    control.record(100, time.monotonic(), failed=True)
+    assert control.batch_size == 25
+
+
+def test_decrease_is_bounded():
+    control = AdaptiveWriteControl(initial_batch_size=2, initial_window=2, min_batch_size=2, min_window=1)
+    control.record(1, time.monotonic(), failed=True)
+    assert control.batch_size == 2
+    assert control.window == 1
+
+
+def test_latency_over_the_target_decreases():
+    control = AdaptiveWriteControl(initial_batch_size=100, initial_window=16, target_latency=0.001)
+    control.record(100, time.monotonic() - 1.0)
+    assert control.batch_size == 50
+
+
+def test_metrics_count_acknowledged_updates():
+    control = AdaptiveWriteControl(target_latency=10.0, throughput_period=60.0)
+    control.record(30, time.monotonic())
+    control.record(20, time.monotonic(), failed=True)
+    metrics = control.metrics()
+    assert metrics.requests == 2
+    assert metrics.updates == 30
+    assert metrics.throughput == 30 / 60.0
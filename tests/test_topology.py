@@ -0,0 +1,115 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from controller import topology
+from controller.p4clonesession import CloneSession
+from controller.p4forwardingtables import ConnectionIdPool, SwitchTableEntryFactory, hashed_connection_id
+from controller.p4reroute import NetworkGraph
+
+TOPOLOGY_PATH = os.path.join(os.path.dirname(__file__), '..', 'topology.json')
+
+
+class FakeSwitchConnection:
+    """Records the writes of a connection, in order, into a log shared by both ends of a protected flow."""
+
+    def __init__(self, name, log):
+        self.switch = SimpleNamespace(name=name, connection_ids=ConnectionIdPool())
+        self.log = log
+
+    def write_table_entry(self, table_entry):
+        self.log.append((self.switch.name, 'entry', table_entry.action_name))
+
+    def write_multipath_protected_flow(self, multicast_group_id, egress_ports):
+        # the slot must already be taken when the group starts replicating
+        reserved = self.switch.connection_ids.references(hashed_connection_id("10.0.1.100", "10.0.2.100"))
+        self.log.append((self.switch.name, 'group', multicast_group_id, tuple(egress_ports), reserved))
+
+
+@pytest.fixture
+def switch_entries():
+    entry_factory = SwitchTableEntryFactory()
+    path_pair = topology._ingress_protected_path_pair(entry_factory, CloneSession(1, 2, 500))
+    return {
+        's1': topology._ingress_switch_entries(entry_factory, path_pair),
+        's2': topology._transit_top_left_switch_entries(entry_factory),
+        's3': topology._transit_top_right_switch_entries(entry_factory),
+        's4': topology._egress_switch_entries(entry_factory),
+        's5': topology._transit_bottom_right_switch_entries(entry_factory),
+        's6': topology._transit_bottom_left_switch_entries(entry_factory),
+    }
+
+
+def _by_table(entries, table_name):
+    return [entry for entry in entries if entry.table_name == table_name]
+
+
+def test_every_link_between_switches_works_both_ways(switch_entries):
+    graph = NetworkGraph.from_topology_file(TOPOLOGY_PATH)
+    for switch in sorted(graph.switches):
+        entries = switch_entries[switch]
+        port_macs = {entry.match_fields["standard_metadata.egress_port"]: entry.action_params["mac"]
+                     for entry in _by_table(entries, "MyEgress.port_mac_table")}
+        next_hops = {entry.match_fields["standard_metadata.egress_port"]: entry.action_params["dstAddr"]
+                     for entry in _by_table(entries, "MyEgress.next_hop_table")}
+        for port, (neighbour, neighbour_port) in graph.links[switch].items():
+            if neighbour not in graph.switches:
+                continue
+            neighbour_entries = switch_entries[neighbour]
+            accepted = {(entry.match_fields["hdr.ethernet.dstAddr"], entry.match_fields["standard_metadata.ingress_port"])
+                        for entry in _by_table(neighbour_entries, "MyIngress.interface_mac_address")}
+            # what the switch sends over the link is addressed to the neighbour port, which accepts it
+            assert (next_hops[port], neighbour_port) in accepted, (switch, port)
+            neighbour_port_mac = [entry.action_params["mac"] for entry in _by_table(neighbour_entries, "MyEgress.port_mac_table")
+                                  if entry.match_fields["standard_metadata.egress_port"] == neighbour_port]
+            assert neighbour_port_mac == [next_hops[port]], (switch, port)
+            assert port in port_macs, (switch, port)
+
+
+def test_no_entry_is_written_twice(switch_entries):
+    for switch, entries in switch_entries.items():
+        keys = [(entry.table_name, tuple(sorted(map(str, entry.match_fields.items())))) for entry in entries]
+        assert len(keys) == len(set(keys)), switch
+
+
+def test_egress_lan_has_a_next_hop_per_host(switch_entries):
+    next_hops = {(entry.match_fields["hdr.ipv4.dstAddr"], entry.action_params["dstAddr"])
+                 for entry in _by_table(switch_entries['s4'], "MyEgress.next_hop_table")
+                 if entry.match_fields["standard_metadata.egress_port"] == 1}
+    assert next_hops == {(("10.0.2.100", 32), "08:00:00:00:02:22"), (("10.0.2.101", 32), "08:00:00:00:02:23")}
+
+
+def test_protect_flow_multipath_programs_the_egress_first():
+    log = []
+    ingress_connection = FakeSwitchConnection('s1', log)
+    egress_connection = FakeSwitchConnection('s4', log)
+    topology.protect_flow_multipath(ingress_connection, egress_connection, SwitchTableEntryFactory(),
+                                    "10.0.1.100", "10.0.2.100", [2, 3], 7)
+    assert log == [
+        ('s4', 'entry', "MyIngress.associate_hashed_protected_details"),
+        ('s1', 'group', 7, (2, 3), 1),
+        ('s1', 'entry', "MyIngress.associate_multipath_protected_details"),
+    ]
+
+
+class FakeEpochConnection:
+    def __init__(self, last_epochs=None):
+        self.last_epochs = last_epochs or dict()
+        self.epochs = []
+
+    def read_register(self, register_name, index):
+        assert register_name == "MyIngress.ph_last_epochs"
+        return self.last_epochs.get(index, 0)
+
+    def write_connection_epoch(self, epoch_entry, connection_id, epoch):
+        self.epochs.append((connection_id, epoch, epoch_entry.action_params["epoch"]))
+
+
+@pytest.mark.parametrize("last_epoch, epoch", [(0, 0), (1, 1), (3, 3), (4, 0)])
+def test_bump_connection_epoch_moves_past_the_last_epoch_seen(last_epoch, epoch):
+    # the egress stores the epoch it last saw plus one, 0 if it has not seen any
+    ingress_connection = FakeEpochConnection()
+    egress_connection = FakeEpochConnection({5: last_epoch})
+    assert topology.bump_connection_epoch(ingress_connection, egress_connection, SwitchTableEntryFactory(), 5) == epoch
+    assert ingress_connection.epochs == [(5, epoch, epoch)]
@@ -14,7 +14,7 @@
 #
 from p4.tmp import p4config_pb2
 
-from .switch import SwitchConnection
+from .switch import AsyncSwitchConnection, SwitchConnection
 
 
 def buildDeviceConfig(bmv2_json_file_path=None):
@@ -29,3 +29,8 @@ def buildDeviceConfig(bmv2_json_file_path=None):
 class Bmv2SwitchConnection(SwitchConnection):
     def buildDeviceConfig(self, **kwargs):
         return buildDeviceConfig(**kwargs)
+
+
+class AsyncBmv2SwitchConnection(AsyncSwitchConnection):
+    def buildDeviceConfig(self, **kwargs):
+        return buildDeviceConfig(**kwargs)
@@ -18,7 +18,7 @@ import google.protobuf.text_format
 from p4.config.v1 import p4info_pb2
 from p4.v1 import p4runtime_pb2
 
-from .convert import encode
+from .convert import decodeNum, encode
 
 
 class P4InfoHelper(object):
@@ -29,6 +29,13 @@ class P4InfoHelper(object):
             google.protobuf.text_format.Merge(p4info_f.read(), p4info)
         self.p4info = p4info
 
+    @classmethod
+    def fromP4Info(cls, p4info):
+        "Builds the helper from a P4Info message, e.g. the one installed on a switch"
+        helper = cls.__new__(cls)
+        helper.p4info = p4info
+        return helper
+
     def get(self, entity_type, name=None, id=None):
         if name is not None and id is not None:
             raise AssertionError("name or id must be None")
@@ -92,6 +99,13 @@ class P4InfoHelper(object):
     def get_match_field_name(self, table_name, match_field_id):
         return self.get_match_field(table_name, id=match_field_id).name
 
+    def requires_priority(self, table_name):
+        for t in self.p4info.tables:
+            if t.preamble.name == table_name:
+                return any(mf.match_type in (p4info_pb2.MatchField.TERNARY, p4info_pb2.MatchField.RANGE)
+                           for mf in t.match_fields)
+        raise AttributeError("Could not find table %r" % table_name)
+
     def get_match_field_pb(self, table_name, match_field_name, value):
         p4info_match = self.get_match_field(table_name, match_field_name)
         bitwidth = p4info_match.bitwidth
@@ -164,32 +178,119 @@ class P4InfoHelper(object):
                         default_action=False,
                         action_name=None,
                         action_params=None,
-                        priority=None):
+                        priority=None,
+                        member_id=None,
+                        group_id=None,
+                        idle_timeout_ns=0):
         table_entry = p4runtime_pb2.TableEntry()
         table_entry.table_id = self.get_tables_id(table_name)
+        # only for tables with support_timeout, 0 means the entry never ages
+        table_entry.idle_timeout_ns = idle_timeout_ns
 
         if priority is not None:
+            if priority <= 0:
+                raise ValueError("priority must be a positive integer, got %r" % priority)
             table_entry.priority = priority
+        elif not default_action and self.requires_priority(table_name):
+            raise ValueError("table %r has ternary or range keys, entries need a priority" % table_name)
 
         if match_fields:
-            table_entry.match.extend([
+            match_pbs = [
                 self.get_match_field_pb(table_name, match_field_name, value)
                 for match_field_name, value in match_fields.items()
+            ]
+            # P4Runtime requires don't-care ternary and LPM fields to be omitted from the entry
+            table_entry.match.extend([
+                match_pb for match_pb in match_pbs
+                if not (match_pb.HasField("ternary") and not any(match_pb.ternary.mask))
+                and not (match_pb.HasField("lpm") and match_pb.lpm.prefix_len == 0)
             ])
 
         if default_action:
             table_entry.is_default_action = True
 
         if action_name:
-            action = table_entry.action.action
-            action.action_id = self.get_actions_id(action_name)
-            if action_params:
-                action.params.extend([
-                    self.get_action_param_pb(action_name, field_name, value)
-                    for field_name, value in action_params.items()
-                ])
+            table_entry.action.action.CopyFrom(self.buildAction(action_name, action_params))
+        elif member_id is not None:
+            # tables with an action profile refer to one of its members or groups
+            table_entry.action.action_profile_member_id = member_id
+        elif group_id is not None:
+            table_entry.action.action_profile_group_id = group_id
         return table_entry
 
+    def buildAction(self, action_name, action_params=None):
+        action = p4runtime_pb2.Action()
+        action.action_id = self.get_actions_id(action_name)
+        if action_params:
+            action.params.extend([
+                self.get_action_param_pb(action_name, field_name, value)
+                for field_name, value in action_params.items()
+            ])
+        return action
+
+    def buildActionProfileMember(self, action_profile_name, member_id, action_name, action_params=None):
+        member = p4runtime_pb2.ActionProfileMember()
+        member.action_profile_id = self.get_action_profiles_id(action_profile_name)
+        member.member_id = member_id
+        member.action.CopyFrom(self.buildAction(action_name, action_params))
+        return member
+
+    def buildActionProfileGroup(self, action_profile_name, group_id, member_ids, max_size=0):
+        "Members are given as ids or as (id, weight) pairs"
+        group = p4runtime_pb2.ActionProfileGroup()
+        group.action_profile_id = self.get_action_profiles_id(action_profile_name)
+        group.group_id = group_id
+        group.max_size = max_size
+        for member in member_ids:
+            member_id, weight = member if isinstance(member, tuple) else (member, 1)
+            group.members.add(member_id=member_id, weight=weight)
+        return group
+
+    def buildPacketOut(self, payload, metadata=None):
+        "Builds a PacketOut, metadata being the fields of the packet_out controller header by name"
+        packet_out = p4runtime_pb2.PacketOut()
+        packet_out.payload = payload
+        if metadata:
+            header = self.get("controller_packet_metadata", name="packet_out")
+            for field in header.metadata:
+                if field.name in metadata:
+                    packet_out.metadata.add(metadata_id=field.id, value=encode(metadata[field.name], field.bitwidth))
+        return packet_out
+
+    def get_packet_in_metadata(self, packet_in):
+        "Returns the fields of the packet_in controller header of a PacketIn by name"
+        header = self.get("controller_packet_metadata", name="packet_in")
+        names = {field.id: field.name for field in header.metadata}
+        return {names[metadata.metadata_id]: decodeNum(metadata.value) for metadata in packet_in.metadata}
+
+    def buildRegisterEntry(self, register_name, index, value):
+        register = self.get('registers', name=register_name)
+        register_entry = p4runtime_pb2.RegisterEntry()
+        register_entry.register_id = register.preamble.id
+        register_entry.index.index = index
+        register_entry.data.bitstring = encode(value, register.type_spec.bitstring.bit.bitwidth)
+        return register_entry
+
+    def buildMeterConfigEntry(self, meter_name, index, cir, cburst, pir, pburst):
+        "Rates are in units (bytes or packets, as per the meter type) per second, bursts in units"
+        meter_entry = p4runtime_pb2.MeterEntry()
+        meter_entry.meter_id = self.get_meters_id(meter_name)
+        meter_entry.index.index = index
+        meter_entry.config.cir = cir
+        meter_entry.config.cburst = cburst
+        meter_entry.config.pir = pir
+        meter_entry.config.pburst = pburst
+        return meter_entry
+
+    def buildDigestEntry(self, digest_name, max_timeout_ns=0, max_list_size=1, ack_timeout_ns=0):
+        "The switch sends a DigestList once it holds max_list_size digests or after max_timeout_ns"
+        digest_entry = p4runtime_pb2.DigestEntry()
+        digest_entry.digest_id = self.get_digests_id(digest_name)
+        digest_entry.config.max_timeout_ns = max_timeout_ns
+        digest_entry.config.max_list_size = max_list_size
+        digest_entry.config.ack_timeout_ns = ack_timeout_ns
+        return digest_entry
+
     def buildMulticastGroupEntry(self, multicast_group_id, replicas):
         mc_entry = p4runtime_pb2.PacketReplicationEngineEntry()
         mc_entry.multicast_group_entry.multicast_group_id = multicast_group_id
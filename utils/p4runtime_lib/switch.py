@@ -12,19 +12,148 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import asyncio
+import inspect
+import logging
+import threading
 from abc import abstractmethod
 from datetime import datetime
-from queue import Queue
+from queue import Empty, Full, Queue
 
 import grpc
+from grpc import aio
 from p4.tmp import p4config_pb2
 from p4.v1 import p4runtime_pb2, p4runtime_pb2_grpc
 
 MSG_LOG_MAX_LEN = 1024
 
+# outgoing stream messages (arbitration, packet-outs, digest acks) waiting to be sent
+STREAM_QUEUE_SIZE = 1024
+# seconds MasterArbitrationUpdate waits for the switch to answer
+ARBITRATION_TIMEOUT = 10
+
+# kinds of StreamMessageResponse, i.e. the 'update' oneof, handlers can be registered for
+STREAM_MESSAGE_TYPES = [f.name for f in p4runtime_pb2.StreamMessageResponse.DESCRIPTOR.oneofs_by_name['update'].fields]
+
 # List of all active connections
 connections = []
 
+# Entity oneof field for each entry message, e.g. 'TableEntry' -> 'table_entry'
+ENTITY_FIELDS = {f.message_type.name: f.name for f in p4runtime_pb2.Entity.DESCRIPTOR.fields}
+
+def buildUpdate(entry, update_type=p4runtime_pb2.Update.INSERT):
+    "Wraps a table, PRE, register, meter, ... entry into a Write update"
+    update = p4runtime_pb2.Update()
+    update.type = update_type
+    getattr(update.entity, ENTITY_FIELDS[entry.DESCRIPTOR.name]).CopyFrom(entry)
+    return update
+
+def buildWriteRequest(device_id, updates):
+    "Wraps updates into a Write request of the primary controller"
+    request = p4runtime_pb2.WriteRequest()
+    request.device_id = device_id
+    request.election_id.low = 1
+    request.updates.extend(updates)
+    return request
+
+def buildArbitrationRequest(device_id):
+    "Stream message claiming the primary controller role"
+    request = p4runtime_pb2.StreamMessageRequest()
+    request.arbitration.device_id = device_id
+    request.arbitration.election_id.high = 0
+    request.arbitration.election_id.low = 1
+    return request
+
+def buildDigestAckRequest(digest_list):
+    request = p4runtime_pb2.StreamMessageRequest()
+    request.digest_ack.digest_id = digest_list.digest_id
+    request.digest_ack.list_id = digest_list.list_id
+    return request
+
+def buildPacketOutRequest(packet_out):
+    request = p4runtime_pb2.StreamMessageRequest()
+    request.packet.CopyFrom(packet_out)
+    return request
+
+def buildSetPipelineConfigRequest(device_id, p4info, device_config):
+    request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
+    request.election_id.low = 1
+    request.device_id = device_id
+    config = request.config
+
+    config.p4info.CopyFrom(p4info)
+    config.p4_device_config = device_config.SerializeToString()
+
+    request.action = p4runtime_pb2.SetForwardingPipelineConfigRequest.VERIFY_AND_COMMIT
+    return request
+
+def buildGetPipelineConfigRequest(device_id):
+    request = p4runtime_pb2.GetForwardingPipelineConfigRequest()
+    request.device_id = device_id
+    request.response_type = p4runtime_pb2.GetForwardingPipelineConfigRequest.P4INFO_AND_COOKIE
+    return request
+
+def buildTableEntryUpdate(table_entry):
+    "INSERT of a table entry, MODIFY of the default action"
+    if table_entry.is_default_action:
+        return buildUpdate(table_entry, p4runtime_pb2.Update.MODIFY)
+    return buildUpdate(table_entry, p4runtime_pb2.Update.INSERT)
+
+def buildReadRequest(device_id):
+    request = p4runtime_pb2.ReadRequest()
+    request.device_id = device_id
+    return request
+
+def buildTableReadRequest(device_id, table_id=None):
+    "Reads the entries of a table, 0 being the wildcard ID"
+    request = buildReadRequest(device_id)
+    request.entities.add().table_entry.table_id = table_id if table_id is not None else 0
+    return request
+
+def buildCounterReadRequest(device_id, counter_id=None, index=None):
+    "Reads a counter cell, or all of them without an index"
+    request = buildReadRequest(device_id)
+    counter_entry = request.entities.add().counter_entry
+    counter_entry.counter_id = counter_id if counter_id is not None else 0
+    if index is not None:
+        counter_entry.index.index = index
+    return request
+
+def buildRegisterReadRequest(device_id, register_id=None, index=None):
+    "Reads a register cell, or all of them without an index"
+    request = buildReadRequest(device_id)
+    register_entry = request.entities.add().register_entry
+    register_entry.register_id = register_id if register_id is not None else 0
+    if index is not None:
+        register_entry.index.index = index
+    return request
+
+def buildPREReadRequest(device_id):
+    "Reads all clone sessions and multicast groups, 0 being the wildcard ID"
+    request = buildReadRequest(device_id)
+    request.entities.add().packet_replication_engine_entry.clone_session_entry.session_id = 0
+    request.entities.add().packet_replication_engine_entry.multicast_group_entry.multicast_group_id = 0
+    return request
+
+def buildActionProfileReadRequest(device_id, action_profile_id):
+    "Reads all members and groups of an action profile"
+    request = buildReadRequest(device_id)
+    request.entities.add().action_profile_member.action_profile_id = action_profile_id
+    request.entities.add().action_profile_group.action_profile_id = action_profile_id
+    return request
+
+def buildMeterReadRequest(device_id, meter_id):
+    "Reads the configuration of every cell of a meter"
+    request = buildReadRequest(device_id)
+    request.entities.add().meter_entry.meter_id = meter_id
+    return request
+
+def buildDigestReadRequest(device_id, digest_id):
+    "Reads the configuration of a digest, empty if it is not enabled"
+    request = buildReadRequest(device_id)
+    request.entities.add().digest_entry.digest_id = digest_id
+    return request
+
 def ShutdownAllSwitchConnections():
     for c in connections:
         c.shutdown()
@@ -42,9 +171,14 @@ class SwitchConnection(object):
             interceptor = GrpcRequestLogger(proto_dump_file)
             self.channel = grpc.intercept_channel(self.channel, interceptor)
         self.client_stub = p4runtime_pb2_grpc.P4RuntimeStub(self.channel)
-        self.requests_stream = IterableQueue()
+        self.requests_stream = IterableQueue(maxsize=STREAM_QUEUE_SIZE)
         self.stream_msg_resp = self.client_stub.StreamChannel(iter(self.requests_stream))
         self.proto_dump_file = proto_dump_file
+        self.stream_handlers = {message_type: [] for message_type in STREAM_MESSAGE_TYPES}
+        self.stream_handlers_lock = threading.Lock()
+        self.arbitration_responses = Queue()
+        self.stream_reader = threading.Thread(target=self._readStream, name='stream-%s' % name, daemon=True)
+        self.stream_reader.start()
         connections.append(self)
 
     @abstractmethod
@@ -54,95 +188,155 @@ class SwitchConnection(object):
     def shutdown(self):
         self.requests_stream.close()
         self.stream_msg_resp.cancel()
+        if self.stream_reader is not threading.current_thread():
+            self.stream_reader.join()
 
-    def MasterArbitrationUpdate(self, dry_run=False, **kwargs):
-        request = p4runtime_pb2.StreamMessageRequest()
-        request.arbitration.device_id = self.device_id
-        request.arbitration.election_id.high = 0
-        request.arbitration.election_id.low = 1
+    def AddStreamHandler(self, message_type, handler):
+        """
+        Calls handler(message) for every stream message of the given type, e.g. 'packet' or 'digest'
+        with the PacketIn or DigestList. Handlers run on the stream reader thread, in order:
+        they must hand long work over to another thread to not delay the following messages.
+        """
+        if message_type not in self.stream_handlers:
+            raise ValueError("unknown stream message type %r, expected one of %r" % (message_type, STREAM_MESSAGE_TYPES))
+        with self.stream_handlers_lock:
+            self.stream_handlers[message_type].append(handler)
+
+    def RemoveStreamHandler(self, message_type, handler):
+        with self.stream_handlers_lock:
+            self.stream_handlers[message_type].remove(handler)
 
+    def _readStream(self):
+        "Drains the stream channel for the whole life of the connection"
+        try:
+            for response in self.stream_msg_resp:
+                message_type = response.WhichOneof('update')
+                if message_type is None:
+                    continue
+                message = getattr(response, message_type)
+                if message_type == 'arbitration':
+                    self.arbitration_responses.put(response)
+                with self.stream_handlers_lock:
+                    handlers = list(self.stream_handlers[message_type])
+                for handler in handlers:
+                    try:
+                        handler(message)
+                    except Exception:
+                        logging.exception("%s handler failed on %s", message_type, self.name)
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.CANCELLED: # cancelled by shutdown()
+                logging.error("stream channel of %s closed: %s", self.name, e)
+
+    def MasterArbitrationUpdate(self, dry_run=False, **kwargs):
+        request = buildArbitrationRequest(self.device_id)
         if dry_run:
             print("P4Runtime MasterArbitrationUpdate: ", request)
         else:
             self.requests_stream.put(request)
-            for item in self.stream_msg_resp:
-                return item # just one
+            return self.arbitration_responses.get(timeout=ARBITRATION_TIMEOUT)
 
-    def SetForwardingPipelineConfig(self, p4info, dry_run=False, **kwargs):
-        device_config = self.buildDeviceConfig(**kwargs)
-        request = p4runtime_pb2.SetForwardingPipelineConfigRequest()
-        request.election_id.low = 1
-        request.device_id = self.device_id
-        config = request.config
+    def AckDigestList(self, digest_list, dry_run=False):
+        "Acknowledges a DigestList, letting the switch send the same digests again"
+        request = buildDigestAckRequest(digest_list)
+        if dry_run:
+            print("P4Runtime DigestListAck:", request)
+        else:
+            self.requests_stream.put(request)
 
-        config.p4info.CopyFrom(p4info)
-        config.p4_device_config = device_config.SerializeToString()
+    def PacketOut(self, packet_out, block=True, timeout=None, dry_run=False):
+        """
+        Queues a PacketOut for the stream channel. The queue is bounded: when the switch does not
+        keep up, this blocks (at most timeout seconds) or, if block is False, raises queue.Full.
+        """
+        request = buildPacketOutRequest(packet_out)
+        if dry_run:
+            print("P4Runtime PacketOut:", request)
+        else:
+            self.requests_stream.put(request, block=block, timeout=timeout)
 
-        request.action = p4runtime_pb2.SetForwardingPipelineConfigRequest.VERIFY_AND_COMMIT
+    def SetForwardingPipelineConfig(self, p4info, dry_run=False, **kwargs):
+        request = buildSetPipelineConfigRequest(self.device_id, p4info, self.buildDeviceConfig(**kwargs))
         if dry_run:
             print("P4Runtime SetForwardingPipelineConfig:", request)
         else:
             self.client_stub.SetForwardingPipelineConfig(request)
 
-    def WriteTableEntry(self, table_entry, dry_run=False):
-        request = p4runtime_pb2.WriteRequest()
-        request.device_id = self.device_id
-        request.election_id.low = 1
-        update = request.updates.add()
-        if table_entry.is_default_action:
-            update.type = p4runtime_pb2.Update.MODIFY
+    def GetForwardingPipelineConfig(self, dry_run=False):
+        request = buildGetPipelineConfigRequest(self.device_id)
+        if dry_run:
+            print("P4Runtime GetForwardingPipelineConfig:", request)
         else:
-            update.type = p4runtime_pb2.Update.INSERT
-        update.entity.table_entry.CopyFrom(table_entry)
+            return self.client_stub.GetForwardingPipelineConfig(request).config
+
+    def WriteUpdates(self, updates, dry_run=False):
+        "Sends several updates in a single (batched) Write request"
+        request = buildWriteRequest(self.device_id, updates)
         if dry_run:
             print("P4Runtime Write:", request)
         else:
             self.client_stub.Write(request)
 
-    def ReadTableEntries(self, table_id=None, dry_run=False):
-        request = p4runtime_pb2.ReadRequest()
-        request.device_id = self.device_id
-        entity = request.entities.add()
-        table_entry = entity.table_entry
-        if table_id is not None:
-            table_entry.table_id = table_id
-        else:
-            table_entry.table_id = 0
+    def WriteUpdatesFuture(self, updates, dry_run=False):
+        """
+        Sends a batched Write request without waiting for the reply: returns a grpc.Future
+        whose result() is the WriteResponse or raises the grpc.RpcError of the request
+        """
+        request = buildWriteRequest(self.device_id, updates)
         if dry_run:
-            print("P4Runtime Read:", request)
+            print("P4Runtime Write:", request)
         else:
-            for response in self.client_stub.Read(request):
-                yield response
+            return self.client_stub.Write.future(request)
 
-    def ReadCounters(self, counter_id=None, index=None, dry_run=False):
-        request = p4runtime_pb2.ReadRequest()
-        request.device_id = self.device_id
-        entity = request.entities.add()
-        counter_entry = entity.counter_entry
-        if counter_id is not None:
-            counter_entry.counter_id = counter_id
-        else:
-            counter_entry.counter_id = 0
-        if index is not None:
-            counter_entry.index.index = index
-        if dry_run:
-            print("P4Runtime Read:", request)
-        else:
-            for response in self.client_stub.Read(request):
-                yield response
+    def WriteTableEntry(self, table_entry, dry_run=False):
+        self.WriteUpdates([buildTableEntryUpdate(table_entry)], dry_run)
 
+    def ModifyTableEntry(self, table_entry, dry_run=False):
+        self.WriteUpdates([buildUpdate(table_entry, p4runtime_pb2.Update.MODIFY)], dry_run)
+
+    def DeleteTableEntry(self, table_entry, dry_run=False):
+        self.WriteUpdates([buildUpdate(table_entry, p4runtime_pb2.Update.DELETE)], dry_run)
+
+    def WriteMeterEntry(self, meter_entry, dry_run=False):
+        "Meter cells always exist, configuring them is a MODIFY"
+        self.WriteUpdates([buildUpdate(meter_entry, p4runtime_pb2.Update.MODIFY)], dry_run)
 
     def WritePREEntry(self, pre_entry, dry_run=False):
-        request = p4runtime_pb2.WriteRequest()
-        request.device_id = self.device_id
-        request.election_id.low = 1
-        update = request.updates.add()
-        update.type = p4runtime_pb2.Update.INSERT
-        update.entity.packet_replication_engine_entry.CopyFrom(pre_entry)
+        self.WriteUpdates([buildUpdate(pre_entry, p4runtime_pb2.Update.INSERT)], dry_run)
+
+    def DeletePREEntry(self, pre_entry, dry_run=False):
+        self.WriteUpdates([buildUpdate(pre_entry, p4runtime_pb2.Update.DELETE)], dry_run)
+
+    def _read(self, request, dry_run):
         if dry_run:
-            print("P4Runtime Write:", request)
-        else:
-            self.client_stub.Write(request)
+            print("P4Runtime Read:", request)
+            return
+        for response in self.client_stub.Read(request):
+            yield response
+
+    def ReadTableEntries(self, table_id=None, dry_run=False):
+        return self._read(buildTableReadRequest(self.device_id, table_id), dry_run)
+
+    def ReadCounters(self, counter_id=None, index=None, dry_run=False):
+        return self._read(buildCounterReadRequest(self.device_id, counter_id, index), dry_run)
+
+    def ReadRegisters(self, register_id=None, index=None, dry_run=False):
+        return self._read(buildRegisterReadRequest(self.device_id, register_id, index), dry_run)
+
+    def ReadPREEntries(self, dry_run=False):
+        "Reads all clone sessions and multicast groups, 0 being the wildcard ID"
+        return self._read(buildPREReadRequest(self.device_id), dry_run)
+
+    def ReadActionProfileEntries(self, action_profile_id, dry_run=False):
+        "Reads all members and groups of an action profile"
+        return self._read(buildActionProfileReadRequest(self.device_id, action_profile_id), dry_run)
+
+    def ReadMeters(self, meter_id, dry_run=False):
+        "Reads the configuration of every cell of a meter"
+        return self._read(buildMeterReadRequest(self.device_id, meter_id), dry_run)
+
+    def ReadDigestEntries(self, digest_id, dry_run=False):
+        "Reads the configuration of a digest, empty if it is not enabled"
+        return self._read(buildDigestReadRequest(self.device_id, digest_id), dry_run)
 
 class GrpcRequestLogger(grpc.UnaryUnaryClientInterceptor,
                         grpc.UnaryStreamClientInterceptor):
@@ -180,4 +374,217 @@ class IterableQueue(Queue):
         return iter(self.get, self._sentinel)
 
     def close(self):
-        self.put(self._sentinel)
+        "Ends the iteration, dropping pending messages if the queue is full"
+        while True:
+            try:
+                self.put_nowait(self._sentinel)
+                return
+            except Full:
+                try:
+                    self.get_nowait()
+                except Empty:
+                    pass
+
+class AsyncSwitchConnection(object):
+    """
+    asyncio counterpart of SwitchConnection on grpc.aio: the same calls as coroutines (async generators
+    for reads), the stream channel being drained by a task instead of a thread, so that one event loop
+    can drive many switches. It must be created, used and shut down on the same running event loop.
+    """
+
+    _sentinel = object()
+
+    def __init__(self, name=None, address='127.0.0.1:50051', device_id=0,
+                 proto_dump_file=None):
+        self.name = name
+        self.address = address
+        self.device_id = device_id
+        self.p4info = None
+        interceptors = None
+        if proto_dump_file is not None:
+            interceptors = [AsyncGrpcRequestLogger(proto_dump_file)]
+        self.channel = aio.insecure_channel(self.address, interceptors=interceptors)
+        self.client_stub = p4runtime_pb2_grpc.P4RuntimeStub(self.channel)
+        self.requests_stream = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.stream_msg_resp = self.client_stub.StreamChannel(self._streamRequests())
+        self.proto_dump_file = proto_dump_file
+        self.stream_handlers = {message_type: [] for message_type in STREAM_MESSAGE_TYPES}
+        self.arbitration_responses = asyncio.Queue()
+        self.stream_reader = asyncio.get_running_loop().create_task(self._readStream(), name='stream-%s' % name)
+
+    @abstractmethod
+    def buildDeviceConfig(self, **kwargs):
+        return p4config_pb2.P4DeviceConfig()
+
+    async def shutdown(self):
+        # end the request stream, dropping pending messages if the queue is full
+        while True:
+            try:
+                self.requests_stream.put_nowait(self._sentinel)
+                break
+            except asyncio.QueueFull:
+                self.requests_stream.get_nowait()
+        self.stream_msg_resp.cancel()
+        if self.stream_reader is not asyncio.current_task():
+            await self.stream_reader
+        await self.channel.close()
+
+    def AddStreamHandler(self, message_type, handler):
+        """
+        Calls handler(message) for every stream message of the given type, e.g. 'packet' or 'digest'.
+        Handlers may be coroutine functions; they run on the stream reader task, in order, and are awaited
+        before the next message is read.
+        """
+        if message_type not in self.stream_handlers:
+            raise ValueError("unknown stream message type %r, expected one of %r" % (message_type, STREAM_MESSAGE_TYPES))
+        self.stream_handlers[message_type].append(handler)
+
+    def RemoveStreamHandler(self, message_type, handler):
+        self.stream_handlers[message_type].remove(handler)
+
+    async def _streamRequests(self):
+        while True:
+            request = await self.requests_stream.get()
+            if request is self._sentinel:
+                return
+            yield request
+
+    async def _readStream(self):
+        "Drains the stream channel for the whole life of the connection"
+        try:
+            async for response in self.stream_msg_resp:
+                message_type = response.WhichOneof('update')
+                if message_type is None:
+                    continue
+                message = getattr(response, message_type)
+                if message_type == 'arbitration':
+                    self.arbitration_responses.put_nowait(response)
+                for handler in list(self.stream_handlers[message_type]):
+                    try:
+                        result = handler(message)
+                        if inspect.isawaitable(result):
+                            await result
+                    except Exception:
+                        logging.exception("%s handler failed on %s", message_type, self.name)
+        except asyncio.CancelledError:
+            pass # cancelled by shutdown()
+        except grpc.RpcError as e:
+            if e.code() != grpc.StatusCode.CANCELLED:
+                logging.error("stream channel of %s closed: %s", self.name, e)
+
+    async def MasterArbitrationUpdate(self, dry_run=False, **kwargs):
+        request = buildArbitrationRequest(self.device_id)
+        if dry_run:
+            print("P4Runtime MasterArbitrationUpdate: ", request)
+        else:
+            await self.requests_stream.put(request)
+            return await asyncio.wait_for(self.arbitration_responses.get(), ARBITRATION_TIMEOUT)
+
+    async def AckDigestList(self, digest_list, dry_run=False):
+        "Acknowledges a DigestList, letting the switch send the same digests again"
+        request = buildDigestAckRequest(digest_list)
+        if dry_run:
+            print("P4Runtime DigestListAck:", request)
+        else:
+            await self.requests_stream.put(request)
+
+    async def PacketOut(self, packet_out, block=True, timeout=None, dry_run=False):
+        """
+        Queues a PacketOut for the stream channel. The queue is bounded: when the switch does not
+        keep up, this waits (at most timeout seconds) or, if block is False, raises asyncio.QueueFull.
+        """
+        request = buildPacketOutRequest(packet_out)
+        if dry_run:
+            print("P4Runtime PacketOut:", request)
+        elif not block:
+            self.requests_stream.put_nowait(request)
+        else:
+            await asyncio.wait_for(self.requests_stream.put(request), timeout)
+
+    async def SetForwardingPipelineConfig(self, p4info, dry_run=False, **kwargs):
+        request = buildSetPipelineConfigRequest(self.device_id, p4info, self.buildDeviceConfig(**kwargs))
+        if dry_run:
+            print("P4Runtime SetForwardingPipelineConfig:", request)
+        else:
+            await self.client_stub.SetForwardingPipelineConfig(request)
+
+    async def GetForwardingPipelineConfig(self, dry_run=False):
+        request = buildGetPipelineConfigRequest(self.device_id)
+        if dry_run:
+            print("P4Runtime GetForwardingPipelineConfig:", request)
+        else:
+            return (await self.client_stub.GetForwardingPipelineConfig(request)).config
+
+    async def WriteUpdates(self, updates, dry_run=False):
+        "Sends several updates in a single (batched) Write request"
+        request = buildWriteRequest(self.device_id, updates)
+        if dry_run:
+            print("P4Runtime Write:", request)
+        else:
+            await self.client_stub.Write(request)
+
+    async def WriteTableEntry(self, table_entry, dry_run=False):
+        await self.WriteUpdates([buildTableEntryUpdate(table_entry)], dry_run)
+
+    async def ModifyTableEntry(self, table_entry, dry_run=False):
+        await self.WriteUpdates([buildUpdate(table_entry, p4runtime_pb2.Update.MODIFY)], dry_run)
+
+    async def DeleteTableEntry(self, table_entry, dry_run=False):
+        await self.WriteUpdates([buildUpdate(table_entry, p4runtime_pb2.Update.DELETE)], dry_run)
+
+    async def WriteMeterEntry(self, meter_entry, dry_run=False):
+        "Meter cells always exist, configuring them is a MODIFY"
+        await self.WriteUpdates([buildUpdate(meter_entry, p4runtime_pb2.Update.MODIFY)], dry_run)
+
+    async def WritePREEntry(self, pre_entry, dry_run=False):
+        await self.WriteUpdates([buildUpdate(pre_entry, p4runtime_pb2.Update.INSERT)], dry_run)
+
+    async def DeletePREEntry(self, pre_entry, dry_run=False):
+        await self.WriteUpdates([buildUpdate(pre_entry, p4runtime_pb2.Update.DELETE)], dry_run)
+
+    async def _read(self, request, dry_run):
+        if dry_run:
+            print("P4Runtime Read:", request)
+            return
+        async for response in self.client_stub.Read(request):
+            yield response
+
+    def ReadTableEntries(self, table_id=None, dry_run=False):
+        return self._read(buildTableReadRequest(self.device_id, table_id), dry_run)
+
+    def ReadCounters(self, counter_id=None, index=None, dry_run=False):
+        return self._read(buildCounterReadRequest(self.device_id, counter_id, index), dry_run)
+
+    def ReadRegisters(self, register_id=None, index=None, dry_run=False):
+        return self._read(buildRegisterReadRequest(self.device_id, register_id, index), dry_run)
+
+    def ReadPREEntries(self, dry_run=False):
+        "Reads all clone sessions and multicast groups, 0 being the wildcard ID"
+        return self._read(buildPREReadRequest(self.device_id), dry_run)
+
+    def ReadActionProfileEntries(self, action_profile_id, dry_run=False):
+        "Reads all members and groups of an action profile"
+        return self._read(buildActionProfileReadRequest(self.device_id, action_profile_id), dry_run)
+
+    def ReadMeters(self, meter_id, dry_run=False):
+        "Reads the configuration of every cell of a meter"
+        return self._read(buildMeterReadRequest(self.device_id, meter_id), dry_run)
+
+    def ReadDigestEntries(self, digest_id, dry_run=False):
+        "Reads the configuration of a digest, empty if it is not enabled"
+        return self._read(buildDigestReadRequest(self.device_id, digest_id), dry_run)
+
+class AsyncGrpcRequestLogger(aio.UnaryUnaryClientInterceptor,
+                             aio.UnaryStreamClientInterceptor):
+    """grpc.aio flavour of GrpcRequestLogger"""
+
+    def __init__(self, log_file):
+        self.logger = GrpcRequestLogger(log_file)
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        self.logger.log_message(client_call_details.method, request)
+        return await continuation(client_call_details, request)
+
+    async def intercept_unary_stream(self, continuation, client_call_details, request):
+        self.logger.log_message(client_call_details.method, request)
+        return await continuation(client_call_details, request)
@@ -39,6 +39,7 @@ class P4RuntimeSwitch(P4Switch):
                  device_id = None,
                  enable_debugger = False,
                  log_file = None,
+                 cpu_port = None,
                  **kwargs):
         Switch.__init__(self, name, **kwargs)
         assert (sw_path)
@@ -55,6 +56,9 @@ class P4RuntimeSwitch(P4Switch):
         else:
             self.json_path = None
 
+        # port connected to the P4Runtime packet-in/packet-out, None for none
+        self.cpu_port = cpu_port
+
         if grpc_port is not None:
             self.grpc_port = grpc_port
         else:
@@ -122,6 +126,8 @@ class P4RuntimeSwitch(P4Switch):
             args.append('--thrift-port ' + str(self.thrift_port))
         if self.grpc_port:
             args.append("-- --grpc-server-addr 0.0.0.0:" + str(self.grpc_port))
+            if self.cpu_port is not None:
+                args.append("--cpu-port " + str(self.cpu_port))
         cmd = ' '.join(args)
         info(cmd + "\n")
 
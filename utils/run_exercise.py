@@ -33,6 +33,9 @@ from mininet.topo import Topo
 from p4_mininet import P4Host, P4Switch
 from p4runtime_switch import P4RuntimeSwitch
 
+# port of the P4Runtime packet-in/packet-out, must match CPU_PORT in the P4 programs
+CPU_PORT = 255
+
 
 def configureP4Switch(**switch_args):
     """ Helper class that is called by mininet to initialize
@@ -43,6 +46,7 @@ def configureP4Switch(**switch_args):
         # If grpc appears in the BMv2 switch target, we assume will start P4Runtime
         class ConfiguredP4RuntimeSwitch(P4RuntimeSwitch):
             def __init__(self, *opts, **kwargs):
+                kwargs.setdefault('cpu_port', CPU_PORT)
                 kwargs.update(switch_args)
                 P4RuntimeSwitch.__init__(self, *opts, **kwargs)
 